@@ -9,6 +9,15 @@ CIVIAI_API_KEY=""
 HUGGINGFACE_TOKEN=""
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
 POD_MANAGER_URL = "https://models.chenyu.cn"
+LOCAL_CACHE_DIR_NAME = ".chenyu-pod-tools"   # 客户端本地缓存目录（位于应用目录下）
+HASH_CACHE_FILE_NAME = "hash_cache.db"       # 文件哈希缓存
+LOOKUP_CACHE_FILE_NAME = "lookup_cache.db"   # C站/晨羽缓存查询结果缓存
+
+# 云端节点共享缓存目录（Git 镜像等），可通过环境变量覆盖
+POD_CACHE_DIR = os.environ.get("CHENYU_POD_CACHE_DIR", "/mnt/chenyu-nvme/pod-cache")
+
+def get_local_cache_dir(app_dir):
+    return os.path.join(app_dir, LOCAL_CACHE_DIR_NAME)
 
 class AppType:
     def __init__(self, 
@@ -1,10 +1,20 @@
+import argparse
 import json
 import logging
 import os.path
-import zipfile
+import sys
 
-from const.app_config import PodConfig, get_app_type_by_identity_key, CIVIAI_API_KEY
-from utils.util import clone_and_checkout, download_file, path_cover, query_cache_path, link_file
+from const.app_config import PodConfig, get_app_type_by_identity_key, CIVIAI_API_KEY, POD_CACHE_DIR
+from utils.env_restore import restore_packages
+from utils.env_template import EnvTemplateStore, restore_environment, ENV_TEMPLATE_MAX_BYTES
+from utils.link_plan import build_link_plan, apply_link_plan, verify_link_plan, resolve_cache_paths, unavailable_models, \
+    DEFAULT_LINK_WORKERS
+from utils.git_mirror import GitMirrorCache, MIRROR_MAX_IDLE_SECONDS
+from utils.plugin_restore import restore_plugins, DEFAULT_PLUGIN_WORKERS
+from utils.pod_delta import apply_delta
+from utils.pod_extract import read_pod_config, extract_pod, DEFAULT_EXTRACT_WORKERS
+from utils.task_graph import TaskGraph, write_timeline
+from utils.util import download_file, path_cover
 
 logging.basicConfig(filename='pod-cloud.log',
                     level=logging.INFO,
@@ -14,64 +24,146 @@ def load_pod_from_json(file_path: str) -> PodConfig:
     with open(file_path, 'r') as file:
         json_data = json.load(file)  # 读取 JSON 文件
     return PodConfig(**json_data)  # 使用 Pydantic 将字典转换为对象
-base_dir = "/poddata/ComfyUI"
 
-if __name__ == "__main__":
-    """读取当前pod压缩文件并解压到/poddata"""
-    print("解压pod.zip开始")
-    with zipfile.ZipFile(os.path.join(base_dir,"pod.zip"), 'r') as zip_ref:
-        zip_ref.extractall(base_dir)
-    print("解压pod.zip结束")
-    """判断配置文件并解析为PODConfig对象"""
-    pod_config = load_pod_from_json(os.path.join(base_dir,"pod_config.json"))
+def print_link_report(report, pod_config, dry_run=False):
+    unavailable = unavailable_models(pod_config)
+    for model in unavailable:
+        print(f'未缓存,跳过软连接:{model.model_name}({model.sha256}) {",".join(model.file_path)}')
+    for problem in report["problems"]:
+        print(f'{"悬空" if problem["status"] == "dangling" else "冲突"}:{problem["target"]}->{problem["source"]}')
+    print(f'软连接共{report["total"]}个,{"待创建" if dry_run else "新建"}'
+          f'{report["missing"] if dry_run else report["created"]}个,已存在{report["ok"]}个,'
+          f'悬空{report["dangling"]}个,冲突{report["conflict"]}个,未缓存模型{len(unavailable)}个,耗时{report["seconds"]}s')
+    return unavailable
+base_dir = "/poddata/ComfyUI"
 
-    print(f'类型: {pod_config.app_type}')
-    app_config_val = get_app_type_by_identity_key(pod_config.app_type)
+def restore_model_files(pod_file, delta_file, app_config_val, args):
     cloud_app_dir = app_config_val.cloud_app_dir
+    if os.path.exists(delta_file):
+        """存在增量包时，在已有的/poddata上应用增量"""
+        print("应用增量包pod_delta.zip开始")
+        applied = apply_delta(delta_file, base_dir, os.path.join(cloud_app_dir, app_config_val.model_dir))
+        print(f"应用增量包pod_delta.zip结束{'' if applied else '（已应用过，跳过）'}")
+    else:
+        """把模型直接解压到/poddata下的最终位置，同时软连接到应用目录"""
+        print("解压pod.zip开始")
+        _, extract_stats = extract_pod(pod_file, base_dir, os.path.join(cloud_app_dir, app_config_val.model_dir),
+                                       args.extract_workers)
+        print(f'解压pod.zip结束,解压{extract_stats["files"]}个,跳过已存在{extract_stats["skipped"]}个,'
+              f'{extract_stats["bytes"] / 1024 / 1024:.1f}MB,耗时{extract_stats["seconds"]}s,'
+              f'{extract_stats["mb_per_second"]}MB/s')
 
-    # 处理插件
-    plugins_dir = os.path.join(cloud_app_dir,app_config_val.plugin_dir)
+def restore_plugin_files(pod_config, plugins_dir, mirror_cache, args):
     print(f'插件目录:{plugins_dir}')
-    for plugin in pod_config.plugins:
-        print(f'插件:{plugin.name}')
-        clone_and_checkout(plugin.remote_url,plugin.commit_log,plugins_dir)
+    report_file = os.path.join(base_dir, "plugin_restore_report.json")
+    report = restore_plugins(pod_config.plugins, plugins_dir, args.plugin_workers, report_file, mirror_cache)
+    for record in report["plugins"]:
+        print(f'插件:{record["name"]} {"成功(" + record["mode"] + ")" if record["ok"] else "失败"} {record["seconds"]}s')
+    print(f'插件恢复完成,成功{report["ok"]}个,失败{report["failed"]}个,耗时{report["seconds"]}s,报告:{report_file}')
+    return report
+
+def restore_python_packages(pod_config, args):
+    print(f'安装依赖,共{len(pod_config.packages)}个,wheel仓库:{args.wheelhouse}')
+    if args.no_env_template:
+        env_report = restore_packages(pod_config.python, pod_config.packages, args.wheelhouse)
+    else:
+        env_store = EnvTemplateStore(args.env_template_dir, args.env_template_max_gb * 1024 ** 3)
+        env_report = restore_environment(pod_config.python, pod_config.packages, args.wheelhouse, env_store)
+        print(f'环境模板:{env_report["template"]},淘汰模板{len(env_report["evicted"])}个')
+    for requirement in env_report["failed"]:
+        print(f'依赖编译失败:{requirement}')
+    for requirement in env_report["skipped"]:
+        print(f'依赖跳过(本地文件或无法识别):{requirement}')
+    print(f'依赖安装完成,安装{env_report["installed"]}个,新编译{env_report["built"]}个,'
+          f'失败{len(env_report["failed"])}个,耗时{env_report["seconds"]}s')
+    return env_report
+
+def link_models(pod_config, app_config_val, args):
+    """缓存存在就用缓存做软连接，其他的就用客户上传的模型做软连接，再映射到应用目录下"""
+    cloud_app_dir = app_config_val.cloud_app_dir
+    print(f'模型软连接,模型目录:{os.path.join(cloud_app_dir,app_config_val.model_dir)}')
+    plan = build_link_plan(resolve_cache_paths(pod_config), base_dir, cloud_app_dir, app_config_val.model_dir)
+    report = apply_link_plan(plan, args.link_workers)
+    print_link_report(report, pod_config)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='晨羽POD云端恢复。')
+    parser.add_argument('--plugin_workers', type=int, default=DEFAULT_PLUGIN_WORKERS,
+                        help=f'并发恢复插件的线程数，默认 {DEFAULT_PLUGIN_WORKERS}。')
+    parser.add_argument('--git_mirror_dir', default=os.path.join(POD_CACHE_DIR, "git-mirrors"),
+                        help='节点共享的插件 Git 镜像目录。')
+    parser.add_argument('--no_git_mirror', action='store_true', help='不使用 Git 镜像，直接从远端拉取插件。')
+    parser.add_argument('--git_mirror_max_idle_days', type=int, default=MIRROR_MAX_IDLE_SECONDS // 86400,
+                        help='清理超过该天数未使用的 Git 镜像。')
+    parser.add_argument('--extract_workers', type=int, default=DEFAULT_EXTRACT_WORKERS,
+                        help=f'并发解压模型的线程数，默认 {DEFAULT_EXTRACT_WORKERS}。')
+    parser.add_argument('--wheelhouse', default=os.path.join(POD_CACHE_DIR, "wheelhouse"),
+                        help='节点共享的 wheel 仓库目录，恢复依赖时优先从这里离线安装。')
+    parser.add_argument('--env_template_dir', default=os.path.join(POD_CACHE_DIR, "env-templates"),
+                        help='节点共享的 Python 环境模板目录，依赖一致或相近时直接复用已构建的环境。')
+    parser.add_argument('--no_env_template', action='store_true', help='不使用环境模板，直接安装依赖。')
+    parser.add_argument('--env_template_max_gb', type=int, default=ENV_TEMPLATE_MAX_BYTES // 1024 ** 3,
+                        help='环境模板目录的容量上限(GB)，超出时淘汰最久未使用的模板。')
+    parser.add_argument('--link_workers', type=int, default=DEFAULT_LINK_WORKERS,
+                        help=f'并发创建模型软连接的线程数，默认 {DEFAULT_LINK_WORKERS}。')
+    parser.add_argument('--dry_run', '--dry-run', action='store_true',
+                        help='只生成并检查模型软连接计划，列出将要创建、悬空及冲突的软连接，不做任何修改。')
+    parser.add_argument('--verify', action='store_true', help='只检查已恢复的模型软连接，有缺失、悬空或冲突时返回非 0。')
+    parser.add_argument('--network_slots', type=int, default=3, help='同时占用网络的恢复任务数上限，默认 3。')
+    parser.add_argument('--disk_slots', type=int, default=2, help='同时大量读写磁盘的恢复任务数上限，默认 2。')
+    parser.add_argument('--cpu_slots', type=int, default=os.cpu_count() or 1, help='同时占用 CPU 的恢复任务数上限，默认 CPU 核数。')
+    args = parser.parse_args()
+
+    if args.dry_run or args.verify:
+        config_file = os.path.join(base_dir,"pod_config.json")
+        if os.path.exists(config_file):
+            pod_config = load_pod_from_json(config_file)
+        else:
+            pod_config = read_pod_config(os.path.join(base_dir,"pod.zip"))
+        app_config_val = get_app_type_by_identity_key(pod_config.app_type)
+        plan = build_link_plan(resolve_cache_paths(pod_config), base_dir, app_config_val.cloud_app_dir, app_config_val.model_dir)
+        report = verify_link_plan(plan, args.link_workers)
+        unavailable = print_link_report(report, pod_config, dry_run=args.dry_run)
+        sys.exit(1 if report["problems"] or (args.verify and (report["missing"] or unavailable)) else 0)
+
+    delta_file = os.path.join(base_dir, "pod_delta.zip")
+    pod_file = os.path.join(base_dir, "pod.zip")
+    state = {}
+
+    def read_manifest():
+        """只读取压缩包中的配置（增量包中是新配置），插件、依赖和模型的恢复都只依赖配置"""
+        state["pod_config"] = read_pod_config(delta_file if os.path.exists(delta_file) else pod_file)
+        state["app_config_val"] = get_app_type_by_identity_key(state["pod_config"].app_type)
+        print(f'类型: {state["pod_config"].app_type}')
+
+    mirror_cache = None
+    if not args.no_git_mirror:
+        mirror_cache = GitMirrorCache(args.git_mirror_dir, args.git_mirror_max_idle_days * 86400)
+        print(f'插件Git镜像目录:{args.git_mirror_dir}')
 
-    # 安装依赖
-    print(f'安装依赖')
-    for package in pod_config.packages:
-        print(f'安装依赖:{package.name}')
-        if package.name is not None and package.version is not None and str.startswith(package.name,'jupyter'):
-            os.system(f'{pod_config.python} -m pip install {package.name}=={package.version}')
+    def finalize():
+        if mirror_cache is not None:
+            print(f'Git镜像命中{mirror_cache.hits}个,更新{mirror_cache.misses}个,清理过期镜像{len(mirror_cache.expire())}个')
 
-    # 处理模型,缓存不存在，C站存在就下载，缓存存在就用缓存做软连接，其他的就用客户上传的模型做软连接
-    print(f'模型预处理,模型目录:{os.path.join(cloud_app_dir,app_config_val.model_dir)}')
-    for model in pod_config.models:
-        # 模型默认路径是客户上传的模型
-        model_file = os.path.join(base_dir,"models",model.file_path[0])
-        # C站缓存在客户端处理的时候已经添加到模型管理了，在这里只需要查询下缓存文件路径即可
-        if model.cache_path is None and model.download_url is not None:
-            model.cache_path = query_cache_path(model.sha256)
-        # 如果缓存存在就使用缓存文件
-        if model.cache_path is not None:
-            link_file(model.cache_path,model_file)
-            model_file = model.cache_path
-        #处理软连接
-        if len(model.file_path) > 1:
-            print(f'缓存模型:{model.cache_path}')
-            for i in range(1,len(model.file_path)):
-                target_model_file = os.path.join(base_dir,"models",model.file_path[i])
-                print(f'重复模型,软连接:{model_file}->{target_model_file}')
-                link_file(model_file,target_model_file)
-    # print(f'模型预处理完成')
-    print(f'模型映射:把/poddata下的模型及软连接，再次软连接到应用目录下')
-    for root_dir, dirs, files in os.walk(os.path.join(base_dir,app_config_val.model_dir)):
-        for file in files:
-            if os.path.isdir(file):
-                print(f'创建目录:{os.path.join(cloud_app_dir,app_config_val.model_dir,file)}')
-                os.mkdir(os.path.join(cloud_app_dir,app_config_val.model_dir,root_dir,file))
-            else:
-                print(os.path.join(root_dir, file))
-                source_file = os.path.join(root_dir,file)
-                target_file = os.path.join(cloud_app_dir,os.path.relpath(source_file,base_dir))
-                print(f'软连接:{source_file}->{target_file}')
-                link_file(source_file,target_file)
+    # 读取配置 -> (恢复插件 ∥ 安装依赖 ∥ 解压模型 -> 模型软连接) -> 收尾
+    graph = TaskGraph({"network": args.network_slots, "disk": args.disk_slots, "cpu": args.cpu_slots})
+    graph.add("manifest", read_manifest, resources=["disk"])
+    graph.add("plugins", lambda: restore_plugin_files(
+        state["pod_config"], os.path.join(state["app_config_val"].cloud_app_dir, state["app_config_val"].plugin_dir),
+        mirror_cache, args), deps=["manifest"], resources=["network"])
+    graph.add("packages", lambda: restore_python_packages(state["pod_config"], args),
+              deps=["manifest"], resources=["network", "cpu"])
+    graph.add("models", lambda: restore_model_files(pod_file, delta_file, state["app_config_val"], args),
+              deps=["manifest"], resources=["disk"])
+    graph.add("links", lambda: link_models(state["pod_config"], state["app_config_val"], args),
+              deps=["models"], resources=["network", "disk"])
+    graph.add("finalize", finalize, deps=["plugins", "packages", "links"])
+    timeline = graph.run()
+    timeline_file = os.path.join(base_dir, "restore_timeline.json")
+    write_timeline(timeline_file, timeline)
+    for task in timeline["tasks"]:
+        print(f'任务:{task["name"]} {task["status"]} {task["seconds"]}s{" " + task["error"] if task["error"] else ""}')
+    print(f'恢复完成,耗时{timeline["seconds"]}s,关键路径:{"->".join(timeline["critical_path"])},时间线:{timeline_file}')
+    if graph.errors():
+        sys.exit(1)
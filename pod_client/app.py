@@ -8,9 +8,14 @@ from tkinter.filedialog import askdirectory, askopenfilename
 import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
 from ttkbootstrap import Style
-from const.app_config import get_app_type, Plugin, PythonPackage, Model, PodConfig
-from utils.util import get_git_repo_info, parse_python_packages, calculate_sha256, get_os, civitai_query_model, \
-    query_cache_path, open_file_or_directory, add_models
+from const.app_config import get_app_type, Plugin, PythonPackage, Model, PodConfig, get_local_cache_dir, \
+    HASH_CACHE_FILE_NAME, LOOKUP_CACHE_FILE_NAME
+from utils.civitai import CivitaiResolver
+from utils.hash_cache import HashCache
+from utils.hash_engine import iter_sha256
+from utils.lookup_cache import LookupCache
+from utils.util import get_git_repo_info, parse_python_packages, get_os, \
+    query_cache_paths, open_file_or_directory, add_models_batch
 
 
 class App:
@@ -215,27 +220,45 @@ class App:
             for file in files:
                 file_list.append(os.path.join(root_dir, file))
         self.log_text.insert("1.0", f"【提示】模型目录：{self.model_dir.get()},共需要处理模型{len(file_list)}个\n")
-        
-        for index, model_path in enumerate(file_list):
+        hash_cache = HashCache(os.path.join(get_local_cache_dir(self.app_dir.get()), HASH_CACHE_FILE_NAME))
+
+        for index, (model_path, sha256) in enumerate(iter_sha256(file_list, hash_cache=hash_cache)):
             progress = (index + 1) / len(file_list) * 100
             self.update_progress(progress, f"处理模型 {index + 1}/{len(file_list)}")
             model_name = os.path.basename(model_path)
             self.log_text.insert("1.0", f"【提示】处理模型[{index + 1}/{len(file_list)}]：{model_path}\n")
-            sha256 = calculate_sha256(model_path)
-            model_id, download_url = civitai_query_model(sha256)
-            cache_path = query_cache_path(sha256)
-            if cache_path is None and download_url is not None:
-                # 云端不存在，C站存在，添加到云端
-                add_models(sha256)
             model_relpath = os.path.relpath(model_path, self.model_dir.get())
             # 将model_relpath转换为linux路径格式
             model_relpath = os.path.normpath(model_relpath).replace('\\', '/')
             if sha256 not in self.models:
-                self.models[sha256] = Model(model_name=model_name, model_id=model_id, sha256=sha256, cache_path=cache_path, file_path = [model_relpath], download_url= download_url)
+                self.models[sha256] = Model(model_name=model_name, model_id=None, sha256=sha256, cache_path=None, file_path = [model_relpath], download_url= None)
             else:
                 self.log_text.insert("1.0", f"【警告】重复模型：{model_name}，只记录路径，后续做映射\n")
                 self.models[sha256].file_path.append(model_relpath)
-            self.log_text.insert("1.0", f"【提示】模型信息[{index + 1}/{len(file_list)}]：{self.models.get(sha256)}\n")
+        hash_cache.prune(file_list)
+        hash_cache.close()
+        # 并发查询C站模型信息，查询结果缓存在本地
+        lookup_cache = LookupCache(os.path.join(get_local_cache_dir(self.app_dir.get()), LOOKUP_CACHE_FILE_NAME))
+        resolver = CivitaiResolver(lookup_cache=lookup_cache)
+        self.log_text.insert("1.0", f"【提示】查询C站模型信息，共{len(self.models)}个模型\n")
+        for sha256, (model_id, download_url) in resolver.resolve_many(list(self.models.keys())).items():
+            self.models[sha256].model_id = model_id
+            self.models[sha256].download_url = download_url
+        # 批量查询云端缓存，云端不存在、C站存在的模型批量添加到云端
+        self.log_text.insert("1.0", f"【提示】批量查询云端缓存，共{len(self.models)}个模型\n")
+        cache_paths = query_cache_paths(list(self.models.keys()), lookup_cache=lookup_cache, use_filter=True)
+        need_add = []
+        for sha256, model in self.models.items():
+            model.cache_path = cache_paths.get(sha256)
+            if model.cache_path is None and model.download_url is not None:
+                need_add.append(sha256)
+        add_models_batch(need_add)
+        self.log_text.insert("1.0", f"【提示】云端已缓存{len(cache_paths)}个，需添加到云端{len(need_add)}个\n")
+        self.log_text.insert("1.0", f"【提示】查询缓存命中{lookup_cache.hits}次，未命中{lookup_cache.misses}次\n")
+        lookup_cache.close()
+        for index, model in enumerate(self.models.values()):
+            self.log_text.insert("1.0", f"【提示】模型信息[{index + 1}/{len(self.models)}]：{model}\n")
+        self.log_text.insert("1.0", f"【提示】哈希缓存命中{hash_cache.hits}个，重新计算{hash_cache.misses}个\n")
         self.log_text.insert("1.0", f"【提示】模型处理完成\n")
 
     def pack_files(self):
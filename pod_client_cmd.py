@@ -6,9 +6,18 @@ import time
 import zipfile
 import datetime
 
-from const.app_config import PodConfig, Model, Plugin, PythonPackage
-from utils.util import calculate_sha256, civitai_query_model, query_cache_path, add_models, get_git_repo_info, \
-    parse_python_packages
+from const.app_config import PodConfig, Model, Plugin, PythonPackage, get_local_cache_dir, HASH_CACHE_FILE_NAME, \
+    LOOKUP_CACHE_FILE_NAME
+from utils.archive import ModelZipWriter
+from utils.civitai import CivitaiResolver, set_civitai_resolver, get_civitai_resolver, CIVITAI_BY_HASH_URL, \
+    CIVITAI_PROXY_URL
+from utils.hash_cache import HashCache
+from utils.hash_engine import DEFAULT_HASH_WORKERS
+from utils.lookup_cache import LookupCache
+from utils.pipeline import Pipeline
+from utils.pod_delta import uploaded_models, build_delta_manifest, config_fingerprint, DELTA_MANIFEST_NAME
+from utils.util import HASH_BUFFER_SIZE, MANAGER_BATCH_SIZE, query_cache_paths, add_models_batch, \
+    get_git_repo_info, parse_python_packages, read_git_head
 
 
 
@@ -23,6 +32,19 @@ pod_config = PodConfig(
     plugins=list(),
     packages=list(),
 )
+# 本地文件哈希缓存，init 时创建
+hash_cache = None
+# 哈希计算并发数及读取缓冲区大小
+hash_workers = DEFAULT_HASH_WORKERS
+hash_buffer_size = HASH_BUFFER_SIZE
+# C站/晨羽缓存查询结果的本地缓存，--no-lookup-cache 时为 None
+lookup_cache = None
+# C站查询并发数及每秒请求数
+civitai_workers = 8
+civitai_rate = 5.0
+civitai_direct = False
+# 单次读取模式：不小于该大小且哈希缓存未命中的模型边计算哈希边打包，None 表示关闭
+single_pass_min_size = None
 
 def reset_timestamp_if_needed(file_path):
     """
@@ -39,54 +61,171 @@ def load_python_info(python_executable):
     python_version = subprocess.run([python_executable, '--version'], stdout=subprocess.PIPE, text=True).stdout.strip()
     return python_version
 
-# 加载模型
-def load_models():
-    file_list = []
+def walk_models():
+    """遍历模型目录（按名称排序，保证多次运行顺序一致），产出 (序号, 文件路径)"""
+    index = 0
     for root_dir, dirs, files in os.walk(pod_config.model_dir):
-        for file in files:
-            file_list.append(os.path.join(root_dir, file))
-    print( f"共需要处理模型{len(file_list)}个")
-    models = {}
-    for index, model_path in enumerate(file_list):
-        model_name = os.path.basename(model_path)
-        print(f"【提示】处理模型[{index + 1}/{len(file_list)}]：{model_path}")
-        sha256 = calculate_sha256(model_path)
-        model_id, download_url = civitai_query_model(sha256)
-        cache_path = query_cache_path(sha256)
-        if cache_path is None and download_url is not None:
+        dirs.sort()
+        for file in sorted(files):
+            yield index, os.path.join(root_dir, file)
+            index += 1
+
+def resolve_models(new_models):
+    """批量查询云端缓存；云端不存在的再并发查询 C站，云端不存在、C站存在的批量添加到云端"""
+    cache_paths = query_cache_paths([model.sha256 for model in new_models], lookup_cache=lookup_cache, use_filter=True)
+    uncached = [model for model in new_models if cache_paths.get(model.sha256) is None]
+    civitai_info = get_civitai_resolver().resolve_many([model.sha256 for model in uncached])
+    need_add = []
+    for model in new_models:
+        model.cache_path = cache_paths.get(model.sha256)
+    for model in uncached:
+        model.model_id, model.download_url = civitai_info[model.sha256]
+        if model.download_url is not None:
             # 云端不存在，C站存在，添加到云端
-            add_models(sha256)
-        model_relpath = os.path.relpath(model_path, pod_config.model_dir)
+            need_add.append(model.sha256)
+    add_models_batch(need_add)
 
-        if sha256 not in models:
-            models[sha256] = Model(model_name=model_name, model_id=model_id, sha256=sha256, cache_path=cache_path, file_path = [model_relpath], download_url= download_url)
-        else:
-            print(f"【警告】重复模型：{model_name}，只记录路径，后续做映射\n")
-            models[sha256].file_path.append(model_relpath)
-        print(f"【提示】模型信息[{index + 1}/{len(file_list)}]：{models.get(sha256)}\n")
-    pod_config.models = list(models.values())
-
-def load_plugins():
+# 加载模型并打包
+def load_models(z, base_config=None):
+    """
+    流式处理模型：遍历 → 计算哈希 → 批量查询 → 打包，各阶段同时进行，阶段间通过有界队列背压
+    第一个哈希算完即开始查询，确认需要上传的模型立即写入压缩包，总耗时接近最慢的单个阶段
+    :param base_config: 增量模式下上一次的配置，已有的模型直接复用记录不再查询，已上传过的模型不再打包
+    """
+    models = {}         # sha256 -> Model
+    file_index = {}     # 模型相对路径 -> 遍历顺序
+    model_paths = []    # 本次遍历到的所有文件
+    # 已查询过的模型 sha256 -> Model（单次读取模式查询的结果及增量模式上一次的记录）
+    resolved = {model.sha256: model for model in base_config.models} if base_config is not None else {}
+    # 增量模式下已经上传过的模型
+    base_uploaded = uploaded_models(base_config) if base_config is not None else {}
+    writer = ModelZipWriter(z, hash_buffer_size)
+
+    def need_upload(model):
+        return model.cache_path is None and model.download_url is None and model.sha256 not in base_uploaded
+
+    def single_pass(model_path, model_relpath):
+        """边计算哈希边打包，读完后查询，确认需要上传才保留压缩包条目"""
+        def decide(sha256):
+            if sha256 not in resolved:
+                probe = Model(model_name=os.path.basename(model_path), model_id=None, sha256=sha256, cache_path=None, file_path=[model_relpath], download_url=None)
+                resolve_models([probe])
+                resolved[sha256] = probe
+            return need_upload(resolved[sha256])
+        return lambda path: writer.write_hashed(path, f"models/{model_relpath}", decide)
+
+    def hash_stage(item):
+        index, model_path = item
+        compute = None
+        if single_pass_min_size is not None and os.path.getsize(model_path) >= single_pass_min_size:
+            reset_timestamp_if_needed(model_path)
+            compute = single_pass(model_path, os.path.relpath(model_path, pod_config.model_dir))
+        return [(index, model_path, hash_cache.get_sha256(model_path, hash_buffer_size, compute))]
+
+    def lookup_stage(batch):
+        new_models = []
+        for index, model_path, sha256 in batch:
+            model_name = os.path.basename(model_path)
+            model_relpath = os.path.relpath(model_path, pod_config.model_dir)
+            print(f"【提示】处理模型[{index + 1}]：{model_path}")
+            file_index[model_relpath] = index
+            model_paths.append(model_path)
+            if sha256 not in models:
+                models[sha256] = Model(model_name=model_name, model_id=None, sha256=sha256, cache_path=None, file_path = [model_relpath], download_url= None)
+                new_models.append(models[sha256])
+            else:
+                print(f"【警告】重复模型：{model_name}，只记录路径，后续做映射\n")
+                models[sha256].file_path.append(model_relpath)
+        if not new_models:
+            return []
+        for model in new_models:
+            if model.sha256 in resolved:
+                probe = resolved[model.sha256]
+                model.model_id, model.download_url, model.cache_path = probe.model_id, probe.download_url, probe.cache_path
+        resolve_models([model for model in new_models if model.sha256 not in resolved])
+        for model in new_models:
+            if model.cache_path is not None:
+                print(f"【提示】模型{model.model_name}云端已存在，忽略打包\n")
+            elif model.download_url is not None:
+                print(f"【警告】模型{model.model_name}C站已存在，忽略打包\n")
+            elif model.sha256 in base_uploaded:
+                print(f"【提示】模型{model.model_name}上一次已上传，忽略打包\n")
+        return [model for model in new_models if need_upload(model)]
+
+    def package_stage(model):
+        file_path = os.path.join(pod_config.model_dir, model.file_path[0])
+        reset_timestamp_if_needed(file_path)
+        if writer.write(file_path, f"models/{model.file_path[0]}", model.sha256):
+            print(f"【提示】模型{model.model_name}打包完成\n")
+
+    print(f"哈希并发数:{hash_workers}，读取缓冲区:{hash_buffer_size // (1024 * 1024)}MB")
+    stats = Pipeline(walk_models(), queue_size=max(16, hash_workers * 4)) \
+        .stage(hash_stage, workers=hash_workers, name="hash") \
+        .stage(lookup_stage, batch_size=MANAGER_BATCH_SIZE, name="lookup") \
+        .stage(package_stage, name="package") \
+        .run()
+
+    # 重复模型的第一个路径是打包上传的文件，其余路径及模型按遍历顺序排列，保证多次运行清单一致
+    for model in models.values():
+        model.file_path.sort(key=file_index.get)
+        arcname = writer.archived.get(model.sha256)
+        first_path = arcname[len("models/"):] if arcname is not None else None
+        if model.sha256 in base_uploaded and base_uploaded[model.sha256].file_path[0] in model.file_path:
+            # 上一次已上传的模型，优先沿用云端已有文件的路径
+            first_path = base_uploaded[model.sha256].file_path[0]
+        if first_path is not None:
+            model.file_path.remove(first_path)
+            model.file_path.insert(0, first_path)
+    pod_config.models = sorted(models.values(), key=lambda model: file_index[model.file_path[0]])
+    for index, model in enumerate(pod_config.models):
+        print(f"【提示】模型信息[{index + 1}/{len(pod_config.models)}]：{model}\n")
+    print(f"共处理模型{len(model_paths)}个，耗时{stats['elapsed']:.1f}s，" +
+          "，".join(f"{stage['name']}阶段{stage['busy_seconds']:.1f}s" for stage in stats['stages']))
+
+    if single_pass_min_size is not None:
+        print(f"单次读取打包模型{writer.single_pass_count}个，丢弃推测写入{writer.dropped_count}个"
+              f"({writer.dropped_bytes / 1024 ** 3:.2f}GB)，其中无法截断{writer.orphan_bytes / 1024 ** 3:.2f}GB")
+
+    # 清理已删除/已变化文件的哈希缓存
+    hash_cache.prune(model_paths)
+    print(f"哈希缓存命中{hash_cache.hits}个，重新计算{hash_cache.misses}个")
+    if lookup_cache is not None:
+        print(f"查询缓存命中{lookup_cache.hits}次，未命中{lookup_cache.misses}次")
+
+def load_plugins(base_config=None):
+    # 增量模式：插件目录名相同且当前 commit 未变化的直接复用上一次的记录，不启动 git 进程
+    base_plugins = {plugin.name: plugin for plugin in base_config.plugins} if base_config is not None else {}
     items = os.listdir(pod_config.plugin_dir)
     repo_dirs = [d for d in items if os.path.isdir(os.path.join(pod_config.plugin_dir, d))]
     print(f"【提示】插件目录：{pod_config.plugin_dir},共需要处理插件{len(repo_dirs)}个")
     for index, repo_dir in enumerate(repo_dirs):
         repo_path = os.path.join(pod_config.plugin_dir, repo_dir)
         print( f"【提示】处理插件[{index + 1}/{len(repo_dirs)}]：{repo_path}")
-        try:
-            name, remote_url, commit_log = get_git_repo_info(repo_path)
-            plugin = Plugin(name=name, remote_url=remote_url, commit_log=commit_log)
-        except:
-            pass
+        base_plugin = base_plugins.get(repo_dir)
+        head = read_git_head(repo_path) if base_plugin is not None else None
+        if head is not None and base_plugin.commit_log and head.startswith(base_plugin.commit_log):
+            plugin = base_plugin
+            print(f"【提示】插件未变化，复用记录：{repo_dir}")
+        else:
+            try:
+                name, remote_url, commit_log = get_git_repo_info(repo_path)
+                plugin = Plugin(name=name, remote_url=remote_url, commit_log=commit_log)
+            except:
+                pass
         pod_config.plugins.append(plugin)
         print(f"【提示】插件信息[{index + 1}/{len(repo_dirs)}]：{plugin}")
 
-def load_python_packages():
+def load_python_packages(base_config=None):
+    # 增量模式：pip freeze 行完全相同的包直接复用上一次的记录
+    base_packages = {package.full_text: package for package in base_config.packages} if base_config is not None else {}
     result = subprocess.check_output([pod_config.python, "-m", "pip", "freeze"], text=True).strip()
     packages = result.strip().split("\n")
     print(f"【提示】Python包数量：{len(packages)}\n")
     for index, line in enumerate(packages):
         print( f"【提示】Python包[{index + 1}/{len(packages)}]：{line}\n")
+        if line in base_packages:
+            pod_config.packages.append(base_packages[line])
+            continue
         name, version, remote_url, package_type, err = parse_python_packages(line)
         if err is not None:
             print(f"【警告】Python包解析失败：{err},忽略\n")
@@ -95,14 +234,31 @@ def load_python_packages():
         print(f"【提示】Python包信息[{index + 1}/{len(packages)}]：{package}\n")
         pod_config.packages.append(package)
 
-def package_zip():
+def write_pod_config(z):
     pod_config_file = os.path.join(pod_config.app_dir, "pod_config.json")
     with open(pod_config_file, "w") as f:
         json.dump(pod_config.model_dump(), f, indent=4)  #
+    z.write(pod_config_file, "pod_config.json")
+
+def load_base_config(base_config_file):
+    """读取上一次导出的配置，返回 (PodConfig, 配置文件指纹)"""
+    with open(base_config_file, "rb") as f:
+        data = f.read()
+    return PodConfig(**json.loads(data)), config_fingerprint(data)
+
+def write_delta(z, base_config, base_fingerprint):
+    """写入增量清单和本次完整配置"""
+    manifest = build_delta_manifest(base_config, base_fingerprint, pod_config)
+    z.writestr(DELTA_MANIFEST_NAME, json.dumps(manifest, indent=4))
+    write_pod_config(z)
+    print(f"增量：新增模型{len(manifest['added_models'])}个，删除模型{len(manifest['removed_models'])}个，"
+          f"上传模型{len(manifest['uploaded'])}个，移动{len(manifest['moved'])}个，删除已上传文件{len(manifest['removed_files'])}个")
 
+def package_zip():
+    """根据已有配置重新打包"""
     pod_zip_file = os.path.join(pod_config.app_dir, "pod_config.zip")
     with zipfile.ZipFile(pod_zip_file, "w") as z:
-        z.write(pod_config_file, "pod_config.json")
+        write_pod_config(z)
         for model in pod_config.models:
             if model.cache_path is not None:
                 print(f"【提示】模型{model.model_name}云端已存在，忽略打包\n")
@@ -117,12 +273,28 @@ def package_zip():
                 print(f"【提示】模型{model.model_name}打包完成\n")
 
 
-def init(app_dir, python):
+def init(app_dir, python, rehash=False, use_lookup_cache=True):
+    global hash_cache, lookup_cache
     if not os.path.exists(app_dir):
         raise Exception(f"应用目录不存在:{app_dir}")
     pod_config.app_dir = app_dir
     print(f"应用目录:{pod_config.app_dir}")
 
+    # 哈希缓存
+    hash_cache_file = os.path.join(get_local_cache_dir(app_dir), HASH_CACHE_FILE_NAME)
+    hash_cache = HashCache(hash_cache_file, rehash=rehash)
+    print(f"哈希缓存:{hash_cache_file}{'（强制重新计算）' if rehash else ''}")
+
+    # 查询结果缓存
+    if use_lookup_cache:
+        lookup_cache_file = os.path.join(get_local_cache_dir(app_dir), LOOKUP_CACHE_FILE_NAME)
+        lookup_cache = LookupCache(lookup_cache_file)
+        print(f"查询缓存:{lookup_cache_file}")
+    # 默认经过晨羽缓存的C站查询代理，代理不可用时直连C站
+    base_url = CIVITAI_BY_HASH_URL if civitai_direct else CIVITAI_PROXY_URL
+    set_civitai_resolver(CivitaiResolver(base_url=base_url, fallback_url=None if civitai_direct else CIVITAI_BY_HASH_URL,
+                                         workers=civitai_workers, rate=civitai_rate, lookup_cache=lookup_cache))
+
     # 模型目录
     model_dir = os.path.join(app_dir, "models")
     if not os.path.exists(model_dir):
@@ -152,44 +324,71 @@ if __name__ == "__main__":
     parser.add_argument('--app_dir', help='应用目录。',required=True)
     parser.add_argument('--python', help='python执行程序，比如 /usr/bin/python，默认 python。')
     parser.add_argument('--pod_config', help='根据配置文件读取。')
+    parser.add_argument('--incremental', action='store_true',
+                        help='增量模式：对比上一次导出的配置，只打包新增/变化的上传模型，生成 pod_delta.zip。')
+    parser.add_argument('--base_config', help='增量模式基于的配置文件，默认 应用目录/pod_config.json。')
+    parser.add_argument('--rehash', action='store_true', help='忽略本地哈希缓存，重新计算所有模型的 sha256。')
+    parser.add_argument('--hash_workers', type=int, default=DEFAULT_HASH_WORKERS,
+                        help=f'并行计算哈希的线程数，SSD 可调大，机械硬盘建议 1，默认 {DEFAULT_HASH_WORKERS}。')
+    parser.add_argument('--hash_buffer_mb', type=int, default=4, help='计算哈希时的读取缓冲区大小(MB)，默认 4。')
+    parser.add_argument('--civitai_workers', type=int, default=8, help='并发查询C站的线程数，默认 8。')
+    parser.add_argument('--civitai_rate', type=float, default=5.0, help='每秒最多直连请求C站的次数，默认 5。')
+    parser.add_argument('--civitai_direct', action='store_true', help='不经过晨羽缓存的C站查询代理，直接请求C站。')
+    parser.add_argument('--single_pass', action='store_true',
+                        help='单次读取模式：大模型边计算哈希边打包，确认云端和C站都不存在后保留，否则丢弃，需要上传的模型只读一次磁盘。')
+    parser.add_argument('--single_pass_min_mb', type=int, default=256, help='单次读取模式处理的最小模型大小(MB)，默认 256。')
+    parser.add_argument('--no-lookup-cache', '--no_lookup_cache', dest='no_lookup_cache', action='store_true',
+                        help='不使用本地查询缓存，重新请求C站和晨羽缓存。')
     args = parser.parse_args()
     # 应用目录
     app_dir = args.app_dir
     python = args.python
     config = args.pod_config
+    hash_workers = args.hash_workers
+    hash_buffer_size = args.hash_buffer_mb * 1024 * 1024
+    civitai_workers = args.civitai_workers
+    civitai_rate = args.civitai_rate
+    civitai_direct = args.civitai_direct
+    if args.single_pass:
+        single_pass_min_size = args.single_pass_min_mb * 1024 * 1024
     if config is None:
         # 初始化
         print("初始化...")
-        init(app_dir, python)
+        init(app_dir, python, args.rehash, not args.no_lookup_cache)
         print("初始化完成")
 
-        print("加载模型...")
-        load_models()
-        print("加载模型完成")
+        base_config, base_fingerprint = None, None
+        if args.incremental:
+            base_config_file = args.base_config or os.path.join(pod_config.app_dir, "pod_config.json")
+            base_config, base_fingerprint = load_base_config(base_config_file)
+            print(f"增量模式，基于配置:{base_config_file}")
 
         print("加载插件...")
-        load_plugins()
+        load_plugins(base_config)
         print("加载插件完成")
 
         print("加载python包...")
-        load_python_packages()
+        load_python_packages(base_config)
         print("加载python包完成")
+
+        # 模型边处理边打包，配置文件在模型处理完成后写入
+        print("加载模型并打包...")
+        if base_config is None:
+            with zipfile.ZipFile(os.path.join(pod_config.app_dir, "pod_config.zip"), "w") as z:
+                load_models(z)
+                write_pod_config(z)
+        else:
+            with zipfile.ZipFile(os.path.join(pod_config.app_dir, "pod_delta.zip"), "w") as z:
+                load_models(z, base_config)
+                write_delta(z, base_config, base_fingerprint)
+        print("打包完成")
     else:
         with open(config, "r") as f:
             data= json.load(f)
             pod_config = PodConfig(**data)
             print(pod_config.app_dir)
-    # 打包
-    print("打包...")
-    print()
-    package_zip()
-    print("打包完成")
-
-
-
-
-
-
-
-
-
+        # 打包
+        print("打包...")
+        print()
+        package_zip()
+        print("打包完成")
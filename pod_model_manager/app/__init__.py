@@ -20,7 +20,10 @@ def check_login_and_login():
         login(token=HUGGINGFACE_TOKEN)
         print("Login successful.")
 
-def create_app():
+def create_app(start_background=True):
+    """
+    :param start_background: 是否启动下载工作线程/定时任务并登录 Huggingface，命令行工具（如批量导入）不需要
+    """
     app = Flask(__name__)
 
     app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
@@ -30,14 +33,20 @@ def create_app():
     # 初始化数据库
     db.init_app(app)
 
+    # SQL 耗时统计
+    from .query_stats import query_stats
+    with app.app_context():
+        query_stats.install(db.engine)
+
     # 导入路由
     from .routes import api_bp
     app.register_blueprint(api_bp)
 
-    # 启动定时任务
-    from .scheduler import start_scheduler
-    start_scheduler(app)
+    if start_background:
+        # 启动定时任务
+        from .scheduler import start_scheduler
+        start_scheduler(app)
 
-    check_login_and_login()
+        check_login_and_login()
 
     return app
\ No newline at end of file
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from .config import MODEL_CACHE_MAX_ENTRIES, MODEL_CACHE_TTL, MODEL_CACHE_PENDING_TTL, MODEL_CACHE_NEGATIVE_TTL
+
+
+class CacheEntry:
+    def __init__(self, data, expires_at):
+        self.data = data                # 模型信息，None 表示模型不存在
+        self.expires_at = expires_at
+        self.etag = hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+class ModelCache:
+    """
+    进程内的模型查询缓存（TTL + LRU），线程安全
+    已下载的模型基本不会再变化，缓存时间较长；未下载完成的模型缓存时间较短；不存在的模型短时间缓存；
+    本进程修改模型（调度器、添加接口）时主动失效，多实例部署时其他实例的修改依赖 TTL 过期
+    """
+
+    def __init__(self, max_entries=MODEL_CACHE_MAX_ENTRIES, ttl=MODEL_CACHE_TTL,
+                 pending_ttl=MODEL_CACHE_PENDING_TTL, negative_ttl=MODEL_CACHE_NEGATIVE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sha256):
+        """返回缓存项，未命中或已过期时返回 None"""
+        with self._lock:
+            entry = self._entries.get(sha256)
+            if entry is None or entry.expires_at < time.monotonic():
+                if entry is not None:
+                    del self._entries[sha256]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(sha256)
+            self.hits += 1
+            return entry
+
+    def put(self, sha256, data):
+        """缓存查询结果（data 为 None 表示模型不存在），返回缓存项"""
+        if data is None:
+            ttl = self.negative_ttl
+        elif str(data.get('status')) == '1':
+            ttl = self.ttl
+        else:
+            ttl = self.pending_ttl
+        entry = CacheEntry(data, time.monotonic() + ttl)
+        with self._lock:
+            self._entries[sha256] = entry
+            self._entries.move_to_end(sha256)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, *sha256_list):
+        with self._lock:
+            for sha256 in sha256_list:
+                if self._entries.pop(sha256, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'invalidations': self.invalidations,
+            }
+
+
+# 进程内共享的模型缓存
+model_cache = ModelCache()
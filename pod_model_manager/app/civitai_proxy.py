@@ -0,0 +1,128 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import requests
+from sqlalchemy.exc import SQLAlchemyError
+
+from utils.civitai import CivitaiResolver, CIVITAI_BY_HASH_URL
+from . import db
+from .config import CIVITAI_CACHE_TTL, CIVITAI_NEGATIVE_TTL, CIVITAI_UPSTREAM_RATE
+from .models import CivitaiLookup
+
+
+class _Flight:
+    """同一哈希正在进行中的上游请求，后到的请求等待其结果"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class CivitaiProxy:
+    """
+    C站 by-hash 查询代理，结果缓存在数据库中（含负缓存），客户端和调度器共用
+    同一进程内同一哈希的并发未命中只请求C站一次，其余请求等待其结果；
+    请求C站失败（非 404）时不缓存，直接向调用方抛出 RequestException
+    """
+
+    def __init__(self, ttl=CIVITAI_CACHE_TTL, negative_ttl=CIVITAI_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+        self._upstream = None
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def upstream(self):
+        with self._lock:
+            if self._upstream is None:
+                self._upstream = CivitaiResolver(base_url=CIVITAI_BY_HASH_URL, fallback_url=None,
+                                                 rate=CIVITAI_UPSTREAM_RATE)
+            return self._upstream
+
+    def _load(self, sha256):
+        """读取未过期的缓存结果 (是否存在, model_id, download_url)，需要在应用上下文中调用"""
+        row = db.session.get(CivitaiLookup, sha256)
+        if row is None:
+            return None
+        ttl = self.ttl if row.found else self.negative_ttl
+        if row.checked_at + timedelta(seconds=ttl) < datetime.now():
+            return None
+        return row.found, row.model_id, row.download_url
+
+    def _store(self, sha256, result):
+        found, model_id, download_url = result
+        try:
+            db.session.merge(CivitaiLookup(sha256=sha256, found=found, model_id=model_id,
+                                           download_url=download_url, checked_at=datetime.now()))
+            db.session.commit()
+        except SQLAlchemyError as e:
+            # 多实例同时写入等情况，缓存写入失败不影响本次结果
+            db.session.rollback()
+            logging.warning(f"C站查询结果缓存写入失败: {sha256} {e}")
+
+    def lookup(self, sha256):
+        """
+        查询模型，需要在应用上下文中调用
+        :return: (是否存在, model_id, download_url)
+        """
+        sha256 = sha256.lower()
+        result = self._load(sha256)
+        if result is not None:
+            with self._lock:
+                self.hits += 1
+            return result
+        with self._lock:
+            self.misses += 1
+            flight = self._flights.get(sha256)
+            leader = flight is None
+            if leader:
+                flight = self._flights[sha256] = _Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = self.upstream().lookup(sha256)
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                del self._flights[sha256]
+            flight.event.set()
+        self._store(sha256, flight.result)
+        return flight.result
+
+    def resolve(self, sha256):
+        """同 CivitaiResolver.resolve，返回 (model_id, download_url)，不存在或请求失败时返回 (None, None)"""
+        try:
+            _, model_id, download_url = self.lookup(sha256)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"请求失败: {e}")
+            return None, None
+        return model_id, download_url
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'errors': self.errors,
+                'in_flight': len(self._flights)
+            }
+
+
+# 进程内共享的C站查询代理
+civitai_proxy = CivitaiProxy()
@@ -2,3 +2,23 @@
 SQLALCHEMY_DATABASE_URI = 'xxxx'
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 MODEL_BASE_DIR = "/mnt/chenyu-nvme"
+DOWNLOAD_WORKERS = 6          # 并发下载的工作线程数（Huggingface 仓库的文件也分散到各工作线程并发下载）
+DOWNLOAD_LEASE_SECONDS = 120  # 下载租约时长，工作线程每 1/3 租约时长续约一次
+DOWNLOAD_MAX_ATTEMPTS = 3     # 最大下载尝试次数，超过后标记为下载失败
+DOWNLOAD_POLL_SECONDS = 10    # 空闲时轮询新任务的间隔（同进程内新增模型会立即唤醒）
+HF_LFS_CACHE_DIR = f"{MODEL_BASE_DIR}/.huggingface-lfs"   # Huggingface 仓库 LFS 文件列表缓存（按仓库+提交）
+DOWNLOAD_CONNECTIONS = 8                # 单个文件的最大并发连接数
+DOWNLOAD_BANDWIDTH_LIMIT_MB = 200       # 所有下载共享的总带宽上限(MB/s)，0 表示不限速，给 pod 流量留出余量
+DOWNLOAD_PROGRESS_INTERVAL = 2          # 下载进度写入数据库的最小间隔(秒)
+MODEL_CACHE_MAX_ENTRIES = 100000        # 模型查询缓存的最大条数
+MODEL_CACHE_TTL = 600                   # 已下载模型的缓存时间(秒)
+MODEL_CACHE_PENDING_TTL = 10            # 未下载完成模型的缓存时间(秒)
+MODEL_CACHE_NEGATIVE_TTL = 30           # 不存在的模型的缓存时间(秒)
+MODEL_FILTER_FALSE_POSITIVE_RATE = 0.01 # 已缓存模型布隆过滤器的误判率
+MODEL_FILTER_MIN_CAPACITY = 100000      # 布隆过滤器的最小容量
+MODEL_FILTER_REBUILD_SECONDS = 600      # 布隆过滤器定时全量重建的间隔(秒)
+CIVITAI_CACHE_TTL = 7 * 24 * 3600       # C站 by-hash 查询结果的缓存时间(秒)
+CIVITAI_NEGATIVE_TTL = 6 * 3600         # C站查不到的模型的缓存时间(秒)
+CIVITAI_UPSTREAM_RATE = 5.0             # 服务端每秒最多请求C站的次数
+QUERY_SLOW_MS = 200                     # 超过该耗时(毫秒)的 SQL 记录警告日志
+QUERY_STATS_MAX_STATEMENTS = 500        # SQL 耗时统计最多保留的语句数
@@ -0,0 +1,312 @@
+"""
+批量导入已有的模型缓存（如新缓存节点的 /mnt/chenyu-nvme）到模型表
+1.读取 json 映射文件（{cache_path: sha256}）
+2.遍历缓存目录下调度器的下载目录（0/ C站、1/ Huggingface）并行计算 sha256，
+  同一磁盘上的其他目录（如 POD_CACHE_DIR 下的 wheel 仓库、Git 镜像）不导入
+已登记的 sha256（及遍历模式下已登记的缓存路径）跳过，新模型按批多行插入，状态为已下载
+Huggingface 文件（{base}/1/{提交}/{sha256}）的仓库名从 LFS 文件列表缓存（HF_LFS_CACHE_DIR/{仓库}/{提交}.json）中查找，
+找不到时 name 为空
+
+用法：python -m pod_model_manager.app.ingest --json_dir ./json
+     python -m pod_model_manager.app.ingest --root /mnt/chenyu-nvme
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from sqlalchemy.exc import IntegrityError
+
+from utils.hash_engine import DEFAULT_HASH_WORKERS
+from utils.pipeline import Pipeline
+from utils.util import calculate_sha256
+from . import db
+from .config import MODEL_BASE_DIR, HF_LFS_CACHE_DIR
+from .models import Model
+
+# 每个事务插入的行数
+INGEST_BATCH_SIZE = 2000
+# 查询已存在 sha256 时单条 IN 语句的最大个数
+EXISTS_CHUNK_SIZE = 1000
+# 进度输出间隔(秒)
+PROGRESS_INTERVAL = 2
+
+_SHA256_NAME = re.compile(r"^[0-9a-fA-F]{64}$")
+# 调度器按模型类型存放下载文件的子目录
+MODEL_TYPE_DIRS = ("0", "1")
+# 下载器/调度器的临时文件：.part、.part.json、.tmp、.tmp-{pid} 及其组合
+_SCRATCH_NAME = re.compile(r"\.(part|tmp)(\.|-|$)")
+
+
+def read_mappings(json_dir):
+    """读取目录下所有 json 映射文件，逐个返回 (cache_path, sha256)"""
+    for filename in sorted(os.listdir(json_dir)):
+        if not filename.endswith('.json'):
+            continue
+        file_path = os.path.join(json_dir, filename)
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"文件 {filename} 读取失败: {e}")
+            continue
+        for cache_path, sha256 in data.items():
+            yield cache_path, sha256
+
+
+def is_scratch_file(file_name):
+    """隐藏文件及下载器/调度器的临时文件"""
+    return file_name.startswith('.') or _SCRATCH_NAME.search(file_name) is not None
+
+
+def walk_cache(root, skip_paths=frozenset(), trust_names=False):
+    """
+    遍历缓存目录下的 0/、1/ 子目录，逐个返回 (cache_path, sha256)，sha256 为 None 表示需要计算
+    跳过隐藏目录、下载临时文件（.part/.part.json/.tmp 等）及已登记的缓存路径
+    :param trust_names: 文件名本身是 sha256 时（调度器下载的文件均以 sha256 命名）直接使用，不读取文件
+    """
+    for type_dir in MODEL_TYPE_DIRS:
+        yield from _walk_dir(os.path.join(root, type_dir), skip_paths, trust_names)
+
+
+def _walk_dir(top, skip_paths, trust_names):
+    for dir_path, dir_names, file_names in os.walk(top):
+        dir_names[:] = sorted(d for d in dir_names if not d.startswith('.'))
+        for file_name in sorted(file_names):
+            if is_scratch_file(file_name):
+                continue
+            cache_path = os.path.join(dir_path, file_name)
+            if cache_path in skip_paths:
+                continue
+            sha256 = file_name.lower() if trust_names and _SHA256_NAME.match(file_name) else None
+            yield cache_path, sha256
+
+
+def huggingface_commit_index(cache_dir=HF_LFS_CACHE_DIR):
+    """
+    读取 Huggingface LFS 文件列表缓存，返回 {提交 sha: (仓库, {sha256: 文件路径})}
+    缓存文件为 {cache_dir}/{仓库，/ 替换为 --}/{提交}.json，见 utils.util.huggingface_query_lfs
+    """
+    index = {}
+    if not os.path.isdir(cache_dir):
+        return index
+    for repo_dir in sorted(os.listdir(cache_dir)):
+        repo_path = os.path.join(cache_dir, repo_dir)
+        if not os.path.isdir(repo_path):
+            continue
+        for file_name in os.listdir(repo_path):
+            match = re.fullmatch(r"([0-9a-f]{40})\.json", file_name)
+            if match is None:
+                continue
+            try:
+                with open(os.path.join(repo_path, file_name), "r") as f:
+                    index[match.group(1)] = (repo_dir.replace("--", "/", 1), json.load(f))
+            except (OSError, ValueError) as e:
+                logging.warning(f"LFS 文件列表缓存读取失败: {repo_path}/{file_name} {e}")
+    return index
+
+
+def model_type_of(cache_path, base_dir=MODEL_BASE_DIR):
+    """按调度器的目录结构推断模型类型：{base}/0/ C站，{base}/1/ Huggingface，其他为 -1"""
+    relative = os.path.relpath(cache_path, base_dir).replace('\\', '/')
+    top = relative.split('/', 1)[0]
+    return top if top in ("0", "1") else "-1"
+
+
+class CacheIngest:
+    """
+    批量导入：哈希阶段多线程读取文件，插入阶段单线程按批写入（每批一个事务）
+    """
+
+    def __init__(self, app, workers=DEFAULT_HASH_WORKERS, batch_size=INGEST_BATCH_SIZE, base_dir=MODEL_BASE_DIR,
+                 hf_lfs_cache_dir=HF_LFS_CACHE_DIR):
+        self.app = app
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.base_dir = base_dir
+        self.hf_lfs_cache_dir = hf_lfs_cache_dir
+        self._hf_commits = None
+        self.unresolved = 0
+        self.scanned = 0
+        self.hashed = 0
+        self.missing = 0
+        self.inserted = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def existing_cache_paths(self):
+        """已登记的缓存路径，遍历模式下这些文件不再计算哈希"""
+        with self.app.app_context():
+            query = db.session.query(Model.cache_path).filter(Model.cache_path.isnot(None))
+            return {cache_path for (cache_path,) in query.yield_per(10000)}
+
+    def _counted(self, source):
+        for item in source:
+            with self._lock:
+                self.scanned += 1
+            yield item
+
+    def _hash_stage(self, item):
+        cache_path, sha256 = item
+        try:
+            size = os.path.getsize(cache_path)
+            if sha256 is None:
+                sha256 = calculate_sha256(cache_path)
+                with self._lock:
+                    self.hashed += 1
+        except OSError as e:
+            logging.warning(f"缓存文件不可读，跳过: {cache_path} {e}")
+            with self._lock:
+                self.missing += 1
+            return None
+        return [(cache_path, sha256.lower(), size)]
+
+    def _huggingface_file(self, cache_path, sha256):
+        """按缓存路径中的提交查找 Huggingface 仓库，返回 (仓库, 真实文件名)，找不到时返回 (None, None)"""
+        if self._hf_commits is None:
+            self._hf_commits = huggingface_commit_index(self.hf_lfs_cache_dir)
+        parts = os.path.relpath(cache_path, self.base_dir).replace('\\', '/').split('/')
+        repo = self._hf_commits.get(parts[1]) if len(parts) > 2 else None
+        if repo is None or sha256 not in repo[1]:
+            return None, None
+        return repo[0], os.path.basename(repo[1][sha256])
+
+    def _row(self, cache_path, sha256, size):
+        model_type = model_type_of(cache_path, self.base_dir)
+        true_file_name = None
+        if model_type == "0":
+            name = sha256
+        elif model_type == "1":
+            name, true_file_name = self._huggingface_file(cache_path, sha256)
+        else:
+            name = os.path.basename(cache_path)
+        return {
+            'sha256': sha256,
+            'name': name,
+            'model_type': model_type,
+            'true_file_name': true_file_name,
+            'cache_path': cache_path,
+            'status': '1',
+            'size': size,
+            'downloaded': size,
+            'priority': 0,
+            'attempts': 0,
+        }
+
+    def _insert_stage(self, batch):
+        rows = {}
+        for cache_path, sha256, size in batch:
+            rows.setdefault(sha256, self._row(cache_path, sha256, size))
+        with self.app.app_context():
+            keys = list(rows)
+            for start in range(0, len(keys), EXISTS_CHUNK_SIZE):
+                chunk = keys[start:start + EXISTS_CHUNK_SIZE]
+                for (sha256,) in db.session.query(Model.sha256).filter(Model.sha256.in_(chunk)):
+                    rows.pop(sha256, None)
+            unresolved = sum(1 for row in rows.values() if row['model_type'] == "1" and row['name'] is None)
+            inserted = self._insert(list(rows.values()))
+        with self._lock:
+            self.unresolved += unresolved
+            self.inserted += inserted
+            self.skipped += len(batch) - inserted
+
+    @staticmethod
+    def _insert(rows):
+        if not rows:
+            return 0
+        try:
+            db.session.execute(Model.__table__.insert(), rows)
+            db.session.commit()
+            return len(rows)
+        except IntegrityError:
+            # 服务端同时添加了其中的模型，逐条插入并跳过已存在的
+            db.session.rollback()
+        inserted = 0
+        for row in rows:
+            try:
+                db.session.execute(Model.__table__.insert(), [row])
+                db.session.commit()
+                inserted += 1
+            except IntegrityError:
+                db.session.rollback()
+        return inserted
+
+    def _progress(self, start, done):
+        while not done.wait(PROGRESS_INTERVAL):
+            self._print_progress(start, end="\r")
+
+    def _print_progress(self, start, end="\n"):
+        elapsed = max(time.monotonic() - start, 1e-6)
+        with self._lock:
+            print(f"已扫描 {self.scanned}，计算哈希 {self.hashed}，新增 {self.inserted}，已存在 {self.skipped}，"
+                  f"不可读 {self.missing}，{self.inserted / elapsed:.0f} 行/秒", end=end, flush=True)
+
+    def run(self, source):
+        """导入 (cache_path, sha256 或 None) 序列，返回统计信息"""
+        start = time.monotonic()
+        done = threading.Event()
+        reporter = threading.Thread(target=self._progress, args=(start, done), name="ingest-progress", daemon=True)
+        reporter.start()
+        try:
+            Pipeline(self._counted(source), queue_size=max(64, self.workers * 4)) \
+                .stage(self._hash_stage, workers=self.workers, name="hash") \
+                .stage(self._insert_stage, batch_size=self.batch_size, batch_timeout=1.0, name="insert",
+                       queue_size=self.batch_size * 2) \
+                .run()
+        finally:
+            done.set()
+            reporter.join()
+            self._print_progress(start)
+        elapsed = time.monotonic() - start
+        return {
+            'scanned': self.scanned,
+            'hashed': self.hashed,
+            'inserted': self.inserted,
+            'skipped': self.skipped,
+            'missing': self.missing,
+            'unresolved': self.unresolved,
+            'seconds': round(elapsed, 2),
+            'rows_per_second': round(self.inserted / elapsed, 1) if elapsed > 0 else 0.0,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量导入已有模型缓存到模型表')
+    parser.add_argument('--json_dir', help='json 映射文件目录，文件内容为 {cache_path: sha256}。')
+    parser.add_argument('--root', help='遍历的缓存根目录，只导入其中的 0/（C站）、1/（Huggingface）子目录。')
+    parser.add_argument('--base_dir', help=f'缓存根目录，用于推断模型类型，默认为 --root，未指定 --root 时为 {MODEL_BASE_DIR}。')
+    parser.add_argument('--hf_lfs_cache_dir', default=HF_LFS_CACHE_DIR,
+                        help=f'Huggingface LFS 文件列表缓存目录，{{base_dir}}/1/{{提交}}/ 下的文件按提交从中查找仓库名，'
+                             f'找不到的 name 为空，默认 {HF_LFS_CACHE_DIR}。')
+    parser.add_argument('--workers', type=int, default=DEFAULT_HASH_WORKERS,
+                        help=f'并行计算哈希的线程数，默认 {DEFAULT_HASH_WORKERS}。')
+    parser.add_argument('--batch_size', type=int, default=INGEST_BATCH_SIZE,
+                        help=f'每个事务插入的行数，默认 {INGEST_BATCH_SIZE}。')
+    parser.add_argument('--trust_names', action='store_true',
+                        help='遍历模式下文件名是 sha256 的直接使用，不读取文件计算。')
+    args = parser.parse_args()
+    if (args.json_dir is None) == (args.root is None):
+        parser.error('需要且只能指定 --json_dir 或 --root 其中之一')
+    base_dir = args.base_dir or args.root or MODEL_BASE_DIR
+
+    from . import create_app
+    app = create_app(start_background=False)
+    ingest = CacheIngest(app, workers=args.workers, batch_size=args.batch_size, base_dir=base_dir,
+                         hf_lfs_cache_dir=args.hf_lfs_cache_dir)
+    if args.json_dir is not None:
+        source = read_mappings(args.json_dir)
+    else:
+        skip_paths = ingest.existing_cache_paths()
+        print(f"已登记缓存路径 {len(skip_paths)} 个，遍历目录: {args.root}")
+        source = walk_cache(args.root, skip_paths, args.trust_names)
+    stats = ingest.run(source)
+    print(f"导入完成：新增 {stats['inserted']} 个，已存在 {stats['skipped']} 个，不可读 {stats['missing']} 个，"
+          f"未找到仓库的 Huggingface 文件 {stats['unresolved']} 个，"
+          f"耗时 {stats['seconds']}s，{stats['rows_per_second']} 行/秒")
+
+
+if __name__ == '__main__':
+    main()
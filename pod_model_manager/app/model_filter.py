@@ -0,0 +1,75 @@
+import threading
+import time
+
+from utils.bloom import BloomFilter
+from . import db
+from .config import MODEL_FILTER_FALSE_POSITIVE_RATE, MODEL_FILTER_MIN_CAPACITY
+from .models import Model
+
+
+class ModelFilter:
+    """
+    已缓存模型（status 1）sha256 的布隆过滤器，供客户端下载后在本地跳过一定不存在的查询
+    启动后首次请求时全量构建，模型下载完成时增量加入并更新版本；
+    元素个数超过容量或定时任务触发时全量重建（多实例部署时其他实例完成的模型在重建后加入）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._capacity = 0
+        self._built_at = 0
+        self._additions = 0
+        self._data = None
+        self._rebuilding = 0
+        self._recent = []       # 重建期间完成的模型，重建结束后补充加入
+
+    def rebuild(self):
+        """全量重建，需要在应用上下文中调用"""
+        with self._lock:
+            self._rebuilding += 1
+        count = db.session.query(Model.sha256).filter(Model.status == '1').count()
+        capacity = max(MODEL_FILTER_MIN_CAPACITY, count * 2)
+        bloom = BloomFilter.for_capacity(capacity, MODEL_FILTER_FALSE_POSITIVE_RATE)
+        for (sha256,) in db.session.query(Model.sha256).filter(Model.status == '1').yield_per(10000):
+            bloom.add(sha256)
+        with self._lock:
+            for sha256 in self._recent:
+                bloom.add(sha256)
+            self._rebuilding -= 1
+            if self._rebuilding == 0:
+                self._recent = []
+            self._bloom = bloom
+            self._capacity = capacity
+            self._built_at = int(time.time())
+            self._additions = 0
+            self._data = None
+
+    def add(self, sha256):
+        """模型下载完成后增量加入；超过容量时丢弃当前过滤器，下次请求时重建"""
+        with self._lock:
+            if self._rebuilding:
+                self._recent.append(sha256)
+            if self._bloom is None:
+                return
+            if self._bloom.count >= self._capacity:
+                self._bloom = None
+                return
+            self._bloom.add(sha256)
+            self._additions += 1
+            self._data = None
+
+    def snapshot(self):
+        """返回 (版本, 序列化数据)，尚未构建时先全量构建"""
+        while True:
+            with self._lock:
+                # 重建完成后到这里之前，并发的 add 可能因超过容量再次丢弃过滤器，需要重新构建
+                if self._bloom is not None:
+                    if self._data is None:
+                        self._data = self._bloom.to_bytes()
+                    return f"{self._built_at}-{self._additions}", self._data
+            self.rebuild()
+
+
+# 进程内共享的模型过滤器
+model_filter = ModelFilter()
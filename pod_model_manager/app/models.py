@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from fsspec.registry import default
 
 from . import db
@@ -17,14 +19,28 @@ chenyudata
 """
 
 class Model(db.Model):
-    name = db.Column(db.String(256), nullable=False)              # 模型名称 huggingface: repoid  civiai: sha256  other: modelname
+    name = db.Column(db.String(256), nullable=True)               # 模型名称 huggingface: repoid  civiai: sha256  other: modelname（批量导入无法确定仓库的 Huggingface 文件为空）
     model_type = db.Column(db.String(32), nullable=False)         # -1: 其他 0: C站模型 1: Huggingface模型
     sha256 = db.Column(db.String(128), primary_key=True)          # 模型SHA256
     cache_path = db.Column(db.String(256), nullable=True)         # 缓存路径
     download_url = db.Column(db.String(1024), nullable=True)      # 下载URL
-    status = db.Column(db.String(32), nullable=True,default=0)    # 模型状态 0: 未下载 1: 已下载 2: 下载中
-    size = db.Column(db.Integer, nullable=True)                   # 模型大小
+    status = db.Column(db.String(32), nullable=True,default=0)    # 模型状态 0: 未下载 1: 已下载 2: 下载中 3: 下载失败
+    size = db.Column(db.BigInteger, nullable=True)                # 模型大小
+    downloaded = db.Column(db.BigInteger, nullable=True)          # 已下载字节数（下载进度）
     true_file_name = db.Column(db.String(256), nullable=True)     # 真实文件名
+    priority = db.Column(db.Integer, nullable=False, default=0)   # 下载优先级，越大越先下载
+    worker_id = db.Column(db.String(64), nullable=True)           # 正在下载的工作线程
+    lease_expires_at = db.Column(db.DateTime, nullable=True)      # 下载租约到期时间，到期未续约会重新排队
+    attempts = db.Column(db.Integer, nullable=False, default=0)   # 下载尝试次数
+    error = db.Column(db.String(1024), nullable=True)             # 最近一次下载失败原因
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # 添加时间，同优先级先添加先下载
+
+    __table_args__ = (
+        db.Index('ix_model_status_priority', status, priority.desc(), created_at),  # 领取任务的排序
+        db.Index('ix_model_status_sha256', 'status', 'sha256'),       # 按状态过滤并按 sha256 分页
+        db.Index('ix_model_type_sha256', 'model_type', 'sha256'),     # 按类型过滤并按 sha256 分页
+        db.Index('ix_model_type_name', 'model_type', 'name', 'sha256'),  # 按仓库/名称查询并按 sha256 分页
+    )
 
     def __repr__(self):
         return f'<Model {self.name}>'
@@ -34,7 +50,26 @@ class Model(db.Model):
             'sha256': self.sha256,
             'name': self.name,
             'model_type': self.model_type,
-            'cache_path': self.cache_path,
+            # 只有下载并校验完成的模型才发布缓存路径，避免 pod 链接到未下载完成的文件
+            'cache_path': self.cache_path if str(self.status) == '1' else None,
             'download_url': self.download_url,
-            'status': self.status
+            'status': self.status,
+            'size': self.size,
+            'downloaded': self.downloaded,
+            'priority': self.priority,
+            'error': self.error
         }
+
+
+class CivitaiLookup(db.Model):
+    """C站 by-hash 查询结果缓存，客户端和调度器共用，found 为 False 表示C站查不到（负缓存）"""
+    __tablename__ = 'civitai_lookup'
+
+    sha256 = db.Column(db.String(128), primary_key=True)          # 模型哈希（小写）
+    found = db.Column(db.Boolean, nullable=False)                 # C站是否存在
+    model_id = db.Column(db.BigInteger, nullable=True)            # 模型ID
+    download_url = db.Column(db.String(1024), nullable=True)      # 下载URL
+    checked_at = db.Column(db.DateTime, nullable=False)           # 最近一次请求C站的时间
+
+    def __repr__(self):
+        return f'<CivitaiLookup {self.sha256}>'
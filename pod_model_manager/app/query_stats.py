@@ -0,0 +1,84 @@
+import logging
+import re
+import threading
+import time
+
+from sqlalchemy import event
+
+from .config import QUERY_SLOW_MS, QUERY_STATS_MAX_STATEMENTS
+
+# IN (?, ?, ...) 参数个数不同的同一语句归为一类
+_PARAM_LIST = re.compile(r"\((?:\s*(?:\?|%s|%\(\w+\)s)\s*,)+\s*(?:\?|%s|%\(\w+\)s)\s*\)")
+
+
+class StatementStats:
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+
+class QueryStats:
+    """
+    通过 SQLAlchemy 游标执行事件统计每条 SQL 的执行次数及耗时，线程安全
+    语句按去掉多余空白后的 SQL 文本归类（参数不同的同一语句归为一类），超过 QUERY_SLOW_MS 的记录警告日志
+    """
+
+    def __init__(self, slow_ms=QUERY_SLOW_MS, max_statements=QUERY_STATS_MAX_STATEMENTS):
+        self.slow_ms = slow_ms
+        self.max_statements = max_statements
+        self.dropped = 0
+        self._statements = {}
+        self._lock = threading.Lock()
+        self._engines = set()
+
+    def install(self, engine):
+        """在引擎上注册事件，同一引擎只注册一次"""
+        with self._lock:
+            if id(engine) in self._engines:
+                return
+            self._engines.add(id(engine))
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info['query_start'].pop()) * 1000
+        statement = _PARAM_LIST.sub("(...)", re.sub(r"\s+", " ", statement).strip())
+        if elapsed_ms >= self.slow_ms:
+            logging.warning(f"慢查询 {elapsed_ms:.1f}ms: {statement}")
+        with self._lock:
+            stats = self._statements.get(statement)
+            if stats is None:
+                if len(self._statements) >= self.max_statements:
+                    self.dropped += 1
+                    return
+                stats = self._statements[statement] = StatementStats()
+            stats.count += 1
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self.dropped = 0
+
+    def stats(self):
+        with self._lock:
+            statements = [{
+                'statement': statement,
+                'count': stats.count,
+                'total_ms': round(stats.total_ms, 3),
+                'avg_ms': round(stats.total_ms / stats.count, 3),
+                'max_ms': round(stats.max_ms, 3),
+            } for statement, stats in self._statements.items()]
+            dropped = self.dropped
+        statements.sort(key=lambda item: item['total_ms'], reverse=True)
+        return {'statements': statements, 'dropped': dropped, 'slow_ms': self.slow_ms}
+
+
+# 进程内共享的 SQL 耗时统计
+query_stats = QueryStats()
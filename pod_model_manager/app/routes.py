@@ -1,11 +1,23 @@
-from flask import Blueprint, request, jsonify
+import logging
+
+import requests
+from flask import Blueprint, request, jsonify, abort, Response
+from sqlalchemy.exc import IntegrityError
 
 from utils.util import huggingface_repo_info
 from . import db
+from .cache import model_cache
+from .civitai_proxy import civitai_proxy
+from .model_filter import model_filter
 from .models import Model
+from .query_stats import query_stats
+from .scheduler import notify_new_jobs
 
 api_bp = Blueprint('api', __name__)
 
+# 批量接口单次请求允许的最大条数
+BATCH_LIMIT = 1000
+
 
 @api_bp.route('/models', methods=['POST'])
 def create_model():
@@ -19,12 +31,145 @@ def create_model():
     if new_model.model_type == "1":
         new_model.sha256 = huggingface_repo_info(identity).sha
     new_model.name = identity
+    new_model.priority = int(data.get('priority', 0))
     db.session.add(new_model)
     db.session.commit()
+    model_cache.invalidate(new_model.sha256)
+    notify_new_jobs()
     return jsonify({'message': '添加成功'}), 200
 
 
+@api_bp.route('/models/batch', methods=['POST'])
+def create_models():
+    """
+    批量添加模型，请求体: {"models": [{"name": ..., "model_type": ..., "priority": 可选}, ...]}
+    单个模型出错（参数缺失、Huggingface 仓库查询失败）不影响其他模型，记录在返回的 failed 中；
+    并发请求已添加的同一模型视为已存在
+    """
+    items = (request.get_json() or {}).get('models', [])
+    if len(items) > BATCH_LIMIT:
+        return jsonify({'message': f'单次最多添加{BATCH_LIMIT}个模型'}), 400
+    new_models = {}
+    failed = []
+    repo_sha = {}                                                  # 同一仓库只查询一次
+    for item in items:
+        try:
+            identity = item['name']                                # huggingface就是repoId c站就是sha256
+            sha256 = identity
+            if item['model_type'] == "1":
+                if identity not in repo_sha:
+                    repo_sha[identity] = huggingface_repo_info(identity).sha
+                sha256 = repo_sha[identity]
+            if sha256 not in new_models:
+                new_models[sha256] = Model(sha256=sha256, name=identity, model_type=item['model_type'],
+                                           priority=int(item.get('priority', 0)))
+        except Exception as e:
+            logging.warning(f"批量添加模型失败: {item}: {e}")
+            failed.append({'model': item, 'error': str(e) or type(e).__name__})
+    existing = {sha256 for (sha256,) in db.session.query(Model.sha256).filter(Model.sha256.in_(list(new_models))).all()}
+    added = [sha256 for sha256 in new_models if sha256 not in existing]
+    try:
+        db.session.add_all([new_models[sha256] for sha256 in added])
+        db.session.commit()
+    except IntegrityError:
+        # 查询之后其他请求添加了其中的模型，逐个添加，主键冲突的视为已存在
+        db.session.rollback()
+        inserted = []
+        for sha256 in added:
+            try:
+                db.session.add(new_models[sha256])
+                db.session.commit()
+                inserted.append(sha256)
+            except IntegrityError:
+                db.session.rollback()
+                existing.add(sha256)
+        added = inserted
+    if added:
+        model_cache.invalidate(*added)
+        notify_new_jobs()
+    return jsonify({'message': '添加成功', 'added': added, 'existing': sorted(existing), 'failed': failed}), 200
+
+
+@api_bp.route('/models', methods=['GET'])
+def list_models():
+    """
+    分页列出模型，按 sha256 排序（键集分页，不使用 OFFSET）
+    参数: status、model_type、name 过滤，limit 每页条数，after 上一页返回的 next
+    返回 {"models": [...], "next": 下一页的 after，没有更多时为 null}
+    """
+    limit = request.args.get('limit', 100, type=int)
+    if not 0 < limit <= BATCH_LIMIT:
+        return jsonify({'message': f'limit 取值范围 1-{BATCH_LIMIT}'}), 400
+    query = Model.query
+    for column in (Model.status, Model.model_type, Model.name):
+        value = request.args.get(column.key)
+        if value is not None:
+            query = query.filter(column == value)
+    after = request.args.get('after')
+    if after:
+        query = query.filter(Model.sha256 > after)
+    models = query.order_by(Model.sha256).limit(limit + 1).all()
+    next_after = models[limit - 1].sha256 if len(models) > limit else None
+    return jsonify({'models': [model.to_dict() for model in models[:limit]], 'next': next_after})
+
+
+@api_bp.route('/models/lookup', methods=['POST'])
+def lookup_models():
+    """批量查询模型，请求体: {"sha256": [...]}，返回 {"models": {sha256: 模型信息}}，不存在的不返回"""
+    sha256_list = (request.get_json() or {}).get('sha256', [])
+    if len(sha256_list) > BATCH_LIMIT:
+        return jsonify({'message': f'单次最多查询{BATCH_LIMIT}个模型'}), 400
+    models = Model.query.filter(Model.sha256.in_(sha256_list)).all() if sha256_list else []
+    return jsonify({'models': {model.sha256: model.to_dict() for model in models}})
+
+
 @api_bp.route('/models/<string:sha256>', methods=['GET'])
 def get_model(sha256):
-    model = Model.query.get_or_404(sha256)
-    return jsonify(model.to_dict())
+    """查询模型，结果经进程内缓存；响应带 ETag，If-None-Match 一致时返回 304"""
+    entry = model_cache.get(sha256)
+    if entry is None:
+        model = db.session.get(Model, sha256)
+        entry = model_cache.put(sha256, model.to_dict() if model is not None else None)
+    if entry.data is None:
+        abort(404)
+    response = jsonify(entry.data)
+    response.set_etag(entry.etag)
+    return response.make_conditional(request)
+
+
+@api_bp.route('/stats/cache', methods=['GET'])
+def cache_stats():
+    return jsonify(model_cache.stats())
+
+
+@api_bp.route('/stats/queries', methods=['GET'])
+def queries_stats():
+    """SQL 耗时统计，按总耗时倒序"""
+    return jsonify(query_stats.stats())
+
+
+@api_bp.route('/filters/models', methods=['GET'])
+def models_filter():
+    """已缓存模型 sha256 的布隆过滤器（utils.bloom.BloomFilter 序列化格式），版本在 X-Filter-Version 及 ETag 中"""
+    version, data = model_filter.snapshot()
+    response = Response(data, mimetype='application/octet-stream')
+    response.headers['X-Filter-Version'] = version
+    response.set_etag(version)
+    return response.make_conditional(request)
+
+
+@api_bp.route('/civitai/by-hash/<sha256>', methods=['GET'])
+def civitai_by_hash(sha256):
+    """C站 by-hash 查询代理，返回格式与C站一致（只包含 modelId 和 downloadUrl），查不到时返回 404"""
+    try:
+        found, model_id, download_url = civitai_proxy.lookup(sha256)
+    except requests.exceptions.RequestException as e:
+        return jsonify({'message': f'请求C站失败: {e}'}), 502
+    if not found:
+        return jsonify({'message': '模型不存在'}), 404
+    return jsonify({'modelId': model_id, 'downloadUrl': download_url})
+
+
+@api_bp.route('/stats/civitai', methods=['GET'])
+def civitai_stats():
+    return jsonify(civitai_proxy.stats())
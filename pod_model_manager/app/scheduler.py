@@ -1,78 +1,309 @@
-import json
 import os.path
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
 
 import huggingface_hub
 from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.schedulers.background import BackgroundScheduler
-from datetime import datetime
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
 
-from utils.util import civitai_query_model, download_file, huggingface_query_lfs
+from utils.downloader import HashMismatch, Downloader, DownloadCancelled, set_downloader
+from utils.rate_limit import TokenBucket
+from utils.util import download_file, huggingface_query_lfs
 from . import db
-from .config import MODEL_BASE_DIR
+from .cache import model_cache
+from .civitai_proxy import civitai_proxy
+from .model_filter import model_filter
+from .config import MODEL_BASE_DIR, DOWNLOAD_WORKERS, DOWNLOAD_LEASE_SECONDS, DOWNLOAD_MAX_ATTEMPTS, DOWNLOAD_POLL_SECONDS, \
+    HF_LFS_CACHE_DIR, DOWNLOAD_CONNECTIONS, DOWNLOAD_BANDWIDTH_LIMIT_MB, DOWNLOAD_PROGRESS_INTERVAL, \
+    MODEL_FILTER_REBUILD_SECONDS
 from .models import Model
 
-def scheduled_task(app):
-    with app.app_context():
-        app.logger.info(f"开始执行任务： {datetime.now()}")
-        need_down_model = Model.query.filter_by(status=0).first()
-        if need_down_model:
-            app.logger.info(f"下载模型: {need_down_model.name}")
-            need_down_model.status = 2
+# 模型状态
+STATUS_QUEUED = "0"        # 未下载（排队中）
+STATUS_DONE = "1"          # 已下载
+STATUS_DOWNLOADING = "2"   # 下载中
+STATUS_FAILED = "3"        # 下载失败（超过最大尝试次数）
+
+# 新任务唤醒事件：添加模型后调用 notify_new_jobs()，空闲的工作线程立即领取，不必等到下一次轮询
+_job_event = threading.Event()
+
+
+def notify_new_jobs():
+    _job_event.set()
+
+
+def claim_job(worker_id, lease_seconds=DOWNLOAD_LEASE_SECONDS):
+    """
+    原子领取一个排队中的任务（按优先级从高到低，同优先级先添加的先领取）
+    条件 UPDATE（status 仍为排队中才更新）保证多个工作线程/多个实例同时领取时只有一个成功
+    :return: 领取到的模型，没有排队中的任务时返回 None
+    """
+    while True:
+        candidates = [sha256 for (sha256,) in db.session.query(Model.sha256)
+                      .filter(Model.status == STATUS_QUEUED)
+                      .order_by(Model.priority.desc(), Model.created_at)
+                      .limit(8)]
+        if not candidates:
+            return None
+        for sha256 in candidates:
+            claimed = Model.query.filter(Model.sha256 == sha256, Model.status == STATUS_QUEUED).update({
+                Model.status: STATUS_DOWNLOADING,
+                Model.worker_id: worker_id,
+                Model.lease_expires_at: datetime.utcnow() + timedelta(seconds=lease_seconds),
+                Model.attempts: Model.attempts + 1,
+            }, synchronize_session=False)
             db.session.commit()
-            output_dir = f"{MODEL_BASE_DIR}/{need_down_model.model_type}"
-            os.makedirs(output_dir, exist_ok=True)
-            # C站模型处理
-            if need_down_model.model_type == "0":
-                # 查询模型ID和下载地址
-                model_id,download_url = civitai_query_model(need_down_model.name)
-                need_down_model.sha256 = need_down_model.name
-                need_down_model.download_url = download_url
-                # 下载到目录 {basedir}/0/{sha256}
-                output_file = os.path.join(output_dir,need_down_model.sha256)
-                need_down_model.cache_path = output_file
-                db.session.commit()
-                true_file_name,total_size = download_file(download_url,output_file)
-                need_down_model.true_file_name = true_file_name
-                need_down_model.size = total_size
-            elif need_down_model.model_type == "1":
-                # 获取所有需要下载的大文件
-                files = huggingface_query_lfs(need_down_model.name)
-                mode_repo_info = huggingface_hub.repo_info(need_down_model.name)
-                output_dir = f"{output_dir}/{mode_repo_info.sha}"
-                need_down_model.cache_path = output_dir
-                os.makedirs(output_dir, exist_ok=True)
-                for sha256,file_path in files.items():
-                    #判断文件是否存在
-                    if Model.query.filter_by(sha256=sha256).first() is not None:
-                        continue
-                    sub_model = Model()
-                    sub_model.name = need_down_model.name
-                    sub_model.model_type = need_down_model.model_type
-                    sub_model.cache_path = os.path.join(output_dir,sha256)
-                    sub_model.sha256 = sha256
-                    sub_model.status = 2
-                    sub_model.download_url = f"https://huggingface.co/{need_down_model.name}/resolve/main/{file_path}"
-                    db.session.add(sub_model)
-                    db.session.commit()
-                    true_file_name,total_size = download_file(sub_model.download_url,sub_model.cache_path)
-                    sub_model.true_file_name = true_file_name
-                    sub_model.size = total_size
-                    # 下载完成更新状态
-                    sub_model.status = 1
-                    db.session.commit()
-            # 下载完成后修改状态
-            need_down_model.status = 1
+            if claimed:
+                model_cache.invalidate(sha256)
+                return db.session.get(Model, sha256)
+
+
+def update_job(sha256, worker_id, values):
+    """只有仍持有租约的工作线程才能更新任务，返回是否更新成功（租约过期被重新领取时返回 False）"""
+    updated = Model.query.filter(Model.sha256 == sha256, Model.worker_id == worker_id,
+                                 Model.status == STATUS_DOWNLOADING).update(values, synchronize_session=False)
+    db.session.commit()
+    model_cache.invalidate(sha256)
+    return updated == 1
+
+
+def finish_job(sha256, worker_id, values=None):
+    values = dict(values or {})
+    values.update({Model.status: STATUS_DONE, Model.worker_id: None, Model.lease_expires_at: None, Model.error: None})
+    finished = update_job(sha256, worker_id, values)
+    if finished:
+        model_filter.add(sha256)
+    return finished
+
+
+def fail_job(sha256, worker_id, attempts, error, retry=True):
+    """下载失败：可重试且未超过最大尝试次数时重新排队，否则标记为下载失败"""
+    return update_job(sha256, worker_id, {
+        Model.status: STATUS_QUEUED if retry and attempts < DOWNLOAD_MAX_ATTEMPTS else STATUS_FAILED,
+        Model.worker_id: None,
+        Model.lease_expires_at: None,
+        Model.error: str(error)[:1024],
+    })
+
+
+class Lease:
+    """
+    下载期间定期续约的后台线程，续约失败（任务已被重新领取）时 lost 为 True
+    数据库不可用等原因一直没能续约、本地计算的租约已到期时也视为失效，避免回收任务后新旧工作线程同时写同一个文件
+    """
+
+    def __init__(self, app, sha256, worker_id, lease_seconds=DOWNLOAD_LEASE_SECONDS):
+        self.app = app
+        self.sha256 = sha256
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self._lost = False
+        self._expires_at = time.monotonic() + lease_seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat, name=f"lease-{worker_id}", daemon=True)
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            # 以发出续约请求的时间计算新的到期时间，不会晚于数据库中的到期时间
+            requested_at = time.monotonic()
+            with self.app.app_context():
+                try:
+                    renewed = update_job(self.sha256, self.worker_id, {
+                        Model.lease_expires_at: datetime.utcnow() + timedelta(seconds=self.lease_seconds)})
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.warning(f"续约失败: {self.sha256}: {e}")
+                    continue
+            if renewed:
+                self._expires_at = requested_at + self.lease_seconds
+            else:
+                self._lost = True
+                self.app.logger.warning(f"租约已失效，任务被重新领取: {self.sha256}")
+                return
+
+    @property
+    def lost(self):
+        return self._lost or time.monotonic() >= self._expires_at
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def progress_reporter(app, sha256, worker_id, interval=DOWNLOAD_PROGRESS_INTERVAL):
+    """下载进度回调，按间隔把已下载字节数写入数据库（回调在下载线程中执行）"""
+    last = [0.0]
+    lock = threading.Lock()
+
+    def report(downloaded, total):
+        now = time.monotonic()
+        with lock:
+            if now - last[0] < interval and downloaded != total:
+                return
+            last[0] = now
+        with app.app_context():
+            try:
+                update_job(sha256, worker_id, {Model.downloaded: downloaded, Model.size: total})
+            except Exception as e:
+                db.session.rollback()
+                app.logger.warning(f"更新下载进度失败: {sha256}: {e}")
+
+    return report
+
+
+def expand_huggingface_repo(app, model):
+    """Huggingface 仓库拆分为每个大文件一个下载任务，继承仓库的优先级，返回仓库缓存目录"""
+    mode_repo_info = huggingface_hub.repo_info(model.name)
+    # 文件列表及下载地址都固定到同一个提交，避免下载过程中分支更新导致文件与 sha256 不一致
+    files = huggingface_query_lfs(model.name, revision=mode_repo_info.sha, cache_dir=HF_LFS_CACHE_DIR)
+    output_dir = f"{MODEL_BASE_DIR}/{model.model_type}/{mode_repo_info.sha}"
+    os.makedirs(output_dir, exist_ok=True)
+    added = 0
+    for sha256, file_path in files.items():
+        # 判断文件是否存在
+        if db.session.get(Model, sha256) is not None:
+            continue
+        sub_model = Model()
+        sub_model.name = model.name
+        sub_model.model_type = model.model_type
+        sub_model.cache_path = os.path.join(output_dir, sha256)       # 计划的缓存路径，校验完成(status 1)后才对外发布
+        sub_model.sha256 = sha256
+        sub_model.status = STATUS_QUEUED
+        sub_model.priority = model.priority
+        sub_model.download_url = f"https://huggingface.co/{model.name}/resolve/{mode_repo_info.sha}/{file_path}"
+        db.session.add(sub_model)
+        try:
             db.session.commit()
-            app.logger.info(f"Model {need_down_model.name} downloaded")
-        else:
-            app.logger.info("No model to download")
+            model_cache.invalidate(sha256)
+            added += 1
+        except IntegrityError:
+            # 其他仓库同时添加了同一个文件
+            db.session.rollback()
+    app.logger.info(f"仓库 {model.name} 拆分出 {added} 个下载任务")
+    if added:
+        notify_new_jobs()
+    return output_dir
+
+
+def run_job(app, model, worker_id):
+    """执行一个已领取的下载任务"""
+    sha256 = model.sha256
+    app.logger.info(f"下载模型: {model.name} ({sha256})")
+    with Lease(app, sha256, worker_id) as lease:
+        values = {}
+        # C站模型处理
+        if model.model_type == "0":
+            # 查询模型ID和下载地址（经过C站查询代理的数据库缓存，与客户端查询共用）
+            model_id, download_url = civitai_proxy.resolve(model.name)
+            output_dir = f"{MODEL_BASE_DIR}/{model.model_type}"
+            os.makedirs(output_dir, exist_ok=True)
+            # 下载到目录 {basedir}/0/{sha256}，校验通过后才发布缓存路径
+            output_file = os.path.join(output_dir, sha256)
+            update_job(sha256, worker_id, {Model.download_url: download_url})
+            true_file_name, total_size = download_file(download_url, output_file, expected_sha256=sha256,
+                                                       progress=progress_reporter(app, sha256, worker_id),
+                                                       cancelled=lambda: lease.lost)
+            values = {Model.true_file_name: true_file_name, Model.size: total_size, Model.cache_path: output_file}
+        elif model.model_type == "1" and model.download_url is None:
+            # Huggingface 仓库：拆分为文件下载任务
+            values = {Model.cache_path: expand_huggingface_repo(app, model)}
+        elif model.model_type == "1":
+            # Huggingface 仓库中的单个文件，sha256 即 LFS 文件的 sha256
+            true_file_name, total_size = download_file(model.download_url, model.cache_path, expected_sha256=sha256,
+                                                       progress=progress_reporter(app, sha256, worker_id),
+                                                       cancelled=lambda: lease.lost)
+            values = {Model.true_file_name: true_file_name, Model.size: total_size}
+        if Model.size in values:
+            values[Model.downloaded] = values[Model.size]
+        if lease.lost or not finish_job(sha256, worker_id, values):
+            app.logger.warning(f"任务已被其他工作线程领取，丢弃结果: {sha256}")
+            return
+    app.logger.info(f"Model {model.name} downloaded")
+
+
+def download_worker(app, worker_id):
+    """下载工作线程：循环领取任务，没有任务时等待唤醒或轮询"""
+    while True:
+        with app.app_context():
+            try:
+                model = claim_job(worker_id)
+                if model is not None:
+                    sha256, attempts = model.sha256, model.attempts
+                    try:
+                        run_job(app, model, worker_id)
+                    except DownloadCancelled:
+                        # 租约已失效，任务由其他工作线程继续下载（续用 .part 文件）
+                        app.logger.warning(f"租约已失效，停止下载: {sha256}")
+                        db.session.rollback()
+                    except HashMismatch as e:
+                        # 内容与 sha256 不一致，重试也不会得到正确的文件
+                        app.logger.error(f"下载模型校验失败: {sha256}: {e}")
+                        db.session.rollback()
+                        fail_job(sha256, worker_id, attempts, e, retry=False)
+                    except Exception as e:
+                        app.logger.exception(f"下载模型失败: {sha256}")
+                        db.session.rollback()
+                        fail_job(sha256, worker_id, attempts, e)
+                    continue
+            except Exception:
+                app.logger.exception("领取下载任务失败")
+                db.session.rollback()
+        _job_event.wait(DOWNLOAD_POLL_SECONDS)
+        _job_event.clear()
+
+
+def requeue_expired_jobs(app):
+    """租约过期（工作线程崩溃/实例退出）的下载中任务重新排队，超过最大尝试次数的标记为下载失败"""
+    with app.app_context():
+        expired = (Model.status == STATUS_DOWNLOADING) & or_(Model.lease_expires_at.is_(None),
+                                                            Model.lease_expires_at < datetime.utcnow())
+        failed = Model.query.filter(expired, Model.attempts >= DOWNLOAD_MAX_ATTEMPTS).update({
+            Model.status: STATUS_FAILED, Model.worker_id: None, Model.lease_expires_at: None,
+            Model.error: "下载租约过期"}, synchronize_session=False)
+        requeued = Model.query.filter(expired, Model.attempts < DOWNLOAD_MAX_ATTEMPTS).update({
+            Model.status: STATUS_QUEUED, Model.worker_id: None, Model.lease_expires_at: None},
+            synchronize_session=False)
+        db.session.commit()
+        if failed or requeued:
+            # 批量更新无法确定具体的模型，清空缓存
+            model_cache.clear()
+            app.logger.info(f"租约过期任务: 重新排队 {requeued} 个, 标记失败 {failed} 个")
+        if requeued:
+            notify_new_jobs()
+
+
+def rebuild_model_filter(app):
+    with app.app_context():
+        model_filter.rebuild()
+
+
+def start_scheduler(app, workers=DOWNLOAD_WORKERS):
+    # 所有工作线程共享一个下载器：同一主机复用连接，共享总带宽限速
+    rate = DOWNLOAD_BANDWIDTH_LIMIT_MB * 1024 * 1024
+    set_downloader(Downloader(connections=DOWNLOAD_CONNECTIONS, pool_maxsize=DOWNLOAD_CONNECTIONS * workers,
+                              rate_limiter=TokenBucket(rate, capacity=rate // 4) if rate > 0 else None))
+
+    # 启动下载工作线程
+    for n in range(workers):
+        worker_id = f"{socket.gethostname()}-{os.getpid()}-{n}"
+        threading.Thread(target=download_worker, args=(app, worker_id), name=f"download-{n}", daemon=True).start()
 
-def start_scheduler(app):
-    # 创建调度器并设置线程池执行器，最大并发任务数为 3
-    scheduler = BackgroundScheduler(executors={'default': ThreadPoolExecutor(3)})
+    # 定时回收租约过期的任务
+    scheduler = BackgroundScheduler(executors={'default': ThreadPoolExecutor(2)})
+    scheduler.add_job(func=requeue_expired_jobs, args=(app,), trigger="interval",
+                      seconds=max(1, DOWNLOAD_LEASE_SECONDS // 2), max_instances=1)
 
-    # 添加任务，设置最大并发任务实例数为 3
-    scheduler.add_job(func=scheduled_task, args=(app,), trigger="interval", seconds=10, max_instances=3)
+    # 定时全量重建已缓存模型的布隆过滤器
+    scheduler.add_job(func=rebuild_model_filter, args=(app,), trigger="interval",
+                      seconds=MODEL_FILTER_REBUILD_SECONDS, max_instances=1)
 
     # 启动调度器
-    scheduler.start()
\ No newline at end of file
+    scheduler.start()
@@ -0,0 +1,7 @@
+-- 下载队列：优先级、工作线程租约、重试次数及失败原因
+ALTER TABLE model ADD COLUMN priority INT NOT NULL DEFAULT 0;
+ALTER TABLE model ADD COLUMN worker_id VARCHAR(64) NULL;
+ALTER TABLE model ADD COLUMN lease_expires_at DATETIME NULL;
+ALTER TABLE model ADD COLUMN attempts INT NOT NULL DEFAULT 0;
+ALTER TABLE model ADD COLUMN error VARCHAR(1024) NULL;
+CREATE INDEX ix_model_status_priority ON model (status, priority);
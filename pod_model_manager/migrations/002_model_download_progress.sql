@@ -0,0 +1,3 @@
+-- 下载进度；模型大小超过 2GB 时 INT 会溢出，改为 BIGINT
+ALTER TABLE model ADD COLUMN downloaded BIGINT NULL;
+ALTER TABLE model MODIFY COLUMN size BIGINT NULL;
@@ -0,0 +1,8 @@
+-- C站 by-hash 查询结果缓存（含查不到的负缓存）
+CREATE TABLE civitai_lookup (
+    sha256 VARCHAR(128) NOT NULL PRIMARY KEY,
+    found BOOLEAN NOT NULL,
+    model_id BIGINT NULL,
+    download_url VARCHAR(1024) NULL,
+    checked_at DATETIME NOT NULL
+);
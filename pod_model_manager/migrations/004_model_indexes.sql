@@ -0,0 +1,3 @@
+-- 按状态过滤并按 sha256 分页（GET /models）、按仓库/名称查询
+CREATE INDEX ix_model_status_sha256 ON model (status, sha256);
+CREATE INDEX ix_model_type_name ON model (model_type, name);
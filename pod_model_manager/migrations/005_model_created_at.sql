@@ -0,0 +1,4 @@
+-- 添加时间：同优先级的任务按添加顺序领取，避免旧任务饿死；已有数据取迁移时间
+ALTER TABLE model ADD COLUMN created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP;
+DROP INDEX ix_model_status_priority ON model;
+CREATE INDEX ix_model_status_priority ON model (status, priority DESC, created_at);
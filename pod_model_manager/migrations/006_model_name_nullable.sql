@@ -0,0 +1,2 @@
+-- 批量导入时无法确定仓库的 Huggingface 文件 name 为空
+ALTER TABLE model MODIFY COLUMN name VARCHAR(256) NULL;
@@ -0,0 +1,4 @@
+-- GET /models 按类型（及名称）过滤时按 sha256 键集分页，索引需要包含 sha256 才能直接按顺序读取
+CREATE INDEX ix_model_type_sha256 ON model (model_type, sha256);
+DROP INDEX ix_model_type_name ON model;
+CREATE INDEX ix_model_type_name ON model (model_type, name, sha256);
@@ -0,0 +1,69 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import zipfile
+
+from utils.archive import ModelZipWriter
+
+
+class ModelZipWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.zip_file = os.path.join(self.tmp_dir, "pod.zip")
+        self.files = {}
+        for name, data in (("keep.bin", b"k" * 4096), ("drop.bin", b"d" * 8192), ("other.bin", b"o" * 1024)):
+            path = os.path.join(self.tmp_dir, name)
+            with open(path, "wb") as f:
+                f.write(data)
+            self.files[name] = (path, hashlib.sha256(data).hexdigest(), data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_keep_and_drop_last(self):
+        with zipfile.ZipFile(self.zip_file, "w") as z:
+            writer = ModelZipWriter(z, 1024)
+            path, sha256, _ = self.files["keep.bin"]
+            self.assertEqual(writer.write_hashed(path, "models/keep.bin", lambda h: True), sha256)
+            path, _, _ = self.files["drop.bin"]
+            writer.write_hashed(path, "models/drop.bin", lambda h: False)
+            # 同一模型只保留一次
+            path, _, _ = self.files["keep.bin"]
+            writer.write_hashed(path, "models/keep2.bin", lambda h: True)
+        self.assertEqual((writer.single_pass_count, writer.dropped_count, writer.orphan_bytes), (1, 2, 0))
+        with zipfile.ZipFile(self.zip_file) as z:
+            self.assertEqual(z.namelist(), ["models/keep.bin"])
+            self.assertIsNone(z.testzip())
+
+    def test_decide_outside_lock(self):
+        # decide 期间其他线程可以继续写入，之后丢弃的条目不是最后一个，只从中央目录移除
+        deciding = threading.Event()
+        written = threading.Event()
+
+        def decide(sha256):
+            deciding.set()
+            self.assertTrue(written.wait(5))
+            return False
+
+        with zipfile.ZipFile(self.zip_file, "w") as z:
+            writer = ModelZipWriter(z, 1024)
+            path, _, data = self.files["drop.bin"]
+            thread = threading.Thread(target=writer.write_hashed, args=(path, "models/drop.bin", decide))
+            thread.start()
+            self.assertTrue(deciding.wait(5))
+            path, sha256, _ = self.files["other.bin"]
+            self.assertTrue(writer.write(path, "models/other.bin", sha256))
+            written.set()
+            thread.join()
+        self.assertEqual((writer.dropped_count, writer.orphan_bytes), (1, len(data)))
+        with zipfile.ZipFile(self.zip_file) as z:
+            self.assertEqual(z.namelist(), ["models/other.bin"])
+            self.assertEqual(z.read("models/other.bin"), self.files["other.bin"][2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import hashlib
+import http.server
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+
+from utils.downloader import Downloader, DownloadCancelled, HashMismatch, PART_SUFFIX, STATE_SUFFIX
+
+DATA = os.urandom(5 * 1024 * 1024 + 123)
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """支持 Range 的文件服务器，server.ranges 为 False 时忽略 Range 返回完整文件"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests += 1
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range") or "")
+        if match and self.server.ranges:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(DATA) - 1
+            body = DATA[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(DATA)}")
+        else:
+            body = DATA
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Disposition", 'attachment; filename="model.safetensors"')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class DownloaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.ranges = True
+        self.server.requests = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/file"
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output = os.path.join(self.tmp_dir, "model")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def assertDownloaded(self, result):
+        self.assertEqual(result, ("model.safetensors", len(DATA)))
+        with open(self.output, "rb") as f:
+            self.assertEqual(f.read(), DATA)
+        self.assertFalse(os.path.exists(self.output + PART_SUFFIX))
+        self.assertFalse(os.path.exists(self.output + STATE_SUFFIX))
+
+    def test_single_stream_verified(self):
+        # 小于分段阈值，单连接下载
+        downloader = Downloader(min_segmented_size=len(DATA) + 1)
+        self.assertDownloaded(downloader.download(self.url, self.output, expected_sha256=SHA256))
+
+    def test_segmented_verified(self):
+        downloader = Downloader(connections=4, segment_size=1024 * 1024, min_segmented_size=1024 * 1024)
+        self.assertDownloaded(downloader.download(self.url, self.output, expected_sha256=SHA256.upper()))
+        # 探测请求 + 6 个分段
+        self.assertEqual(self.server.requests, 7)
+
+    def test_no_range_verified(self):
+        self.server.ranges = False
+        downloader = Downloader(segment_size=1024 * 1024, min_segmented_size=1024 * 1024)
+        self.assertDownloaded(downloader.download(self.url, self.output, expected_sha256=SHA256))
+
+    def test_hash_mismatch(self):
+        for downloader in (Downloader(min_segmented_size=len(DATA) + 1),
+                           Downloader(segment_size=1024 * 1024, min_segmented_size=1024 * 1024)):
+            with self.assertRaises(HashMismatch):
+                downloader.download(self.url, self.output, expected_sha256="0" * 64)
+            self.assertFalse(os.path.exists(self.output))
+            self.assertFalse(os.path.exists(self.output + PART_SUFFIX))
+            self.assertFalse(os.path.exists(self.output + STATE_SUFFIX))
+
+    def test_cancelled(self):
+        for downloader in (Downloader(min_segmented_size=len(DATA) + 1),
+                           Downloader(connections=2, segment_size=1024 * 1024, min_segmented_size=1024 * 1024)):
+            if os.path.exists(self.output):
+                os.remove(self.output)
+            calls = []
+            with self.assertRaises(DownloadCancelled):
+                downloader.download(self.url, self.output, expected_sha256=SHA256,
+                                    cancelled=lambda: calls.append(1) or len(calls) > 2)
+            self.assertFalse(os.path.exists(self.output))
+            # 临时文件保留，重新下载时续传
+            self.assertTrue(os.path.exists(self.output + PART_SUFFIX))
+            self.assertDownloaded(downloader.download(self.url, self.output, expected_sha256=SHA256))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from const.app_config import Plugin
+from utils.git_mirror import GitMirrorCache
+from utils.plugin_restore import restore_plugins
+
+
+def _git(*args):
+    return subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args], check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True).stdout.strip()
+
+
+class GitMirrorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        # 本地裸仓库作为插件远端，两个提交
+        work = os.path.join(self.tmp_dir, "work")
+        _git('init', '-q', '-b', 'main', work)
+        self.commits = []
+        for content in ("v1", "v2"):
+            with open(os.path.join(work, "node.py"), "w") as f:
+                f.write(content)
+            _git('-C', work, 'add', 'node.py')
+            _git('-C', work, 'commit', '-q', '-m', content)
+            self.commits.append(_git('-C', work, 'rev-parse', 'HEAD'))
+        remote = os.path.join(self.tmp_dir, "remote", "my-node.git")
+        _git('clone', '-q', '--bare', work, remote)
+        self.remote_url = f"file://{remote}"
+        self.plugins_dir = os.path.join(self.tmp_dir, "custom_nodes")
+        os.makedirs(self.plugins_dir)
+        self.report_file = os.path.join(self.tmp_dir, "report.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def assertRestored(self, commit):
+        clone_path = os.path.join(self.plugins_dir, "my-node")
+        self.assertEqual(_git('-C', clone_path, 'rev-parse', 'HEAD'), commit)
+        with open(os.path.join(clone_path, "node.py")) as f:
+            self.assertEqual(f.read(), "v1" if commit == self.commits[0] else "v2")
+
+    def test_shallow(self):
+        plugin = Plugin(name="my-node", remote_url=self.remote_url, commit_log=self.commits[0])
+        report = restore_plugins([plugin], self.plugins_dir, report_file=self.report_file)
+        self.assertEqual((report["ok"], report["failed"]), (1, 0))
+        self.assertEqual(report["plugins"][0]["mode"], "shallow")
+        self.assertRestored(self.commits[0])
+        # 已是指定提交时不再拉取
+        report = restore_plugins([plugin], self.plugins_dir)
+        self.assertEqual(report["plugins"][0]["mode"], "exists")
+
+    def test_mirror(self):
+        mirror_cache = GitMirrorCache(os.path.join(self.tmp_dir, "mirrors"))
+        for commit in self.commits:
+            shutil.rmtree(os.path.join(self.plugins_dir, "my-node"), ignore_errors=True)
+            plugin = Plugin(name="my-node", remote_url=self.remote_url, commit_log=commit)
+            report = restore_plugins([plugin], self.plugins_dir, report_file=self.report_file, mirror_cache=mirror_cache)
+            self.assertEqual(report["plugins"][0]["mode"], "mirror")
+            self.assertRestored(commit)
+        # 第一次创建镜像，第二次镜像中已有该提交
+        self.assertEqual((mirror_cache.hits, mirror_cache.misses), (1, 1))
+        mirror_path = mirror_cache.mirror_path(self.remote_url)
+        self.assertTrue(os.path.isdir(mirror_path))
+        # 插件的 origin 仍是远端地址
+        self.assertEqual(_git('-C', os.path.join(self.plugins_dir, "my-node"), 'remote', 'get-url', 'origin'),
+                         self.remote_url)
+        self.assertEqual(mirror_cache.expire(0), [mirror_path])
+        self.assertFalse(os.path.exists(mirror_path))
+
+    def test_failure_report(self):
+        mirror_cache = GitMirrorCache(os.path.join(self.tmp_dir, "mirrors"))
+        plugins = [Plugin(name="my-node", remote_url=self.remote_url, commit_log=self.commits[1]),
+                   Plugin(name="missing", remote_url=f"file://{self.tmp_dir}/remote/missing.git",
+                          commit_log=self.commits[1])]
+        for cache in (None, mirror_cache):
+            shutil.rmtree(os.path.join(self.plugins_dir, "my-node"), ignore_errors=True)
+            report = restore_plugins(plugins, self.plugins_dir, report_file=self.report_file, mirror_cache=cache)
+            self.assertEqual((report["ok"], report["failed"]), (1, 1))
+            with open(self.report_file) as f:
+                records = {record["name"]: record for record in json.load(f)["plugins"]}
+            self.assertTrue(records["my-node"]["ok"])
+            self.assertFalse(records["missing"]["ok"])
+            self.assertIn("missing.git", records["missing"]["error"])
+            self.assertNotIn("mode", records["missing"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from const.app_config import PodConfig, Model
+from utils.link_plan import build_link_plan, apply_link_plan, verify_link_plan, unavailable_models
+
+
+class BuildLinkPlanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.base_dir = os.path.join(self.tmp_dir, "poddata")
+        self.app_dir = os.path.join(self.tmp_dir, "app")
+        os.makedirs(os.path.join(self.base_dir, "models"))
+        with open(os.path.join(self.base_dir, "models", "up.bin"), "w") as f:
+            f.write("up")
+        models = [
+            # 客户上传的模型
+            Model(model_name="up.bin", model_id=None, sha256="u" * 64, cache_path=None, file_path=["up.bin"],
+                  download_url=None),
+            # C站模型，尚未下载到缓存
+            Model(model_name="c.bin", model_id=1, sha256="c" * 64, cache_path=None, file_path=["c.bin", "lora/c.bin"],
+                  download_url="https://civitai.com/api/download/models/1"),
+        ]
+        self.pod_config = PodConfig(app_dir="/app", app_type="ComfyUI", model_dir="models", plugin_dir="custom_nodes",
+                                    python="python", python_version="3.11", models=models, plugins=[], packages=[])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_skip_uncached_models(self):
+        self.assertEqual([model.sha256 for model in unavailable_models(self.pod_config)], ["c" * 64])
+        plan = build_link_plan(self.pod_config, self.base_dir, self.app_dir, "models")
+        self.assertEqual(plan, [(os.path.join(self.base_dir, "models", "up.bin"),
+                                 os.path.join(self.app_dir, "models", "up.bin"))])
+        self.assertEqual(verify_link_plan(plan)["problems"], [])
+        report = apply_link_plan(plan)
+        self.assertEqual((report["created"], report["dangling"]), (1, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
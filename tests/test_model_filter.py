@@ -0,0 +1,47 @@
+import unittest
+
+from flask import Flask
+
+from pod_model_manager.app import db
+from pod_model_manager.app.model_filter import ModelFilter
+from pod_model_manager.app.models import Model
+
+
+class ModelFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        db.session.add(Model(sha256="a" * 64, name="a", model_type="0", status="1"))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        self.context.pop()
+
+    def test_snapshot_rebuilds_when_dropped_concurrently(self):
+        model_filter = ModelFilter()
+        rebuild = model_filter.rebuild
+        calls = []
+
+        def rebuild_then_overflow():
+            rebuild()
+            calls.append(1)
+            if len(calls) == 1:
+                # 重建完成后、snapshot 取得锁之前，并发的 add 超过容量丢弃了过滤器
+                model_filter._capacity = model_filter._bloom.count
+                model_filter.add("b" * 64)
+
+        model_filter.rebuild = rebuild_then_overflow
+        version, data = model_filter.snapshot()
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(version.endswith("-0"))
+        self.assertTrue(data)
+
+
+if __name__ == "__main__":
+    unittest.main()
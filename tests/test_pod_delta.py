@@ -0,0 +1,99 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from const.app_config import PodConfig, Model
+from utils.link_plan import build_link_plan, apply_link_plan
+from utils.pod_delta import apply_delta, build_delta_manifest, config_fingerprint, DELTA_MANIFEST_NAME, POD_CONFIG_NAME
+
+
+def _model(sha256, file_path, cache_path=None):
+    return Model(model_name=os.path.basename(file_path[0]), model_id=None, sha256=sha256, cache_path=cache_path,
+                 file_path=file_path, download_url=None)
+
+
+def _config(models):
+    return PodConfig(app_dir="/app", app_type="ComfyUI", model_dir="models", plugin_dir="custom_nodes",
+                     python="python", python_version="3.11", models=models, plugins=[], packages=[])
+
+
+def _tree(root):
+    """目录下所有文件及软连接的相对路径"""
+    paths = set()
+    for dir_path, _, file_names in os.walk(root):
+        for file_name in file_names:
+            paths.add(os.path.relpath(os.path.join(dir_path, file_name), root))
+    return paths
+
+
+class ApplyDeltaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.base_dir = os.path.join(self.tmp_dir, "poddata")
+        self.poddata_models = os.path.join(self.base_dir, "models")
+        self.app_dir = os.path.join(self.tmp_dir, "app")
+        self.app_models = os.path.join(self.app_dir, "models")
+        cache_dir = os.path.join(self.tmp_dir, "cache")
+        os.makedirs(cache_dir)
+        self.cache = {}
+        for name in ("a", "k"):
+            self.cache[name] = os.path.join(cache_dir, name)
+            with open(self.cache[name], "w") as f:
+                f.write(name)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def restore_links(self, pod_config):
+        report = apply_link_plan(build_link_plan(pod_config, self.base_dir, self.app_dir, "models"))
+        self.assertEqual(report["problems"], [])
+
+    def test_removed_and_moved_models_leave_no_stale_links(self):
+        base_config = _config([
+            _model("a" * 64, ["a/cached.bin"], self.cache["a"]),      # 删除的缓存模型
+            _model("k" * 64, ["keep/k.bin"], self.cache["k"]),        # 不变的缓存模型
+            _model("b" * 64, ["big.bin"]),                            # 移动的上传模型
+            _model("r" * 64, ["r.bin"]),                              # 删除的上传模型
+        ])
+        base_data = base_config.model_dump_json().encode()
+        os.makedirs(self.poddata_models)
+        for name in ("big.bin", "r.bin"):
+            with open(os.path.join(self.poddata_models, name), "w") as f:
+                f.write(name)
+        with open(os.path.join(self.base_dir, POD_CONFIG_NAME), "wb") as f:
+            f.write(base_data)
+        self.restore_links(base_config)
+
+        pod_config = _config([
+            _model("k" * 64, ["keep/k.bin"], self.cache["k"]),
+            _model("b" * 64, ["sub/big.bin"]),
+            _model("n" * 64, ["n.bin"]),                              # 新上传的模型
+        ])
+        delta_file = os.path.join(self.tmp_dir, "pod_delta.zip")
+        with zipfile.ZipFile(delta_file, "w") as z:
+            z.writestr(POD_CONFIG_NAME, pod_config.model_dump_json())
+            z.writestr(DELTA_MANIFEST_NAME, json.dumps(
+                build_delta_manifest(base_config, config_fingerprint(base_data), pod_config)))
+            z.writestr("models/n.bin", "n.bin")
+
+        self.assertTrue(apply_delta(delta_file, self.base_dir, self.app_models))
+        self.restore_links(pod_config)
+
+        expected = {"keep/k.bin", "sub/big.bin", "n.bin"}
+        self.assertEqual(_tree(self.poddata_models), expected)
+        self.assertEqual(_tree(self.app_models), expected)
+        for root in (self.poddata_models, self.app_models):
+            for file_path in expected:
+                self.assertTrue(os.path.exists(os.path.join(root, file_path)), f"悬空: {root}/{file_path}")
+        with open(os.path.join(self.app_models, "sub/big.bin")) as f:
+            self.assertEqual(f.read(), "big.bin")
+        # 再次应用时跳过
+        self.assertFalse(apply_delta(delta_file, self.base_dir, self.app_models))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+from pod_model_manager.app import db
+from pod_model_manager.app.models import Model
+from pod_model_manager.app.query_stats import query_stats
+from pod_model_manager.app.routes import api_bp
+
+
+class ListModelsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.app.register_blueprint(api_bp)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        query_stats.install(db.engine)
+        for index in range(30):
+            db.session.add(Model(sha256=f"{index:064x}", name=f"repo{index % 3}", model_type=str(index % 2),
+                                 status=str(index % 4)))
+        db.session.commit()
+        query_stats.reset()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def list_all(self, **params):
+        """按页取完所有结果，返回 (sha256 列表, 页数)"""
+        sha256_list, pages, after = [], 0, None
+        while True:
+            response = self.client.get('/models', query_string={**params, **({'after': after} if after else {})})
+            self.assertEqual(response.status_code, 200)
+            pages += 1
+            sha256_list += [model['sha256'] for model in response.json['models']]
+            after = response.json['next']
+            if after is None:
+                return sha256_list, pages
+
+    def test_keyset_pagination(self):
+        sha256_list, pages = self.list_all(limit=7)
+        self.assertEqual(sha256_list, [f"{index:064x}" for index in range(30)])
+        self.assertEqual(pages, 5)
+        self.assertEqual(self.client.get('/models', query_string={'limit': 0}).status_code, 400)
+
+    def test_filters(self):
+        sha256_list, _ = self.list_all(limit=4, status='1')
+        self.assertEqual(sha256_list, [f"{index:064x}" for index in range(30) if index % 4 == 1])
+        sha256_list, _ = self.list_all(limit=4, model_type='0', name='repo1')
+        self.assertEqual(sha256_list, [f"{index:064x}" for index in range(30) if index % 2 == 0 and index % 3 == 1])
+
+    def test_filtered_pages_use_index_order(self):
+        # 过滤后按 sha256 排序应由索引直接提供，不需要临时排序
+        for column, value in (('status', '1'), ('model_type', '0')):
+            plan = db.session.execute(db.text(
+                f"EXPLAIN QUERY PLAN SELECT sha256 FROM model WHERE {column} = :value AND sha256 > :after "
+                f"ORDER BY sha256 LIMIT 10"), {'value': value, 'after': ''}).all()
+            detail = " ".join(row[-1] for row in plan)
+            self.assertIn("USING", detail)
+            self.assertNotIn("TEMP B-TREE", detail)
+
+    def test_query_stats(self):
+        self.list_all(limit=10)
+        statements = self.client.get('/stats/queries').json['statements']
+        selects = [item for item in statements if item['statement'].startswith('SELECT') and 'FROM model' in item['statement']]
+        self.assertEqual(sum(item['count'] for item in selects), 3)
+        self.assertTrue(all(item['max_ms'] >= item['avg_ms'] >= 0 for item in selects))
+
+
+class CreateModelsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.app.register_blueprint(api_bp)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def post(self, models):
+        response = self.client.post('/models/batch', json={'models': models})
+        self.assertEqual(response.status_code, 200)
+        return response.json
+
+    def test_failed_items_reported(self):
+        def repo_info(repo_id):
+            if repo_id == "bad/repo":
+                raise ValueError("仓库不存在")
+            return mock.Mock(sha="f" * 64)
+
+        with mock.patch('pod_model_manager.app.routes.huggingface_repo_info', side_effect=repo_info) as info, \
+                mock.patch('pod_model_manager.app.routes.notify_new_jobs'):
+            result = self.post([{'name': "a" * 64, 'model_type': '0'},
+                                {'name': "bad/repo", 'model_type': '1'},
+                                {'name': "good/repo", 'model_type': '1'},
+                                {'name': "good/repo", 'model_type': '1'},
+                                {'model_type': '0'}])
+        self.assertEqual(info.call_count, 2)
+        self.assertEqual(result['added'], ["a" * 64, "f" * 64])
+        self.assertEqual([item['model'].get('name') for item in result['failed']], ["bad/repo", None])
+        self.assertEqual(Model.query.count(), 2)
+
+    def test_concurrent_insert_is_existing(self):
+        db.session.add(Model(sha256="b" * 64, name="b" * 64, model_type='0'))
+        db.session.commit()
+        # 模拟查询已存在模型之后，其他请求才添加了同一模型
+        with mock.patch.object(db.session, 'query'), mock.patch('pod_model_manager.app.routes.notify_new_jobs'):
+            result = self.post([{'name': "a" * 64, 'model_type': '0'}, {'name': "b" * 64, 'model_type': '0'}])
+        self.assertEqual(result['added'], ["a" * 64])
+        self.assertEqual(result['existing'], ["b" * 64])
+        self.assertEqual(result['failed'], [])
+        self.assertEqual(Model.query.count(), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import hashlib
+import logging
+import threading
+import zipfile
+
+from utils.util import HASH_BUFFER_SIZE
+
+
+class ModelZipWriter:
+    """
+    线程安全的模型压缩包写入器，每个 sha256 只打包一次
+    支持"单次读取"模式：边读文件边计算 sha256 边写入压缩包条目，读完后再决定是否保留，
+    不需要的条目（云端已缓存/C站存在/重复模型）丢弃，需要上传的大模型只从磁盘读取一次
+    """
+
+    def __init__(self, z: zipfile.ZipFile, buffer_size=HASH_BUFFER_SIZE):
+        self.z = z
+        self.buffer_size = buffer_size
+        self.archived = {}          # sha256 -> 压缩包内路径
+        self.single_pass_count = 0  # 单次读取并保留的条目数
+        self.dropped_count = 0      # 推测写入后丢弃的条目数
+        self.dropped_bytes = 0
+        self.orphan_bytes = 0       # 无法截断、只从中央目录移除的条目数据大小
+        self._lock = threading.Lock()
+
+    def write(self, file_path, arcname, sha256):
+        """打包文件，同一 sha256 已打包过时跳过，返回是否写入"""
+        with self._lock:
+            if sha256 in self.archived:
+                return False
+            self.z.write(file_path, arcname)
+            self.archived[sha256] = arcname
+            return True
+
+    def write_hashed(self, file_path, arcname, decide):
+        """
+        单次读取：边计算 sha256 边写入压缩包，随后调用 decide(sha256) 决定是否保留该条目
+        只在追加条目（本地文件头及数据）期间持有锁，decide 可能请求网络，在锁外调用；
+        丢弃时条目仍是最后一个则直接截断，否则只从中央目录移除（数据留在压缩包中，计入 orphan_bytes）
+        :param decide: 回调，参数为 sha256，返回 True 保留条目，False 丢弃
+        :return: sha256
+        """
+        zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+        sha256_hash = hashlib.sha256()
+        buffer = bytearray(self.buffer_size)
+        view = memoryview(buffer)
+        with self._lock:
+            with open(file_path, "rb", buffering=0) as src, self.z.open(zinfo, "w") as dst:
+                while True:
+                    size = src.readinto(buffer)
+                    if not size:
+                        break
+                    sha256_hash.update(view[:size])
+                    dst.write(view[:size])
+            sha256 = sha256_hash.hexdigest()
+            keep = sha256 not in self.archived
+        keep = keep and decide(sha256)
+        with self._lock:
+            # decide 期间其他线程可能已经打包了同一模型
+            if keep and sha256 not in self.archived:
+                self.archived[sha256] = arcname
+                self.single_pass_count += 1
+            else:
+                self._drop(zinfo)
+        return sha256
+
+    def _drop(self, zinfo):
+        """丢弃条目：最后一个条目直接截断，否则只从中央目录移除，需要持有锁"""
+        z = self.z
+        if z.filelist and z.filelist[-1] is zinfo:
+            z.fp.seek(zinfo.header_offset)
+            z.fp.truncate()
+            z.start_dir = zinfo.header_offset
+            z.filelist.pop()
+        else:
+            z.filelist.remove(zinfo)
+            self.orphan_bytes += zinfo.compress_size
+            logging.warning(f"丢弃的条目之后已写入其他条目，数据保留在压缩包中: {zinfo.filename}")
+        del z.NameToInfo[zinfo.filename]
+        self.dropped_count += 1
+        self.dropped_bytes += zinfo.file_size
+        logging.info(f"丢弃推测写入的条目: {zinfo.filename}")
@@ -0,0 +1,55 @@
+import math
+import struct
+
+# 序列化格式: 魔数(4) 哈希函数个数(1) 位数(8) 元素个数(8)，随后为位数组
+_HEADER = struct.Struct(">4sBQQ")
+_MAGIC = b"BLM1"
+
+
+class BloomFilter:
+    """
+    sha256 集合的布隆过滤器，用于客户端在本地判断"一定不存在"的模型，跳过网络查询
+    sha256 本身是均匀分布的，直接取其中两段作为双重哈希的两个基值，不需要再计算哈希
+    """
+
+    def __init__(self, num_bits, num_hashes, bits=None, count=0):
+        self.num_bits = max(8, num_bits)
+        self.num_hashes = max(1, num_hashes)
+        self.bits = bits if bits is not None else bytearray((self.num_bits + 7) // 8)
+        self.count = count
+
+    @classmethod
+    def for_capacity(cls, capacity, false_positive_rate=0.01):
+        """按预计元素个数及误判率计算位数和哈希函数个数"""
+        capacity = max(1, capacity)
+        num_bits = int(math.ceil(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        num_hashes = max(1, int(round(num_bits / capacity * math.log(2))))
+        return cls(num_bits, num_hashes)
+
+    def _positions(self, sha256):
+        sha256 = sha256.lower()
+        h1 = int(sha256[0:16], 16)
+        h2 = int(sha256[16:32], 16) | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, sha256):
+        for position in self._positions(sha256):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, sha256):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(sha256))
+
+    def to_bytes(self):
+        return _HEADER.pack(_MAGIC, self.num_hashes, self.num_bits, self.count) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, num_hashes, num_bits, count = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError("不是有效的布隆过滤器数据")
+        bits = bytearray(data[_HEADER.size:])
+        if len(bits) != (num_bits + 7) // 8:
+            raise ValueError("布隆过滤器数据长度不正确")
+        return cls(num_bits, num_hashes, bits, count)
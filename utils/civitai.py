@@ -0,0 +1,127 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from const.app_config import POD_MANAGER_URL
+from utils.rate_limit import TokenBucket
+
+CIVITAI_BY_HASH_URL = "https://civitai.com/api/v1/model-versions/by-hash"
+# 晨羽缓存的C站查询代理（服务端数据库缓存，返回格式与C站一致）
+CIVITAI_PROXY_URL = f"{POD_MANAGER_URL}/civitai/by-hash"
+# 查询结果在 LookupCache 中的命名空间
+LOOKUP_NAMESPACE = "civitai"
+
+
+class CivitaiResolver:
+    """
+    C站 by-hash 查询器
+    复用连接池，令牌桶限速，429/5xx 自动退避重试，支持线程池并发批量查询
+    默认经过晨羽缓存的查询代理，代理不可用时直连C站
+    """
+
+    def __init__(self, base_url=CIVITAI_PROXY_URL, fallback_url=CIVITAI_BY_HASH_URL, workers=8, rate=5.0, burst=10,
+                 max_retries=5, backoff_factor=1.0, timeout=30, lookup_cache=None):
+        """
+        :param base_url: by-hash 接口地址
+        :param fallback_url: base_url 请求失败（非 404）时改用的接口地址；设置后 base_url 视为局域网代理：
+                             不限速、不重试（代理自身已对C站重试），第一次失败即改用 fallback_url
+        :param workers: 并发查询线程数
+        :param rate: 每秒最多发起的请求数
+        :param burst: 允许的突发请求数
+        :param max_retries: 429/5xx 最大重试次数
+        :param backoff_factor: 退避系数，第 n 次重试等待 backoff_factor * 2^(n-1) 秒（优先遵循 Retry-After）
+        :param timeout: 单次请求超时时间(秒)
+        :param lookup_cache: 可选的 LookupCache，缓存查询结果（含查不到的负结果）
+        """
+        self.base_url = base_url.rstrip("/")
+        self.fallback_url = fallback_url.rstrip("/") if fallback_url else None
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.lookup_cache = lookup_cache
+        self.limiter = TokenBucket(rate, burst)
+        retry = Retry(total=max_retries,
+                      status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset(["GET"]),
+                      backoff_factor=backoff_factor,
+                      respect_retry_after_header=True,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # 查询代理使用不重试的连接池，避免与代理对C站的重试叠加
+        proxy_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers, max_retries=0)
+        self.proxy_session = requests.Session()
+        self.proxy_session.mount("https://", proxy_adapter)
+        self.proxy_session.mount("http://", proxy_adapter)
+
+    def lookup(self, sha256):
+        """
+        查询单个模型
+        :return: (是否存在, model_id, download_url)，C站返回 404 时视为不存在，其他错误抛出 RequestException
+        """
+        if self.fallback_url is None:
+            return self._lookup(self.base_url, sha256, self.session, limited=True)
+        try:
+            return self._lookup(self.base_url, sha256, self.proxy_session, limited=False)
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"查询代理请求失败，直连 civitai: {e}")
+            return self._lookup(self.fallback_url, sha256, self.session, limited=True)
+
+    def _lookup(self, base_url, sha256, session, limited):
+        url = f"{base_url}/{sha256}"
+        if limited:
+            self.limiter.acquire()
+        logging.info(f"请求 civitai 模型: {url}")
+        response = session.get(url, timeout=self.timeout)
+        if response.status_code == 404:
+            return False, None, None
+        response.raise_for_status()
+        data = response.json()
+        model_id = data.get('modelId')
+        download_url = data.get('downloadUrl')
+        logging.info(f"模型 ID: {model_id}, 下载地址: {download_url}")
+        return True, model_id, download_url
+
+    def resolve(self, sha256):
+        """查询单个模型，返回 (model_id, download_url)，不存在或请求失败时返回 (None, None)"""
+        if self.lookup_cache is not None:
+            hit, value = self.lookup_cache.get(LOOKUP_NAMESPACE, sha256)
+            if hit:
+                return tuple(value)
+        try:
+            found, model_id, download_url = self.lookup(sha256)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"请求失败: {e}")
+            return None, None
+        if self.lookup_cache is not None:
+            self.lookup_cache.put(LOOKUP_NAMESPACE, sha256, [model_id, download_url], positive=found)
+        return model_id, download_url
+
+    def resolve_many(self, sha256_list):
+        """并发查询多个模型，返回 {sha256: (model_id, download_url)}"""
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="civitai") as executor:
+            return dict(zip(sha256_list, executor.map(self.resolve, sha256_list)))
+
+
+_default_resolver = None
+_default_resolver_lock = threading.Lock()
+
+
+def get_civitai_resolver():
+    """进程内共享的查询器，共用连接池和限速器"""
+    global _default_resolver
+    with _default_resolver_lock:
+        if _default_resolver is None:
+            _default_resolver = CivitaiResolver()
+        return _default_resolver
+
+
+def set_civitai_resolver(resolver):
+    global _default_resolver
+    with _default_resolver_lock:
+        _default_resolver = resolver
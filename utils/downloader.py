@@ -0,0 +1,334 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs, unquote
+
+import requests
+
+DEFAULT_CONNECTIONS = 8
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024      # 每个分段的大小
+MIN_SEGMENTED_SIZE = 32 * 1024 * 1024        # 小于该大小的文件只用一个连接
+CHUNK_SIZE = 1024 * 1024
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".part.json"                  # 分段下载状态，用于断点续传
+
+
+class DownloadError(Exception):
+    pass
+
+
+class DownloadCancelled(Exception):
+    """cancelled 回调返回 True 时中止下载，临时文件保留用于续传"""
+
+
+class HashMismatch(DownloadError):
+    """下载内容的 sha256 与期望值不一致"""
+
+    def __init__(self, expected, actual):
+        super().__init__(f"sha256 不一致: 期望 {expected}, 实际 {actual}")
+        self.expected = expected
+        self.actual = actual
+
+
+def content_disposition_file_name(value):
+    """从 Content-Disposition 中解析文件名"""
+    if not value:
+        return None
+    match = re.search(r"filename\*=(?:UTF-8'')?([^;]+)", value, re.IGNORECASE)
+    if match:
+        return unquote(match.group(1).strip('"'))
+    match = re.search(r'filename="?([^";]+)"?', value, re.IGNORECASE)
+    return unquote(match.group(1)) if match else None
+
+
+def remote_file_name(url, response):
+    """真实文件名：优先响应头，其次 S3 签名地址中的 response-content-disposition 参数，最后取 URL 路径"""
+    file_name = content_disposition_file_name(response.headers.get("Content-Disposition"))
+    if file_name is None:
+        query_params = parse_qs(urlparse(url).query)
+        file_name = content_disposition_file_name(query_params.get("response-content-disposition", [None])[0])
+    if file_name is None:
+        file_name = unquote(os.path.basename(urlparse(url).path)) or None
+    return file_name
+
+
+def _write_json(path, data):
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_file, path)
+
+
+class Downloader:
+    """
+    多连接分段下载器
+    服务器支持 Range 时把文件切成若干分段，多个连接并发下载，按偏移写入预分配的 .part 文件；
+    已完成的分段记录在 .part.json 中，中断后重新下载只下载未完成的分段；
+    服务器不支持 Range 或无法获得文件大小时退回单连接下载（不能续传）
+    """
+
+    def __init__(self, connections=DEFAULT_CONNECTIONS, segment_size=DEFAULT_SEGMENT_SIZE,
+                 min_segmented_size=MIN_SEGMENTED_SIZE, max_retries=5, timeout=(10, 60), session=None,
+                 rate_limiter=None, pool_maxsize=None):
+        """
+        :param connections: 单个文件的最大并发连接数
+        :param rate_limiter: 可选的 TokenBucket（令牌为字节），多个下载共享同一个限速器即可限制节点总带宽
+        :param pool_maxsize: 每个主机保持的最大连接数，多个文件同时下载时应为 connections * 同时下载的文件数
+        """
+        self.connections = max(1, connections)
+        self.segment_size = segment_size
+        self.min_segmented_size = min_segmented_size
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        # 同一个 Session 按主机维护连接池，同一主机的请求复用连接
+        self.session = session or requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=pool_maxsize or self.connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _throttle(self, size):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(size)
+
+    def probe(self, url, headers):
+        """请求第一个字节，判断是否支持 Range 并获取文件大小、校验标识和文件名"""
+        response = self.session.get(url, headers={**headers, "Range": "bytes=0-0"}, stream=True, timeout=self.timeout)
+        try:
+            if response.status_code != 416:
+                # 空文件请求 Range 时返回 416，按不支持分段处理
+                response.raise_for_status()
+            info = {
+                "url": response.url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "file_name": remote_file_name(response.url, response),
+                "accept_ranges": False,
+                "size": None,
+            }
+            content_range = response.headers.get("Content-Range", "")
+            if response.status_code == 206 and "/" in content_range and not content_range.endswith("/*"):
+                info["accept_ranges"] = True
+                info["size"] = int(content_range.rsplit("/", 1)[1])
+            elif response.headers.get("Content-Length") is not None:
+                info["size"] = int(response.headers["Content-Length"])
+            return info
+        finally:
+            response.close()
+
+    def download(self, url, output_path, headers=None, progress=None, expected_sha256=None, cancelled=None):
+        """
+        下载文件到 output_path，完成前写入 output_path.part，完成后原子重命名
+        :param headers: 请求头
+        :param progress: 可选回调 progress(已下载字节数, 总字节数或 None)
+        :param expected_sha256: 可选，下载过程中同时计算 sha256，与期望值一致才重命名为 output_path，
+                                不一致时删除临时文件并抛出 HashMismatch
+        :param cancelled: 可选回调，每写入一块数据检查一次，返回 True 时抛出 DownloadCancelled
+        :return: (真实文件名, 文件大小)
+        """
+        headers = dict(headers or {})
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        start_time = time.time()
+        info = self.probe(url, headers)
+        logging.info(f"文件实际下载地址: {info['url']}, 文件名: {info['file_name']}, 文件大小: {info['size']} 字节, "
+                     f"支持分段: {info['accept_ranges']}")
+        verify = expected_sha256 is not None
+        if info["accept_ranges"] and info["size"] >= self.min_segmented_size:
+            sha256 = self._download_segmented(info, output_path, headers, progress, verify, cancelled)
+        else:
+            sha256 = self._download_single(info, output_path, headers, progress, verify, cancelled)
+        if verify and sha256 != expected_sha256.lower():
+            # 内容已损坏，无法判断是哪个分段，删除全部临时文件
+            for suffix in (PART_SUFFIX, STATE_SUFFIX):
+                if os.path.exists(output_path + suffix):
+                    os.remove(output_path + suffix)
+            raise HashMismatch(expected_sha256.lower(), sha256)
+        os.replace(output_path + PART_SUFFIX, output_path)
+        if os.path.exists(output_path + STATE_SUFFIX):
+            os.remove(output_path + STATE_SUFFIX)
+        size = os.path.getsize(output_path)
+        seconds = time.time() - start_time
+        logging.info(f"下载完成. 文件路径: {output_path}, 耗时 {seconds:.1f}s, {size / 1024 / 1024 / max(seconds, 0.001):.2f} MB/s")
+        return info["file_name"], size
+
+    def _download_single(self, info, output_path, headers, progress, verify=False, cancelled=None):
+        """单连接下载，失败时从头重试；verify 时边写入边计算 sha256 并返回"""
+        for attempt in range(self.max_retries + 1):
+            downloaded = 0
+            sha256_hash = hashlib.sha256() if verify else None
+            try:
+                with self.session.get(info["url"], headers=headers, stream=True, timeout=self.timeout) as response:
+                    response.raise_for_status()
+                    with open(output_path + PART_SUFFIX, "wb") as f:
+                        for chunk in response.iter_content(CHUNK_SIZE):
+                            if cancelled is not None and cancelled():
+                                raise DownloadCancelled(f"下载已取消: {output_path}")
+                            self._throttle(len(chunk))
+                            f.write(chunk)
+                            if sha256_hash is not None:
+                                sha256_hash.update(chunk)
+                            downloaded += len(chunk)
+                            if progress is not None:
+                                progress(downloaded, info["size"])
+                if info["size"] is not None and downloaded != info["size"]:
+                    raise DownloadError(f"下载不完整: {downloaded}/{info['size']}")
+                return sha256_hash.hexdigest() if sha256_hash is not None else None
+            except (requests.RequestException, DownloadError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                logging.warning(f"下载失败，重试({attempt + 1}/{self.max_retries}): {e}")
+                time.sleep(min(2 ** attempt, 30))
+
+    def _load_state(self, info, output_path):
+        """读取断点续传状态，文件大小或校验标识变化时重新下载"""
+        state_file = output_path + STATE_SUFFIX
+        if os.path.exists(state_file) and os.path.exists(output_path + PART_SUFFIX):
+            try:
+                with open(state_file, "r") as f:
+                    state = json.load(f)
+                if (state["size"] == info["size"] and state["etag"] == info["etag"]
+                        and state["last_modified"] == info["last_modified"]
+                        and state["segment_size"] == self.segment_size):
+                    return state
+            except (ValueError, KeyError):
+                pass
+            logging.info(f"远程文件已变化或状态文件无效，重新下载: {output_path}")
+        return {"size": info["size"], "etag": info["etag"], "last_modified": info["last_modified"],
+                "segment_size": self.segment_size, "done": []}
+
+    def _download_segmented(self, info, output_path, headers, progress, verify=False, cancelled=None):
+        """
+        分段下载；verify 时由单独的线程按顺序计算 sha256：
+        始终哈希从文件开头连续写入完成的部分（前沿），数据刚写入、读取命中页缓存，不需要下载完成后再完整读一遍
+        """
+        size = info["size"]
+        state_file = output_path + STATE_SUFFIX
+        part_file = output_path + PART_SUFFIX
+        state = self._load_state(info, output_path)
+        done = set(state["done"])
+        segments = [(index, start, min(start + self.segment_size, size) - 1)
+                    for index, start in enumerate(range(0, size, self.segment_size))]
+        pending = [segment for segment in segments if segment[0] not in done]
+        if done:
+            logging.info(f"断点续传: 已完成 {len(done)}/{len(segments)} 个分段")
+        lock = threading.Lock()
+        downloaded = [sum(end - start + 1 for index, start, end in segments if index in done)]
+        # 每个分段已连续写入到的位置，供哈希线程推进前沿
+        written = {index: (end + 1 if index in done else start) for index, start, end in segments}
+        written_changed = threading.Condition(lock)
+        stop = threading.Event()
+        sha256_hash = hashlib.sha256() if verify else None
+
+        def hash_frontier():
+            hashed = 0
+            buffer = bytearray(CHUNK_SIZE * 4)
+            view = memoryview(buffer)
+            with open(part_file, "rb", buffering=0) as f:
+                while hashed < size:
+                    with written_changed:
+                        while written[hashed // self.segment_size] <= hashed and not stop.is_set():
+                            written_changed.wait(1)
+                        available = written[hashed // self.segment_size]
+                    if stop.is_set():
+                        return
+                    f.seek(hashed)
+                    while hashed < available:
+                        n = f.readinto(view[:min(len(buffer), available - hashed)])
+                        sha256_hash.update(view[:n])
+                        hashed += n
+
+        fd = os.open(part_file, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0))
+        try:
+            if not done:
+                # 预分配空间，减少碎片，磁盘空间不足时尽早失败
+                os.ftruncate(fd, size)
+                if hasattr(os, "posix_fallocate"):
+                    os.posix_fallocate(fd, 0, size)
+                _write_json(state_file, state)
+
+            def write_at(data, offset):
+                if hasattr(os, "pwrite"):
+                    os.pwrite(fd, data, offset)
+                else:
+                    with lock:
+                        os.lseek(fd, offset, os.SEEK_SET)
+                        os.write(fd, data)
+
+            def fetch(segment):
+                index, start, end = segment
+                position = start
+                for attempt in range(self.max_retries + 1):
+                    try:
+                        range_headers = {**headers, "Range": f"bytes={position}-{end}"}
+                        with self.session.get(info["url"], headers=range_headers, stream=True,
+                                              timeout=self.timeout) as response:
+                            if response.status_code != 206:
+                                raise DownloadError(f"分段请求未返回 206: {response.status_code}")
+                            for chunk in response.iter_content(CHUNK_SIZE):
+                                if cancelled is not None and cancelled():
+                                    raise DownloadCancelled(f"下载已取消: {output_path}")
+                                chunk = chunk[:end + 1 - position]
+                                self._throttle(len(chunk))
+                                write_at(chunk, position)
+                                position += len(chunk)
+                                with lock:
+                                    written[index] = position
+                                    written_changed.notify_all()
+                                    downloaded[0] += len(chunk)
+                                    if progress is not None:
+                                        progress(downloaded[0], size)
+                                if position > end:
+                                    break
+                        if position <= end:
+                            raise DownloadError(f"分段 {index} 不完整: {position - start}/{end - start + 1}")
+                        break
+                    except (requests.RequestException, DownloadError) as e:
+                        if attempt >= self.max_retries:
+                            raise
+                        logging.warning(f"分段 {index} 下载失败，从 {position} 继续({attempt + 1}/{self.max_retries}): {e}")
+                        time.sleep(min(2 ** attempt, 30))
+                with lock:
+                    state["done"].append(index)
+                    _write_json(state_file, state)
+
+            hasher = threading.Thread(target=hash_frontier, name="download-hash", daemon=True) if verify else None
+            if hasher is not None:
+                hasher.start()
+            try:
+                with ThreadPoolExecutor(max_workers=min(self.connections, max(1, len(pending))),
+                                        thread_name_prefix="download") as executor:
+                    list(executor.map(fetch, pending))
+            except BaseException:
+                stop.set()
+                raise
+            finally:
+                if hasher is not None:
+                    hasher.join()
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return sha256_hash.hexdigest() if sha256_hash is not None else None
+
+
+_downloader = None
+_downloader_lock = threading.Lock()
+
+
+def get_downloader():
+    """进程内共享的下载器（共享连接池）"""
+    global _downloader
+    with _downloader_lock:
+        if _downloader is None:
+            _downloader = Downloader()
+        return _downloader
+
+
+def set_downloader(downloader):
+    global _downloader
+    with _downloader_lock:
+        _downloader = downloader
@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import re
+import subprocess
+import tempfile
+import time
+
+# 记录 git/远程地址 -> 编译出的 wheel 文件名，同一地址（含提交号）只编译一次
+DIRECT_REFS_FILE_NAME = "direct_refs.json"
+
+
+def normalize_name(name):
+    """按 wheel 文件名规则规范化包名"""
+    return re.sub(r"[-_.]+", "_", name).lower()
+
+
+def package_requirement(package):
+    """PythonPackage 转换为 pip 需求行，本地文件及无法识别的包返回 None"""
+    if package.name is None:
+        return None
+    if package.type == "normal" and package.version is not None:
+        return f"{package.name}=={package.version}"
+    if package.type in ("git", "remote") and package.remote_url is not None:
+        return f"{package.name} @ {package.remote_url}"
+    return None
+
+
+def python_tag(python):
+    """目标解释器的版本及平台标识，不同解释器使用 wheel 仓库中不同的子目录"""
+    return subprocess.check_output(
+        [python, "-c", "import sys, sysconfig; "
+                       "print(f'cp{sys.version_info[0]}{sys.version_info[1]}-{sysconfig.get_platform()}')"],
+        text=True).strip()
+
+
+class Wheelhouse:
+    """本地 wheel 仓库，普通包按 包名+版本 匹配，git/远程地址的包按地址匹配"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.refs_file = os.path.join(path, DIRECT_REFS_FILE_NAME)
+        self.direct_refs = {}
+        if os.path.exists(self.refs_file):
+            with open(self.refs_file, "r") as f:
+                self.direct_refs = json.load(f)
+
+    def wheel_files(self):
+        return {file_name for file_name in os.listdir(self.path) if file_name.endswith(".whl")}
+
+    def versions(self):
+        """{规范化包名: {版本}}"""
+        result = {}
+        for file_name in self.wheel_files():
+            name, version = file_name.split("-")[:2]
+            result.setdefault(normalize_name(name), set()).add(version)
+        return result
+
+    def offline_requirement(self, package, versions=None):
+        """仓库中已有该包时返回离线安装用的需求行，否则返回 None"""
+        if package.type == "normal":
+            versions = self.versions() if versions is None else versions
+            if package.version in versions.get(normalize_name(package.name), set()):
+                return f"{package.name}=={package.version}"
+            return None
+        wheel = self.direct_refs.get(package.remote_url)
+        if wheel is not None and os.path.exists(os.path.join(self.path, wheel)):
+            return os.path.join(self.path, wheel)
+        return None
+
+    def record_direct_refs(self, packages, new_files):
+        """把本次新编译出的 wheel 关联到对应的 git/远程地址"""
+        by_name = {normalize_name(file_name.split("-")[0]): file_name for file_name in new_files}
+        for package in packages:
+            if package.type != "normal" and normalize_name(package.name) in by_name:
+                self.direct_refs[package.remote_url] = by_name[normalize_name(package.name)]
+        tmp_file = self.refs_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.direct_refs, f, indent=2)
+        os.replace(tmp_file, self.refs_file)
+
+
+def _pip(python, *args):
+    logging.info(f"执行: {python} -m pip {' '.join(args)}")
+    return subprocess.run([python, "-m", "pip", *args], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+
+def _write_requirements(lines, work_dir, name):
+    path = os.path.join(work_dir, name)
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+
+def _build_wheels(python, wheelhouse, packages, work_dir):
+    """
+    一次 pip wheel 编译仓库中缺少的包，批量失败时逐个编译找出失败的包
+    :return: 编译失败的需求行
+    """
+    before = wheelhouse.wheel_files()
+    requirements = _write_requirements([package_requirement(package) for package in packages], work_dir, "missing.txt")
+    result = _pip(python, "wheel", "--no-deps", "--find-links", wheelhouse.path, "-w", wheelhouse.path, "-r", requirements)
+    failed = []
+    if result.returncode != 0:
+        logging.warning(f"批量编译 wheel 失败，逐个编译缺少的包: {result.stdout[-2000:]}")
+        wheelhouse.record_direct_refs(packages, wheelhouse.wheel_files() - before)
+        versions = wheelhouse.versions()
+        for package in packages:
+            if wheelhouse.offline_requirement(package, versions) is not None:
+                continue
+            requirement = package_requirement(package)
+            single_before = wheelhouse.wheel_files()
+            result = _pip(python, "wheel", "--no-deps", "--find-links", wheelhouse.path, "-w", wheelhouse.path, requirement)
+            if result.returncode != 0:
+                failed.append(requirement)
+                logging.error(f"编译 wheel 失败: {requirement}: {result.stdout[-2000:]}")
+            else:
+                wheelhouse.record_direct_refs([package], wheelhouse.wheel_files() - single_before)
+    else:
+        wheelhouse.record_direct_refs(packages, wheelhouse.wheel_files() - before)
+    return failed
+
+
+def restore_packages(python, packages, wheelhouse_root):
+    """
+    恢复 Python 环境：
+    1. 由 PythonPackage 列表生成需求集合（包含 git/远程地址的包）
+    2. 本地 wheel 仓库中缺少的包一次性 pip wheel 预编译，重复恢复时直接命中仓库
+    3. 一次 pip install 从本地 wheel 仓库离线安装全部依赖（pip freeze 已是完整的依赖集合，使用 --no-deps）
+    :return: 报告 {"installed", "built", "failed", "skipped", "seconds"}
+    """
+    start = time.time()
+    wheelhouse = Wheelhouse(os.path.join(wheelhouse_root, python_tag(python)))
+
+    wanted = []
+    skipped = []
+    for package in packages:
+        if package_requirement(package) is None:
+            skipped.append(package.full_text or package.name)
+        else:
+            wanted.append(package)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        versions = wheelhouse.versions()
+        missing = [package for package in wanted if wheelhouse.offline_requirement(package, versions) is None]
+        failed = []
+        if missing:
+            logging.info(f"本地 wheel 仓库缺少 {len(missing)} 个包，开始编译")
+            failed = _build_wheels(python, wheelhouse, missing, work_dir)
+
+        versions = wheelhouse.versions()
+        installable = [requirement for requirement in
+                       (wheelhouse.offline_requirement(package, versions) for package in wanted)
+                       if requirement is not None]
+        if installable:
+            requirements = _write_requirements(installable, work_dir, "requirements.txt")
+            result = _pip(python, "install", "--no-index", "--no-deps", "--find-links", wheelhouse.path, "-r", requirements)
+            if result.returncode != 0:
+                logging.error(f"安装依赖失败: {result.stdout[-4000:]}")
+                raise RuntimeError(f"安装依赖失败: {result.stdout[-500:]}")
+
+    return {
+        "installed": len(installable),
+        "built": len(missing) - len(failed),
+        "failed": failed,
+        "skipped": skipped,
+        "seconds": round(time.time() - start, 3),
+    }
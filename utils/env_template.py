@@ -0,0 +1,235 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import time
+
+from utils.env_restore import normalize_name, package_requirement, python_tag, restore_packages
+
+try:
+    import fcntl
+except ImportError:  # Windows 下只使用进程内锁
+    fcntl = None
+
+ENV_TEMPLATE_MAX_BYTES = 50 * 1024 ** 3   # 模板仓库默认容量上限
+TEMPLATE_MAX_DIFF = 20                    # 近似模板最多允许相差的包数量
+META_FILE_NAME = "meta.json"
+
+
+def package_set(packages):
+    """规范化的依赖集合 {规范化包名: 规范化需求行}，本地文件及无法识别的包不参与比较"""
+    result = {}
+    for package in packages:
+        if package_requirement(package) is None:
+            continue
+        name = normalize_name(package.name)
+        if package.type == "normal":
+            result[name] = f"{name}=={package.version}"
+        else:
+            result[name] = f"{name} @ {package.remote_url}"
+    return result
+
+
+def package_fingerprint(requirements):
+    """依赖集合指纹，与包的顺序、包名大小写及 -/_ 写法无关"""
+    return hashlib.sha256("\n".join(sorted(requirements.values())).encode()).hexdigest()
+
+
+def env_paths(python):
+    """目标解释器的 site-packages 及脚本目录"""
+    paths = json.loads(subprocess.check_output(
+        [python, "-c", "import json, sysconfig; print(json.dumps(sysconfig.get_paths()))"], text=True))
+    trees = sorted({paths["purelib"], paths["platlib"]})
+    return {"trees": trees, "scripts": paths["scripts"]}
+
+
+def _link_or_copy(src, dst):
+    """优先硬链接，跨文件系统时退回复制；目标已存在时先删除，避免改写与其他模板共享的文件"""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+
+def _dir_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for file_name in files:
+            file_path = os.path.join(root, file_name)
+            if not os.path.islink(file_path):
+                size += os.path.getsize(file_path)
+    return size
+
+
+class EnvTemplateStore:
+    """
+    预构建 Python 环境模板仓库，以 (解释器, 依赖集合指纹) 为键保存 site-packages 快照
+    恢复时用硬链接把模板整体替换到目标环境；模板按最近使用时间 LRU 淘汰，总大小不超过上限
+    注意：模板与恢复出的环境共享文件（硬链接），pip 升级/卸载只会删除文件不会改写，原地修改包内文件会影响模板
+    """
+
+    def __init__(self, root, max_bytes=ENV_TEMPLATE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def _lock(self, exclusive):
+        lock_file = open(os.path.join(self.root, ".lock"), "w")
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        return lock_file
+
+    def templates(self):
+        result = []
+        for name in os.listdir(self.root):
+            meta_file = os.path.join(self.root, name, META_FILE_NAME)
+            if os.path.exists(meta_file):
+                with open(meta_file, "r") as f:
+                    meta = json.load(f)
+                meta["path"] = os.path.join(self.root, name)
+                result.append(meta)
+        return result
+
+    @staticmethod
+    def _write_meta(path, meta):
+        meta = {key: value for key, value in meta.items() if key != "path"}
+        tmp_file = os.path.join(path, META_FILE_NAME + ".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_file, os.path.join(path, META_FILE_NAME))
+
+    def find(self, env_key, requirements, max_diff=TEMPLATE_MAX_DIFF):
+        """
+        查找完全一致或最接近的模板
+        :return: (模板信息, 需要安装的包名, 需要卸载的包名)，没有可用模板时返回 None
+        """
+        best = None
+        for meta in self.templates():
+            if meta["env_key"] != env_key:
+                continue
+            template_requirements = meta["requirements"]
+            to_install = [name for name, line in requirements.items() if template_requirements.get(name) != line]
+            to_remove = [name for name in template_requirements if name not in requirements]
+            diff = len(to_install) + len(to_remove)
+            if diff <= max_diff and (best is None or diff < best[0]):
+                best = (diff, meta, to_install, to_remove)
+        if best is None:
+            return None
+        return best[1], best[2], best[3]
+
+    def materialize(self, meta, paths):
+        """用模板替换目标环境的 site-packages，并把模板中的脚本链接到脚本目录"""
+        with self._lock(exclusive=False):
+            for index, tree in enumerate(paths["trees"]):
+                template_tree = os.path.join(meta["path"], "trees", str(index))
+                tmp_tree = f"{tree}.template-{os.getpid()}"
+                old_tree = f"{tree}.old-{os.getpid()}"
+                shutil.rmtree(tmp_tree, ignore_errors=True)
+                shutil.copytree(template_tree, tmp_tree, symlinks=True, copy_function=_link_or_copy)
+                if os.path.exists(tree):
+                    os.rename(tree, old_tree)
+                os.rename(tmp_tree, tree)
+                shutil.rmtree(old_tree, ignore_errors=True)
+            template_scripts = os.path.join(meta["path"], "scripts")
+            if os.path.isdir(template_scripts):
+                os.makedirs(paths["scripts"], exist_ok=True)
+                for file_name in os.listdir(template_scripts):
+                    _link_or_copy(os.path.join(template_scripts, file_name), os.path.join(paths["scripts"], file_name))
+            meta["last_used"] = time.time()
+            self._write_meta(meta["path"], meta)
+        logging.info(f"使用环境模板: {meta['path']}")
+
+    def capture(self, env_key, requirements, paths):
+        """把当前环境保存为模板（已存在同一指纹的模板时跳过），返回模板路径"""
+        fingerprint = package_fingerprint(requirements)
+        path = os.path.join(self.root, f"{env_key[:16]}-{fingerprint[:16]}")
+        with self._lock(exclusive=True):
+            if os.path.exists(os.path.join(path, META_FILE_NAME)):
+                return path
+            tmp_path = f"{path}.tmp-{os.getpid()}"
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            for index, tree in enumerate(paths["trees"]):
+                shutil.copytree(tree, os.path.join(tmp_path, "trees", str(index)), symlinks=True,
+                                copy_function=_link_or_copy)
+            # 脚本目录只保存普通文件，python 等解释器符号链接由目标环境自带
+            scripts_dir = os.path.join(tmp_path, "scripts")
+            os.makedirs(scripts_dir)
+            if os.path.isdir(paths["scripts"]):
+                for file_name in os.listdir(paths["scripts"]):
+                    file_path = os.path.join(paths["scripts"], file_name)
+                    if os.path.isfile(file_path) and not os.path.islink(file_path):
+                        _link_or_copy(file_path, os.path.join(scripts_dir, file_name))
+            now = time.time()
+            self._write_meta(tmp_path, {
+                "env_key": env_key,
+                "fingerprint": fingerprint,
+                "requirements": requirements,
+                "size": _dir_size(tmp_path),
+                "created": now,
+                "last_used": now,
+            })
+            shutil.rmtree(path, ignore_errors=True)
+            os.rename(tmp_path, path)
+        logging.info(f"保存环境模板: {path}")
+        return path
+
+    def evict(self, keep=None):
+        """按最近使用时间淘汰模板，直到总大小不超过上限，返回删除的模板路径"""
+        evicted = []
+        with self._lock(exclusive=True):
+            templates = sorted(self.templates(), key=lambda meta: meta["last_used"])
+            total = sum(meta["size"] for meta in templates)
+            for meta in templates:
+                if total <= self.max_bytes:
+                    break
+                if meta["path"] == keep:
+                    continue
+                shutil.rmtree(meta["path"], ignore_errors=True)
+                total -= meta["size"]
+                evicted.append(meta["path"])
+                logging.info(f"淘汰环境模板: {meta['path']}")
+        return evicted
+
+
+def restore_environment(python, packages, wheelhouse_root, store: EnvTemplateStore, max_diff=TEMPLATE_MAX_DIFF):
+    """
+    通过环境模板恢复 Python 环境
+    完全一致的模板直接硬链接恢复；近似模板恢复后只卸载多余的包、安装差异的包；
+    没有可用模板时完整安装，安装成功后保存为新模板
+    :return: 报告，在 restore_packages 的报告基础上增加 "template" (exact/near/none) 和 "evicted"
+    """
+    start = time.time()
+    paths = env_paths(python)
+    env_key = hashlib.sha256(json.dumps([python_tag(python), paths], sort_keys=True).encode()).hexdigest()
+    requirements = package_set(packages)
+    match = store.find(env_key, requirements, max_diff)
+    if match is not None and not match[1] and not match[2]:
+        store.materialize(match[0], paths)
+        return {"template": "exact", "installed": 0, "built": 0, "failed": [], "evicted": [],
+                "skipped": [package.full_text or package.name for package in packages if package_requirement(package) is None],
+                "seconds": round(time.time() - start, 3)}
+
+    mode = "none"
+    if match is not None:
+        meta, to_install, to_remove = match
+        store.materialize(meta, paths)
+        mode = "near"
+        if to_remove:
+            logging.info(f"卸载模板中多余的包: {to_remove}")
+            subprocess.run([python, "-m", "pip", "uninstall", "-y", *to_remove], check=True,
+                           stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        install_names = set(to_install)
+        packages = [package for package in packages
+                    if package_requirement(package) is None or normalize_name(package.name) in install_names]
+    report = restore_packages(python, packages, wheelhouse_root)
+    report["template"] = mode
+    report["evicted"] = []
+    if not report["failed"]:
+        report["evicted"] = store.evict(keep=store.capture(env_key, requirements, paths))
+    report["seconds"] = round(time.time() - start, 3)
+    return report
@@ -0,0 +1,99 @@
+import hashlib
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows 下只使用进程内锁
+    fcntl = None
+
+# 默认清理超过 30 天未使用的镜像
+MIRROR_MAX_IDLE_SECONDS = 30 * 24 * 3600
+
+
+def _git(*args):
+    return subprocess.run(['git', *args], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+
+class GitMirrorCache:
+    """
+    节点共享的 Git 镜像缓存，以 remote_url 为键保存裸仓库
+    插件从本地镜像克隆（同一文件系统下为硬链接，镜像删除后不影响已克隆的仓库），
+    只有镜像中缺少需要的提交时才从远端更新镜像
+    """
+
+    def __init__(self, root, max_idle_seconds=MIRROR_MAX_IDLE_SECONDS):
+        self.root = root
+        self.max_idle_seconds = max_idle_seconds
+        self.hits = 0
+        self.misses = 0
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def mirror_path(self, repo_url):
+        name = re.sub(r'[^\w.-]', '_', os.path.basename(repo_url.rstrip('/')).replace('.git', ''))
+        return os.path.join(self.root, f"{hashlib.sha1(repo_url.encode()).hexdigest()[:16]}-{name}.git")
+
+    def _lock(self, repo_url):
+        with self._locks_lock:
+            return self._locks.setdefault(repo_url, threading.Lock())
+
+    @staticmethod
+    def has_commit(mirror_path, commit):
+        try:
+            _git('-C', mirror_path, 'cat-file', '-e', f'{commit}^{{commit}}')
+            return True
+        except subprocess.CalledProcessError:
+            return False
+
+    def ensure(self, repo_url, commit):
+        """保证镜像存在且包含指定提交，返回镜像路径"""
+        mirror_path = self.mirror_path(repo_url)
+        with self._lock(repo_url), open(mirror_path + ".lock", "w") as lock_file:
+            # 文件锁保证同一节点上的多个 pod 不会同时更新同一个镜像
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if not os.path.isdir(mirror_path):
+                self.misses += 1
+                logging.info(f"创建镜像: {repo_url} -> {mirror_path}")
+                tmp_path = f"{mirror_path}.tmp-{os.getpid()}"
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                _git('clone', '-q', '--bare', repo_url, tmp_path)
+                _git('-C', tmp_path, 'config', 'remote.origin.fetch', '+refs/heads/*:refs/heads/*')
+                os.rename(tmp_path, mirror_path)
+            elif not self.has_commit(mirror_path, commit):
+                self.misses += 1
+                logging.info(f"镜像缺少提交 {commit}，更新镜像: {repo_url}")
+                _git('-C', mirror_path, 'fetch', '-q', '--prune', '--tags', 'origin')
+            else:
+                self.hits += 1
+            # 记录最近使用时间
+            os.utime(mirror_path, None)
+        return mirror_path
+
+    def expire(self, max_idle_seconds=None):
+        """删除长时间未使用的镜像，返回删除的镜像路径"""
+        max_idle_seconds = self.max_idle_seconds if max_idle_seconds is None else max_idle_seconds
+        deadline = time.time() - max_idle_seconds
+        expired = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not name.endswith(".git") or not os.path.isdir(path) or os.path.getmtime(path) >= deadline:
+                continue
+            with open(path + ".lock", "w") as lock_file:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue
+                shutil.rmtree(path, ignore_errors=True)
+            os.remove(path + ".lock")
+            expired.append(path)
+            logging.info(f"删除过期镜像: {path}")
+        return expired
@@ -0,0 +1,116 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from utils.util import calculate_sha256, HASH_BUFFER_SIZE
+
+
+class HashCache:
+    """
+    本地文件哈希缓存（SQLite），每条记录以 (path, size, mtime_ns, inode) 作为校验键，
+    文件未发生变化时直接返回上次计算的 sha256，避免重复读取大模型文件
+    """
+
+    def __init__(self, db_path, rehash=False):
+        """
+        :param db_path: 缓存数据库文件路径
+        :param rehash: 为 True 时忽略已有缓存，强制重新计算（结果仍会写回缓存）
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self.rehash = rehash
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS file_hash (
+                path      TEXT PRIMARY KEY,
+                size      INTEGER NOT NULL,
+                mtime_ns  INTEGER NOT NULL,
+                inode     INTEGER NOT NULL,
+                sha256    TEXT NOT NULL,
+                hashed_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def _key(file_path):
+        return os.path.normcase(os.path.abspath(file_path))
+
+    def get(self, file_path, stat=None):
+        """返回缓存的 sha256，文件不在缓存或已发生变化时返回 None"""
+        if self.rehash:
+            return None
+        if stat is None:
+            stat = os.stat(file_path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sha256 FROM file_hash WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?",
+                (self._key(file_path), stat.st_size, stat.st_mtime_ns, stat.st_ino),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, file_path, sha256, stat=None):
+        if stat is None:
+            stat = os.stat(file_path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO file_hash (path, size, mtime_ns, inode, sha256, hashed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (self._key(file_path), stat.st_size, stat.st_mtime_ns, stat.st_ino, sha256, time.time()),
+            )
+            self._conn.commit()
+
+    def get_sha256(self, file_path, buffer_size=HASH_BUFFER_SIZE, compute=None):
+        """
+        读取缓存，未命中时计算 sha256 并写回缓存
+        :param compute: 可选的计算函数 compute(file_path) -> sha256，用于在计算哈希的同时处理文件内容
+        """
+        stat = os.stat(file_path)
+        sha256 = self.get(file_path, stat)
+        with self._lock:
+            if sha256 is not None:
+                self.hits += 1
+                return sha256
+            self.misses += 1
+        sha256 = compute(file_path) if compute is not None else calculate_sha256(file_path, buffer_size)
+        self.put(file_path, sha256, stat)
+        return sha256
+
+    def prune(self, keep_paths=None):
+        """
+        清理过期记录
+        :param keep_paths: 本次仍然存在的文件路径；为 None 时检查每条记录对应的文件是否仍存在且未变化
+        :return: 删除的记录数
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT path, size, mtime_ns, inode FROM file_hash").fetchall()
+            if keep_paths is not None:
+                keep = {self._key(p) for p in keep_paths}
+                stale = [(row[0],) for row in rows if row[0] not in keep]
+            else:
+                stale = []
+                for path, size, mtime_ns, inode in rows:
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        stale.append((path,))
+                        continue
+                    if (st.st_size, st.st_mtime_ns, st.st_ino) != (size, mtime_ns, inode):
+                        stale.append((path,))
+            self._conn.executemany("DELETE FROM file_hash WHERE path = ?", stale)
+            self._conn.commit()
+        logging.info(f"清理哈希缓存: {len(stale)} 条")
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM file_hash")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,33 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.util import calculate_sha256, HASH_BUFFER_SIZE
+
+# 默认并发数：SSD/NVMe 可适当调大，机械硬盘建议设置为 1 避免随机寻道
+DEFAULT_HASH_WORKERS = min(8, os.cpu_count() or 1)
+
+
+def iter_sha256(file_paths, workers=DEFAULT_HASH_WORKERS, buffer_size=HASH_BUFFER_SIZE, hash_cache=None):
+    """
+    多线程并行计算文件 sha256，按输入顺序逐个返回 (file_path, sha256)
+    hashlib 在处理大块数据时会释放 GIL，因此线程池即可利用多核与磁盘带宽
+    :param file_paths: 文件路径列表
+    :param workers: 并发数
+    :param buffer_size: 读取缓冲区大小
+    :param hash_cache: 可选的 HashCache，命中缓存的文件不再读取
+    """
+    def _hash(file_path):
+        if hash_cache is not None:
+            return hash_cache.get_sha256(file_path, buffer_size)
+        return calculate_sha256(file_path, buffer_size)
+
+    workers = max(1, workers)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hash") as executor:
+        # executor.map 按提交顺序返回结果，保证清单顺序在多次运行间保持一致
+        for file_path, sha256 in zip(file_paths, executor.map(_hash, file_paths)):
+            yield file_path, sha256
+
+
+def hash_files(file_paths, workers=DEFAULT_HASH_WORKERS, buffer_size=HASH_BUFFER_SIZE, hash_cache=None):
+    """并行计算文件 sha256，返回与 file_paths 顺序一致的 sha256 列表"""
+    return [sha256 for _, sha256 in iter_sha256(file_paths, workers, buffer_size, hash_cache)]
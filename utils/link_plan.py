@@ -0,0 +1,138 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from const.app_config import PodConfig
+from utils.util import query_cache_paths
+
+DEFAULT_LINK_WORKERS = 8
+LINK_BATCH_SIZE = 256
+
+# 链接状态
+LINK_OK = "ok"              # 已是指向源文件的软连接
+LINK_MISSING = "missing"    # 尚未创建
+LINK_DANGLING = "dangling"  # 软连接存在但源文件不存在
+LINK_CONFLICT = "conflict"  # 目标已存在，但不是指向源文件的软连接
+
+
+def resolve_cache_paths(pod_config: PodConfig):
+    """C站模型在客户端处理时已添加到模型管理，这里批量查询缓存路径（已下载完成的才有路径）"""
+    pending = [model.sha256 for model in pod_config.models if model.cache_path is None and model.download_url is not None]
+    if pending:
+        # 不使用模型过滤器：其他实例刚下载完成的模型可能还没进入过滤器，漏判会导致链接悬空
+        cache_paths = query_cache_paths(pending, use_filter=False)
+        for model in pod_config.models:
+            if model.cache_path is None and model.sha256 in cache_paths:
+                model.cache_path = cache_paths[model.sha256]
+    return pod_config
+
+
+def unavailable_models(pod_config: PodConfig):
+    """C站模型尚未下载到缓存（客户端也没有上传），/poddata 下没有对应文件，暂时无法创建软连接"""
+    return [model for model in pod_config.models if model.cache_path is None and model.download_url is not None]
+
+
+def build_link_plan(pod_config: PodConfig, base_dir, app_dir, model_dir="models"):
+    """
+    根据 PodConfig.models 生成完整的软连接计划 [(源文件, 软连接)]，不遍历目录
+    /poddata 下：缓存模型的第一个路径指向缓存文件，重复模型的其他路径指向第一个路径（客户上传的模型本身就是第一个路径）
+    应用目录下：每个模型路径指向 /poddata 下的同一相对路径
+    unavailable_models 中的模型没有源文件，跳过，避免创建悬空的软连接
+    """
+    poddata_model_dir = os.path.join(base_dir, "models")
+    skipped = {model.sha256 for model in unavailable_models(pod_config)}
+    plan = []
+    for model in pod_config.models:
+        if model.sha256 in skipped:
+            continue
+        first_file = os.path.join(poddata_model_dir, model.file_path[0])
+        if model.cache_path is not None:
+            plan.append((model.cache_path, first_file))
+        source_file = model.cache_path if model.cache_path is not None else first_file
+        for file_path in model.file_path[1:]:
+            plan.append((source_file, os.path.join(poddata_model_dir, file_path)))
+        for file_path in model.file_path:
+            plan.append((os.path.join(poddata_model_dir, file_path), os.path.join(app_dir, model_dir, file_path)))
+    return plan
+
+
+def check_link(source, target):
+    """检查单个软连接的状态"""
+    if not os.path.lexists(target):
+        return LINK_MISSING
+    if not os.path.islink(target) or os.readlink(target) != source:
+        return LINK_CONFLICT
+    return LINK_OK if os.path.exists(target) else LINK_DANGLING
+
+
+def _apply_batch(batch):
+    results = []
+    for source, target in batch:
+        try:
+            os.symlink(source, target)
+            status = "created"
+        except FileExistsError:
+            status = check_link(source, target)
+        results.append((source, target, status))
+    return results
+
+
+def _batches(plan, batch_size):
+    return [plan[start:start + batch_size] for start in range(0, len(plan), batch_size)]
+
+
+def _report(results, start):
+    report = {"total": len(results), "seconds": 0.0}
+    for status in ("created", LINK_OK, LINK_MISSING, LINK_DANGLING, LINK_CONFLICT):
+        report[status] = 0
+    report["problems"] = []
+    for source, target, status in results:
+        report[status] += 1
+        if status in (LINK_DANGLING, LINK_CONFLICT):
+            report["problems"].append({"status": status, "source": source, "target": target})
+    report["seconds"] = round(time.time() - start, 3)
+    return report
+
+
+def apply_link_plan(plan, workers=DEFAULT_LINK_WORKERS, batch_size=LINK_BATCH_SIZE):
+    """
+    执行软连接计划：每个目录只创建一次，软连接分批并发创建；已存在的目标不覆盖，记录为冲突
+    :return: 报告 {"total", "created", "ok", "dangling", "conflict", "problems": [...], "seconds"}
+    """
+    start = time.time()
+    for target_dir in sorted({os.path.dirname(target) for _, target in plan}):
+        os.makedirs(target_dir, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="link") as executor:
+        results = [result for batch in executor.map(_apply_batch, _batches(plan, batch_size)) for result in batch]
+    # 新建的软连接也检查源文件是否存在
+    results = [(source, target, LINK_DANGLING if status == "created" and not os.path.exists(target) else status)
+               for source, target, status in results]
+    report = _report(results, start)
+    logging.info(f"软连接完成: 新建 {report['created']}, 已存在 {report['ok']}, "
+                 f"悬空 {report['dangling']}, 冲突 {report['conflict']}, 耗时 {report['seconds']}s")
+    return report
+
+
+def verify_link_plan(plan, workers=DEFAULT_LINK_WORKERS, batch_size=LINK_BATCH_SIZE):
+    """只检查不修改（--dry-run / --verify），missing 为将要创建的软连接，源文件不存在的记为悬空"""
+    start = time.time()
+
+    def check_batch(batch):
+        results = []
+        for source, target in batch:
+            status = check_link(source, target)
+            if status == LINK_MISSING and not os.path.exists(source) and (source, target) not in planned_links:
+                status = LINK_DANGLING
+            results.append((source, target, status))
+        return results
+
+    # 源文件本身是计划中尚未创建的软连接时，不算悬空
+    planned_links = set()
+    targets = {target for _, target in plan}
+    for source, target in plan:
+        if source in targets:
+            planned_links.add((source, target))
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="link") as executor:
+        results = [result for batch in executor.map(check_batch, _batches(plan, batch_size)) for result in batch]
+    return _report(results, start)
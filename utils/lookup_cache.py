@@ -0,0 +1,76 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# 默认有效期：查到结果的缓存 1 天，查不到的（负结果）缓存 1 小时
+POSITIVE_TTL = 24 * 3600
+NEGATIVE_TTL = 3600
+
+
+class LookupCache:
+    """
+    查询结果本地缓存（SQLite），按 (namespace, key) 存储 C站/晨羽缓存的查询结果
+    同时缓存正、负结果，负结果使用更短的有效期，请求失败的结果不缓存
+    """
+
+    def __init__(self, db_path, positive_ttl=POSITIVE_TTL, negative_ttl=NEGATIVE_TTL):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS lookup_result (
+                namespace  TEXT NOT NULL,
+                key        TEXT NOT NULL,
+                value      TEXT,
+                positive   INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        self._conn.execute("DELETE FROM lookup_result WHERE expires_at < ?", (time.time(),))
+        self._conn.commit()
+
+    def get(self, namespace, key):
+        """:return: (是否命中, 缓存的值)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM lookup_result WHERE namespace = ? AND key = ? AND expires_at >= ?",
+                (namespace, key, time.time()),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+        return True, json.loads(row[0])
+
+    def put(self, namespace, key, value, positive=True):
+        self.put_many(namespace, [(key, value, positive)])
+
+    def put_many(self, namespace, items):
+        """:param items: [(key, value, positive), ...]"""
+        now = time.time()
+        rows = [(namespace, key, json.dumps(value), int(positive),
+                 now + (self.positive_ttl if positive else self.negative_ttl)) for key, value, positive in items]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO lookup_result (namespace, key, value, positive, expires_at) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
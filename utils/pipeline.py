@@ -0,0 +1,159 @@
+import logging
+import queue
+import threading
+import time
+
+# 队列结束标记
+_END = object()
+
+
+class _Stage:
+    def __init__(self, name, func, workers, batch_size, batch_timeout, queue_size):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.batch_timeout = batch_timeout
+        self.input = queue.Queue(maxsize=queue_size)
+        self.processed = 0
+        self.busy_seconds = 0.0
+        self.alive = self.workers
+        self.lock = threading.Lock()
+
+
+class Pipeline:
+    """
+    基于线程和有界队列的流水线
+    各阶段同时运行，上一阶段产出一条即可被下一阶段处理；队列满时上游阻塞（背压），内存占用有上限
+    阶段函数返回可迭代对象作为输出（返回 None 或空列表表示不向下游输出），最后一个阶段的输出被丢弃
+    任一阶段抛出异常时整个流水线停止，run() 重新抛出该异常
+    """
+
+    def __init__(self, source, queue_size=64):
+        """
+        :param source: 数据源（可迭代对象），在独立线程中遍历
+        :param queue_size: 各阶段输入队列的默认长度
+        """
+        self._source = source
+        self._queue_size = queue_size
+        self._stages = []
+        self._stop = threading.Event()
+        self._error = None
+
+    def stage(self, func, workers=1, batch_size=1, batch_timeout=0.2, name=None, queue_size=None):
+        """
+        添加处理阶段
+        :param func: 处理函数；batch_size 为 1 时传入单条数据，否则传入列表
+        :param workers: 该阶段的并发线程数
+        :param batch_size: 批量处理的最大条数
+        :param batch_timeout: 凑批的最长等待时间(秒)，超时后有多少处理多少
+        """
+        self._stages.append(_Stage(name or func.__name__, func, workers, batch_size, batch_timeout,
+                                   queue_size or self._queue_size))
+        return self
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._stop.is_set():
+            wait = 0.1 if deadline is None else min(0.1, deadline - time.monotonic())
+            if wait <= 0:
+                raise queue.Empty
+            try:
+                return q.get(timeout=wait)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _fail(self, e):
+        if self._error is None:
+            self._error = e
+        self._stop.set()
+
+    def _feed(self):
+        first = self._stages[0]
+        try:
+            for item in self._source:
+                if not self._put(first.input, item):
+                    return
+        except Exception as e:
+            logging.exception("流水线数据源异常")
+            self._fail(e)
+        for _ in range(first.workers):
+            self._put(first.input, _END)
+
+    def _next_batch(self, stage):
+        item = self._get(stage.input)
+        if item is _END:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + stage.batch_timeout
+        while len(batch) < stage.batch_size:
+            try:
+                item = self._get(stage.input, max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is _END:
+                # 结束标记放回队列，处理完当前批次后退出
+                self._put(stage.input, _END)
+                break
+            batch.append(item)
+        return batch
+
+    def _work(self, index):
+        stage = self._stages[index]
+        downstream = self._stages[index + 1] if index + 1 < len(self._stages) else None
+        try:
+            while not self._stop.is_set():
+                batch = self._next_batch(stage)
+                if batch is None:
+                    break
+                start = time.monotonic()
+                outputs = stage.func(batch if stage.batch_size > 1 else batch[0])
+                with stage.lock:
+                    stage.busy_seconds += time.monotonic() - start
+                    stage.processed += len(batch)
+                if downstream is not None and outputs:
+                    for output in outputs:
+                        if not self._put(downstream.input, output):
+                            return
+        except Exception as e:
+            logging.exception(f"流水线阶段 {stage.name} 异常")
+            self._fail(e)
+        finally:
+            with stage.lock:
+                stage.alive -= 1
+                last = stage.alive == 0
+            if last and downstream is not None:
+                for _ in range(downstream.workers):
+                    self._put(downstream.input, _END)
+
+    def run(self):
+        """运行流水线直到数据源耗尽且所有阶段处理完毕，返回各阶段统计信息"""
+        if not self._stages:
+            raise ValueError("流水线至少需要一个阶段")
+        threads = [threading.Thread(target=self._feed, name="pipeline-source", daemon=True)]
+        for index, stage in enumerate(self._stages):
+            for n in range(stage.workers):
+                threads.append(threading.Thread(target=self._work, args=(index,),
+                                                name=f"pipeline-{stage.name}-{n}", daemon=True))
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self._error is not None:
+            raise self._error
+        return {
+            "elapsed": time.monotonic() - start,
+            "stages": [{"name": stage.name, "processed": stage.processed, "busy_seconds": stage.busy_seconds,
+                        "workers": stage.workers} for stage in self._stages],
+        }
@@ -0,0 +1,54 @@
+import json
+import logging
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.util import clone_and_checkout
+
+DEFAULT_PLUGIN_WORKERS = 8
+
+
+def restore_plugin(plugin, plugins_dir, mirror_cache=None):
+    """恢复单个插件，返回报告记录（不抛出异常）"""
+    start = time.time()
+    record = {"name": plugin.name, "remote_url": plugin.remote_url, "commit": plugin.commit_log}
+    try:
+        record["mode"] = clone_and_checkout(plugin.remote_url, plugin.commit_log, plugins_dir, mirror_cache)
+        record["ok"] = True
+    except subprocess.CalledProcessError as e:
+        record["ok"] = False
+        record["error"] = (e.stderr or str(e)).strip()
+    except Exception as e:
+        logging.exception(f"恢复插件失败: {plugin.name}")
+        record["ok"] = False
+        record["error"] = str(e)
+    record["seconds"] = round(time.time() - start, 3)
+    return record
+
+
+def restore_plugins(plugins, plugins_dir, workers=DEFAULT_PLUGIN_WORKERS, report_file=None, mirror_cache=None):
+    """
+    线程池并发恢复插件，每个插件只拉取记录的提交
+    :param mirror_cache: 可选的 GitMirrorCache，从节点本地镜像克隆
+    :param report_file: 可选，写入每个插件耗时及失败原因的 JSON 报告
+    :return: 报告 {"seconds": 总耗时, "ok": 成功数, "failed": 失败数, "plugins": [...]}
+    """
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="plugin") as executor:
+        records = list(executor.map(lambda plugin: restore_plugin(plugin, plugins_dir, mirror_cache), plugins))
+    report = {
+        "seconds": round(time.time() - start, 3),
+        "ok": sum(1 for record in records if record["ok"]),
+        "failed": sum(1 for record in records if not record["ok"]),
+        "plugins": records,
+    }
+    for record in records:
+        if record["ok"]:
+            logging.info(f"插件 {record['name']} 恢复成功（{record['mode']}），耗时 {record['seconds']}s")
+        else:
+            logging.error(f"插件 {record['name']} 恢复失败，耗时 {record['seconds']}s: {record['error']}")
+    if report_file is not None:
+        with open(report_file, "w") as f:
+            json.dump(report, f, indent=4, ensure_ascii=False)
+    return report
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import logging
+import os
+import zipfile
+
+from const.app_config import PodConfig
+from utils.pod_extract import extract_entries
+
+DELTA_MANIFEST_NAME = "pod_delta.json"
+POD_CONFIG_NAME = "pod_config.json"
+
+
+def config_fingerprint(data: bytes):
+    """配置文件指纹，用于确认增量包基于的是哪一份配置"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def uploaded_models(pod_config: PodConfig):
+    """客户上传的模型（云端未缓存、C站不存在），sha256 -> Model"""
+    return {model.sha256: model for model in pod_config.models
+            if model.cache_path is None and model.download_url is None}
+
+
+def build_delta_manifest(base_config: PodConfig, base_fingerprint, pod_config: PodConfig):
+    """
+    对比上一次的配置生成增量清单
+    uploaded: 本次需要随增量包上传的模型文件
+    moved: 已上传过但本地路径变化的模型 {新路径: 旧路径}
+    removed_files: 已上传过、本次不再需要的模型文件
+    """
+    base_uploaded = uploaded_models(base_config)
+    current_uploaded = uploaded_models(pod_config)
+    base_shas = {model.sha256 for model in base_config.models}
+    current_shas = {model.sha256 for model in pod_config.models}
+    moved = {}
+    for sha256, model in current_uploaded.items():
+        if sha256 in base_uploaded and model.file_path[0] != base_uploaded[sha256].file_path[0]:
+            moved[model.file_path[0]] = base_uploaded[sha256].file_path[0]
+    return {
+        "base_fingerprint": base_fingerprint,
+        "added_models": sorted(current_shas - base_shas),
+        "removed_models": sorted(base_shas - current_shas),
+        "uploaded": [model.file_path[0] for sha256, model in current_uploaded.items() if sha256 not in base_uploaded],
+        "moved": moved,
+        "removed_files": [model.file_path[0] for sha256, model in base_uploaded.items() if sha256 not in current_uploaded],
+    }
+
+
+def stale_model_paths(base_config: PodConfig, pod_config: PodConfig):
+    """上一次配置中本次不再使用、或换成了其他模型的模型路径（删除的模型、移动前的路径等）"""
+    current = {file_path: model.sha256 for model in pod_config.models for file_path in model.file_path}
+    return sorted({file_path for model in base_config.models for file_path in model.file_path
+                   if current.get(file_path) != model.sha256})
+
+
+def _unlink_stale_links(model_dir, stale_paths):
+    """删除模型目录下过期路径上的软连接（普通文件由 moved / removed_files 处理）"""
+    removed = 0
+    for file_path in stale_paths:
+        link = os.path.join(model_dir, file_path)
+        if os.path.islink(link):
+            os.unlink(link)
+            removed += 1
+            logging.info(f"删除过期软连接: {link}")
+    return removed
+
+
+def apply_delta(delta_zip_file, base_dir, app_model_dir=None):
+    """
+    把增量包应用到已有的 pod 数据目录（包含上一次的 pod_config.json 及上传的模型）
+    删除的模型及移动前的路径上的软连接（/poddata 及应用模型目录下）一并删除，避免残留或悬空
+    :param app_model_dir: 应用的模型目录，None 时只处理 /poddata
+    :return: 是否应用了增量（已应用过时返回 False）
+    """
+    config_file = os.path.join(base_dir, POD_CONFIG_NAME)
+    model_dir = os.path.join(base_dir, "models")
+    with zipfile.ZipFile(delta_zip_file, "r") as z:
+        manifest = json.loads(z.read(DELTA_MANIFEST_NAME))
+        new_config = z.read(POD_CONFIG_NAME)
+        if not os.path.exists(config_file):
+            raise FileNotFoundError(f"增量包需要基于已有的配置文件: {config_file}")
+        with open(config_file, "rb") as f:
+            current_config = f.read()
+        current_fingerprint = config_fingerprint(current_config)
+        if current_fingerprint == config_fingerprint(new_config):
+            logging.info(f"增量包已应用过: {delta_zip_file}")
+            return False
+        if current_fingerprint != manifest["base_fingerprint"]:
+            raise ValueError(f"增量包与当前配置不匹配: 当前 {current_fingerprint}, 增量包基于 {manifest['base_fingerprint']}")
+
+        # 先处理移动，再删除不再需要的文件，最后解压新上传的模型
+        for new_path, old_path in manifest["moved"].items():
+            source = os.path.join(model_dir, old_path)
+            target = os.path.join(model_dir, new_path)
+            if not os.path.lexists(source) and os.path.lexists(target):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(source, target)
+            logging.info(f"移动模型: {old_path} -> {new_path}")
+        for removed in manifest["removed_files"]:
+            removed_file = os.path.join(model_dir, removed)
+            if removed not in manifest["moved"] and os.path.lexists(removed_file):
+                os.remove(removed_file)
+                logging.info(f"删除模型: {removed}")
+        stale_paths = stale_model_paths(PodConfig(**json.loads(current_config)), PodConfig(**json.loads(new_config)))
+        for stale_dir in (model_dir, app_model_dir):
+            if stale_dir is not None:
+                _unlink_stale_links(stale_dir, stale_paths)
+        entries = [(name, os.path.join(base_dir, name)) for name in z.namelist() if name.startswith("models/")]
+        # 同一路径可能换成了大小相同的新模型，不能按大小跳过
+        extract_entries(delta_zip_file, entries, skip_existing=False)
+        # 最后替换配置文件，中途失败时可以重新应用
+        with open(config_file, "wb") as f:
+            f.write(new_config)
+    return True
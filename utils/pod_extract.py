@@ -0,0 +1,122 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from const.app_config import PodConfig
+from utils.util import link_file
+
+POD_CONFIG_NAME = "pod_config.json"
+MODEL_PREFIX = "models/"
+EXTRACT_BUFFER_SIZE = 16 * 1024 * 1024
+DEFAULT_EXTRACT_WORKERS = 4
+
+
+def read_pod_config(zip_file):
+    """只读取压缩包中的配置文件（中央目录位于文件末尾，不需要先解压模型）"""
+    with zipfile.ZipFile(zip_file, "r") as z:
+        return PodConfig(**json.loads(z.read(POD_CONFIG_NAME)))
+
+
+def _entry_mtime(info):
+    """压缩包条目的修改时间（zip 中保存的是本地时间）"""
+    return int(time.mktime(info.date_time + (0, 0, -1)))
+
+
+def _is_extracted(info, target):
+    """目标文件大小及修改时间与条目一致（解压时会把修改时间设为条目的时间）"""
+    try:
+        stat = os.stat(target)
+    except OSError:
+        return False
+    return stat.st_size == info.file_size and int(stat.st_mtime) == _entry_mtime(info)
+
+
+def extract_entries(zip_file, entries, workers=DEFAULT_EXTRACT_WORKERS, buffer_size=EXTRACT_BUFFER_SIZE, on_done=None,
+                    skip_existing=True):
+    """
+    并发解压指定条目，每个线程使用独立的 ZipFile 句柄
+    先写入 .part 临时文件再原子替换，中途失败后重新执行不会留下不完整的文件
+    :param entries: [(压缩包内路径, 目标文件)]
+    :param skip_existing: 目标文件已存在且大小、修改时间都与条目一致时跳过（重新执行时不重复解压）；
+                          只比较大小不够，同一路径可能换成了大小相同的新模型
+    :param on_done: 可选回调，参数为 (压缩包内路径, 目标文件)，条目解压完成（或已存在）后调用
+    :return: {"files": 解压文件数, "skipped": 跳过文件数, "bytes": 解压字节数, "seconds": 耗时}
+    """
+    start = time.time()
+    for target_dir in {os.path.dirname(target) for _, target in entries}:
+        os.makedirs(target_dir, exist_ok=True)
+    local = threading.local()
+    handles = []
+    lock = threading.Lock()
+    stats = {"files": 0, "skipped": 0, "bytes": 0}
+
+    def extract(entry):
+        name, target = entry
+        z = getattr(local, "z", None)
+        if z is None:
+            z = local.z = zipfile.ZipFile(zip_file, "r")
+            with lock:
+                handles.append(z)
+        info = z.getinfo(name)
+        if skip_existing and _is_extracted(info, target):
+            with lock:
+                stats["skipped"] += 1
+        else:
+            tmp_file = target + ".part"
+            with z.open(info) as src, open(tmp_file, "wb") as dst:
+                shutil.copyfileobj(src, dst, buffer_size)
+            mtime = _entry_mtime(info)
+            os.utime(tmp_file, (mtime, mtime))
+            os.replace(tmp_file, target)
+            with lock:
+                stats["files"] += 1
+                stats["bytes"] += info.file_size
+            logging.info(f"解压: {name} -> {target}")
+        if on_done is not None:
+            on_done(name, target)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="extract") as executor:
+            # 大文件优先，避免最后只剩一个大文件串行解压
+            sizes = {}
+            with zipfile.ZipFile(zip_file, "r") as z:
+                for name, _ in entries:
+                    sizes[name] = z.getinfo(name).file_size
+            list(executor.map(extract, sorted(entries, key=lambda entry: -sizes[entry[0]])))
+    finally:
+        for z in handles:
+            z.close()
+    stats["seconds"] = round(time.time() - start, 3)
+    return stats
+
+
+def extract_pod(zip_file, base_dir, link_dir=None, workers=DEFAULT_EXTRACT_WORKERS, buffer_size=EXTRACT_BUFFER_SIZE):
+    """
+    流式恢复 pod.zip：先读取配置，再把模型直接解压到 base_dir/models 下的最终位置，
+    解压完成的模型同时软连接到 link_dir（应用的模型目录）下的同一相对路径，不需要再遍历一次目录
+    :return: (PodConfig, 统计信息)，统计信息中 mb_per_second 为解压吞吐量
+    """
+    with zipfile.ZipFile(zip_file, "r") as z:
+        config_data = z.read(POD_CONFIG_NAME)
+        names = [info.filename for info in z.infolist() if not info.is_dir()]
+    pod_config = PodConfig(**json.loads(config_data))
+    entries = [(name, os.path.join(base_dir, name)) for name in names if name.startswith(MODEL_PREFIX)]
+
+    def link_model(name, target):
+        link_file(target, os.path.join(link_dir, name[len(MODEL_PREFIX):]))
+
+    stats = extract_entries(zip_file, entries, workers, buffer_size, link_model if link_dir is not None else None)
+    # 其他文件（配置等）体积很小，最后写入配置文件，中途失败时重新执行会再次解压
+    with zipfile.ZipFile(zip_file, "r") as z:
+        for name in names:
+            if not name.startswith(MODEL_PREFIX) and name != POD_CONFIG_NAME:
+                z.extract(name, base_dir)
+    with open(os.path.join(base_dir, POD_CONFIG_NAME), "wb") as f:
+        f.write(config_data)
+    stats["mb_per_second"] = round(stats["bytes"] / 1024 / 1024 / max(stats["seconds"], 0.001), 1)
+    return pod_config, stats
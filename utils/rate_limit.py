@@ -0,0 +1,35 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    令牌桶限速器，线程安全
+    acquire 允许一次取出超过桶容量的令牌（记为欠账），后续调用需等待欠账还清，
+    因此既可用于请求数限速（每次 1 个令牌），也可用于带宽限速（每次取字节数）
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: 每秒补充的令牌数，<= 0 表示不限速
+        :param capacity: 桶容量（允许的突发量），默认等于 rate
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """取出令牌，令牌不足时阻塞等待，返回等待的秒数"""
+        if self.rate <= 0:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
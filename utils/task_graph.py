@@ -0,0 +1,142 @@
+import json
+import logging
+import threading
+import time
+
+# 任务状态
+TASK_PENDING = "pending"
+TASK_OK = "ok"
+TASK_FAILED = "failed"
+TASK_SKIPPED = "skipped"  # 依赖的任务失败，未执行
+
+
+class _Task:
+    def __init__(self, name, func, deps, resources):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.resources = sorted(resources)
+        self.status = TASK_PENDING
+        self.result = None
+        self.error = None
+        self.start = None
+        self.end = None
+        self.done = threading.Event()
+
+
+class TaskGraph:
+    """
+    按依赖关系并行执行的任务图（DAG）
+    每个任务在依赖全部成功后立即开始，同时受所需资源（network/disk/cpu 等）的并发上限约束；
+    任务失败时依赖它的任务被跳过，其他分支继续执行。run() 返回记录每个任务起止时间的时间线
+    """
+
+    def __init__(self, resources=None):
+        """
+        :param resources: 各资源的并发上限，如 {"network": 3, "disk": 2, "cpu": 4}
+        """
+        self._semaphores = {name: threading.BoundedSemaphore(max(1, limit)) for name, limit in (resources or {}).items()}
+        self._limits = dict(resources or {})
+        self._tasks = {}
+
+    def add(self, name, func, deps=(), resources=()):
+        """
+        添加任务
+        :param func: 无参数的任务函数，返回值可通过 result(name) 获取
+        :param deps: 依赖的任务名称（必须已添加，保证无环）
+        :param resources: 执行期间占用的资源名称
+        """
+        if name in self._tasks:
+            raise ValueError(f"任务已存在: {name}")
+        for dep in deps:
+            if dep not in self._tasks:
+                raise ValueError(f"任务 {name} 依赖的任务不存在: {dep}")
+        for resource in resources:
+            if resource not in self._semaphores:
+                raise ValueError(f"任务 {name} 使用的资源未定义: {resource}")
+        self._tasks[name] = _Task(name, func, deps, resources)
+        return name
+
+    def result(self, name):
+        return self._tasks[name].result
+
+    def errors(self):
+        return {task.name: task.error for task in self._tasks.values() if task.error is not None}
+
+    def _run_task(self, task, origin):
+        try:
+            for dep in task.deps:
+                self._tasks[dep].done.wait()
+            if any(self._tasks[dep].status != TASK_OK for dep in task.deps):
+                task.status = TASK_SKIPPED
+                logging.warning(f"依赖的任务未成功，跳过任务: {task.name}")
+                return
+            acquired = []
+            try:
+                # 按名称顺序获取资源，避免死锁
+                for resource in task.resources:
+                    self._semaphores[resource].acquire()
+                    acquired.append(resource)
+                task.start = time.monotonic() - origin
+                logging.info(f"任务开始: {task.name}")
+                task.result = task.func()
+                task.status = TASK_OK
+            except Exception as e:
+                logging.exception(f"任务失败: {task.name}")
+                task.status = TASK_FAILED
+                task.error = e
+            finally:
+                task.end = time.monotonic() - origin
+                for resource in acquired:
+                    self._semaphores[resource].release()
+                logging.info(f"任务结束: {task.name} {task.status}")
+        finally:
+            task.done.set()
+
+    def critical_path(self):
+        """关键路径：从最后结束的任务开始，沿最晚结束的依赖向前回溯"""
+        finished = [task for task in self._tasks.values() if task.end is not None]
+        if not finished:
+            return []
+        task = max(finished, key=lambda t: t.end)
+        path = [task.name]
+        while task.deps:
+            task = max((self._tasks[dep] for dep in task.deps), key=lambda t: t.end or 0)
+            path.append(task.name)
+        return list(reversed(path))
+
+    def run(self):
+        """执行全部任务并等待结束，返回时间线"""
+        origin = time.monotonic()
+        threads = [threading.Thread(target=self._run_task, args=(task, origin), name=f"task-{task.name}", daemon=True)
+                   for task in self._tasks.values()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.timeline(time.monotonic() - origin)
+
+    def timeline(self, seconds=None):
+        tasks = []
+        for task in self._tasks.values():
+            tasks.append({
+                "name": task.name,
+                "deps": task.deps,
+                "resources": task.resources,
+                "status": task.status,
+                "start": None if task.start is None else round(task.start, 3),
+                "end": None if task.end is None else round(task.end, 3),
+                "seconds": None if task.start is None else round(task.end - task.start, 3),
+                "error": None if task.error is None else str(task.error),
+            })
+        return {
+            "seconds": None if seconds is None else round(seconds, 3),
+            "resources": self._limits,
+            "critical_path": self.critical_path(),
+            "tasks": tasks,
+        }
+
+
+def write_timeline(file_path, timeline):
+    with open(file_path, "w") as f:
+        json.dump(timeline, f, ensure_ascii=False, indent=2)
@@ -1,19 +1,22 @@
 import hashlib
+import json
 import logging
 import os
 import platform
 import shutil
 import subprocess
 import sys
-import time
 
 from huggingface_hub import HfApi
 import requests
 import re
 import urllib.request
-from urllib.parse import urlparse, parse_qs, unquote
+from urllib.parse import urlparse
 
 from const.app_config import HUGGINGFACE_TOKEN, USER_AGENT, CIVIAI_API_KEY, POD_MANAGER_URL
+from utils.bloom import BloomFilter
+from utils.civitai import get_civitai_resolver
+from utils.downloader import get_downloader
 
 logging.basicConfig(filename='app.log',
                     level=logging.INFO,
@@ -21,43 +24,115 @@ logging.basicConfig(filename='app.log',
 
 """查询 civitai 模型"""
 def civitai_query_model(sha256):
-    url = f"https://civitai.com/api/v1/model-versions/by-hash/{sha256}"
-    logging.info(f"请求 civitai 模型: {url}")
+    # 使用共享查询器（连接池、限速、429/5xx 退避重试）
+    return get_civitai_resolver().resolve(sha256)
+
+# 晨羽缓存查询结果在 LookupCache 中的命名空间
+MANAGER_LOOKUP_NAMESPACE = "manager"
+
+# 晨羽缓存模型过滤器，每个进程只下载一次；False 表示下载失败，不再重试
+_model_filter = None
+
+def get_model_filter():
+    """下载晨羽缓存已缓存模型的布隆过滤器，失败时返回 None（此时所有查询照常发出）"""
+    global _model_filter
+    if _model_filter is None:
+        query_url = f"{POD_MANAGER_URL}/filters/models"
+        try:
+            response = requests.get(query_url, timeout=30)
+            response.raise_for_status()
+            _model_filter = BloomFilter.from_bytes(response.content)
+            logging.info(f"模型过滤器版本: {response.headers.get('X-Filter-Version')}, 模型数量: {_model_filter.count}")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logging.error(f"模型过滤器下载失败: {e}")
+            _model_filter = False
+    return _model_filter or None
+
+def maybe_cached(sha256):
+    """过滤器判断模型可能在晨羽缓存中（可能误判为存在，但不会漏判）"""
+    model_filter = get_model_filter()
+    if model_filter is None:
+        return True
     try:
-        # 发出 GET 请求
-        response = requests.get(url)
-        response.raise_for_status()  # 如果响应状态码不是 200，抛出异常
-
-        # 解析 JSON 响应
-        data = response.json()
-
-        # 提取 modelId 和 downloadUrl
-        model_id = data.get('modelId')
-        download_url = data.get('downloadUrl')
-        logging.info(f"模型 ID: {model_id}, 下载地址: {download_url}")
-        return model_id, download_url
-    except requests.exceptions.RequestException as e:
-        logging.error(f"请求失败: {e}")
-        return None, None
+        return sha256 in model_filter
+    except ValueError:
+        return True
 
 """判断是否在晨羽缓存数据"""
-def query_cache_path(sha256):
+def query_cache_path(sha256, lookup_cache=None, use_filter=False):
+    if use_filter and not maybe_cached(sha256):
+        return None
+    if lookup_cache is not None:
+        hit, cache_path = lookup_cache.get(MANAGER_LOOKUP_NAMESPACE, sha256)
+        if hit:
+            return cache_path
     query_url = f"{POD_MANAGER_URL}/models/{sha256}"
     logging.info(f"请求缓存数据: {query_url}")
     try:
         # 发出 GET 请求
         response = requests.get(query_url)
-        response.raise_for_status()  # 如果响应状态码不是 200，抛出异常
-        # 解析 JSON 响应
-        data = response.json()
-
-        # 提取缓存路径
-        cache_path = data.get('cache_path')
+        if response.status_code == 404:
+            cache_path = None
+        else:
+            response.raise_for_status()  # 如果响应状态码不是 200，抛出异常
+            # 解析 JSON 响应，提取缓存路径
+            cache_path = response.json().get('cache_path')
         logging.info(f"缓存路径: {cache_path}")
-        return cache_path
     except requests.exceptions.RequestException as e:
         logging.error(f"请求失败: {e}")
         return None
+    if lookup_cache is not None:
+        lookup_cache.put(MANAGER_LOOKUP_NAMESPACE, sha256, cache_path, positive=cache_path is not None)
+    return cache_path
+
+# 批量接口每次请求的条数（服务端上限 1000）
+MANAGER_BATCH_SIZE = 200
+
+def query_cache_paths(sha256_list, batch_size=MANAGER_BATCH_SIZE, lookup_cache=None, use_filter=False):
+    """
+    批量查询晨羽缓存，返回 {sha256: cache_path}，不存在的 sha256 不出现在结果中
+    :param use_filter: 先用模型过滤器跳过一定不存在的 sha256，只用于客户端扫描；
+                       过滤器可能落后于其他实例刚完成的下载，云端恢复等不能接受漏判的场景不使用
+    """
+    query_url = f"{POD_MANAGER_URL}/models/lookup"
+    cache_paths = {}
+    pending = []
+    for sha256 in sha256_list:
+        hit, cache_path = lookup_cache.get(MANAGER_LOOKUP_NAMESPACE, sha256) if lookup_cache is not None else (False, None)
+        if not hit:
+            if not use_filter or maybe_cached(sha256):
+                pending.append(sha256)
+        elif cache_path is not None:
+            cache_paths[sha256] = cache_path
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        logging.info(f"批量请求缓存数据: {query_url}, 数量: {len(chunk)}")
+        try:
+            response = requests.post(query_url, json={"sha256": chunk})
+            response.raise_for_status()
+            found = {sha256: model.get('cache_path') for sha256, model in response.json().get('models', {}).items()}
+        except requests.exceptions.RequestException as e:
+            logging.error(f"请求失败: {e}")
+            continue
+        cache_paths.update({sha256: cache_path for sha256, cache_path in found.items() if cache_path is not None})
+        if lookup_cache is not None:
+            lookup_cache.put_many(MANAGER_LOOKUP_NAMESPACE,
+                                  [(sha256, found.get(sha256), found.get(sha256) is not None) for sha256 in chunk])
+    return cache_paths
+
+def add_models_batch(sha256_list, batch_size=MANAGER_BATCH_SIZE):
+    """批量添加 C站模型到晨羽缓存"""
+    url = f"{POD_MANAGER_URL}/models/batch"
+    for start in range(0, len(sha256_list), batch_size):
+        chunk = sha256_list[start:start + batch_size]
+        logging.info(f"批量添加模型: {url}, 数量: {len(chunk)}")
+        try:
+            response = requests.post(url, json={"models": [{"name": sha256, "model_type": "0"} for sha256 in chunk]})
+            response.raise_for_status()
+            for failed in response.json().get("failed", []):
+                logging.error(f"添加模型失败: {failed['model']}: {failed['error']}")
+        except requests.exceptions.RequestException as e:
+            logging.error(f"请求失败: {e}")
 
 def add_models(sha256):
     url = f"{POD_MANAGER_URL}/models"
@@ -85,8 +160,8 @@ def get_git_repo_info(repo_path):
         # 获取 Git 地址
         remote_url = subprocess.check_output(["git", "remote", "get-url", "origin"], text=True,startupinfo=startupinfo).strip()
 
-        # 获取当前 commit log
-        commit_log = subprocess.check_output(["git", "log", "-1", "--format=%h"], text=True,startupinfo=startupinfo).strip()
+        # 获取当前 commit（完整 sha，云端可按 sha 浅克隆）
+        commit_log = subprocess.check_output(["git", "log", "-1", "--format=%H"], text=True,startupinfo=startupinfo).strip()
 
         # 提取仓库名称（假设仓库目录名即为仓库名称）
         repo_name = os.path.basename(repo_path)
@@ -98,6 +173,34 @@ def get_git_repo_info(repo_path):
         logging.error(f"Error processing repo {repo_path}: {e}")
         return None, None, None
 
+def read_git_head(repo_path):
+    """直接读取 .git 目录获取当前 commit 的完整 sha（不启动 git 进程），无法解析时返回 None"""
+    git_dir = os.path.join(repo_path, ".git")
+    try:
+        if os.path.isfile(git_dir):
+            # 子模块/工作树: .git 文件内容为 "gitdir: <path>"
+            with open(git_dir, "r") as f:
+                git_dir = os.path.join(repo_path, f.read().strip()[len("gitdir:"):].strip())
+        with open(os.path.join(git_dir, "HEAD"), "r") as f:
+            head = f.read().strip()
+        if not head.startswith("ref:"):
+            return head
+        ref = head[len("ref:"):].strip()
+        ref_file = os.path.join(git_dir, ref)
+        if os.path.exists(ref_file):
+            with open(ref_file, "r") as f:
+                return f.read().strip()
+        packed_refs = os.path.join(git_dir, "packed-refs")
+        if os.path.exists(packed_refs):
+            with open(packed_refs, "r") as f:
+                for line in f:
+                    parts = line.strip().split(" ")
+                    if len(parts) == 2 and parts[1] == ref:
+                        return parts[0]
+    except OSError as e:
+        logging.warning(f"读取 Git HEAD 失败 {repo_path}: {e}")
+    return None
+
 def parse_python_packages(package_str:str):
     try:
         if "==" in package_str:
@@ -158,20 +261,75 @@ def open_file_or_directory(path):
     else:  # Linux 和其他 Unix 系统
         subprocess.run(["xdg-open", path])
 
+HASH_BUFFER_SIZE = 4 * 1024 * 1024
+
 """计算文件的 sha256 哈希值"""
-def calculate_sha256(file_path):
+def calculate_sha256(file_path, buffer_size=HASH_BUFFER_SIZE):
     sha256_hash = hashlib.sha256()
-    # 以二进制模式读取文件，并逐块更新哈希
-    with open(file_path, "rb") as f:
-        # 逐块读取文件，以节省内存（特别是对于大文件）
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
+    # 复用同一块大缓冲区读取文件（hashlib 处理大块数据时会释放 GIL，可多线程并行）
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(file_path, "rb", buffering=0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            sha256_hash.update(view[:size])
 
     # 返回十六进制形式的哈希值
     return sha256_hash.hexdigest()
 
-# 克隆仓库并切换到指定提交
-def clone_and_checkout(repo_url: str, commit_log: str, output_dir: str):
+def _git(*args):
+    subprocess.run(['git', *args], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+def _update_submodules(clone_path: str, repo_url: str):
+    try:
+        _git('-C', clone_path, 'submodule', 'update', '-q', '--init', '--recursive', '--depth', '1')
+    except subprocess.CalledProcessError:
+        logging.warning(f"子模块浅拉取失败，回退为完整拉取: {repo_url}")
+        _git('-C', clone_path, 'submodule', 'update', '-q', '--init', '--recursive')
+
+def fetch_commit(repo_url: str, commit_log: str, clone_path: str, mirror_cache=None):
+    """
+    把仓库的指定提交检出到 clone_path
+    有本地镜像缓存时从镜像克隆（镜像缺少该提交才访问远端）；
+    否则只拉取该提交（depth=1，子模块同样浅拉取），服务端不支持按 sha 拉取或 commit_log 不是完整 sha 时回退为完整拉取
+    :return: 实际使用的方式 "exists" / "mirror" / "shallow" / "full"，失败抛出 subprocess.CalledProcessError
+    """
+    if os.path.isdir(clone_path):
+        head = read_git_head(clone_path)
+        if head is not None and head.startswith(commit_log):
+            return "exists"
+        shutil.rmtree(clone_path)
+    if mirror_cache is not None:
+        try:
+            mirror_path = mirror_cache.ensure(repo_url, commit_log)
+            _git('clone', '-q', '--no-checkout', mirror_path, clone_path)
+            _git('-C', clone_path, 'remote', 'set-url', 'origin', repo_url)
+            _git('-C', clone_path, 'checkout', '-q', commit_log)
+            _update_submodules(clone_path, repo_url)
+            return "mirror"
+        except (subprocess.CalledProcessError, OSError) as e:
+            logging.warning(f"从镜像克隆失败，直接从远端拉取: {repo_url}: {getattr(e, 'stderr', None) or e}")
+            shutil.rmtree(clone_path, ignore_errors=True)
+    os.makedirs(clone_path)
+    _git('init', '-q', clone_path)
+    _git('-C', clone_path, 'remote', 'add', 'origin', repo_url)
+    if len(commit_log) == 40:
+        try:
+            _git('-C', clone_path, 'fetch', '-q', '--depth', '1', 'origin', commit_log)
+            _git('-C', clone_path, 'checkout', '-q', 'FETCH_HEAD')
+            _update_submodules(clone_path, repo_url)
+            return "shallow"
+        except subprocess.CalledProcessError as e:
+            logging.warning(f"按提交浅拉取失败，回退为完整拉取: {repo_url} {commit_log}: {e.stderr}")
+    _git('-C', clone_path, 'fetch', '-q', '--tags', 'origin', '+refs/heads/*:refs/remotes/origin/*')
+    _git('-C', clone_path, 'checkout', '-q', commit_log)
+    _git('-C', clone_path, 'submodule', 'update', '-q', '--init', '--recursive')
+    return "full"
+
+# 克隆仓库并切换到指定提交，mirror_cache 为可选的 GitMirrorCache
+def clone_and_checkout(repo_url: str, commit_log: str, output_dir: str, mirror_cache=None):
     # 如果没有提供输出目录，默认为当前目录
     if output_dir is None:
         output_dir = os.getcwd()
@@ -180,19 +338,14 @@ def clone_and_checkout(repo_url: str, commit_log: str, output_dir: str):
     repo_name = os.path.basename(repo_url).replace('.git', '')
     clone_path = os.path.join(output_dir, repo_name)
 
-    # 1. 克隆仓库
     try:
-        logging.info(f"克隆仓库 {repo_url} 到 {clone_path}...")
-        subprocess.run(['git', 'clone','--recursive', repo_url, clone_path], check=True)
-
-        # 2. 进入仓库目录并切换到指定提交
-        logging.info(f"克隆仓库成功，切换到提交 {commit_log}...")
-        subprocess.run(['git', '-C', clone_path, 'checkout', commit_log], check=True)
-
-        logging.info(f"切换到提交 {commit_log} 成功")
-
+        logging.info(f"克隆仓库 {repo_url} 到 {clone_path}，提交 {commit_log}...")
+        mode = fetch_commit(repo_url, commit_log, clone_path, mirror_cache)
+        logging.info(f"切换到提交 {commit_log} 成功（{mode}）")
+        return mode
     except subprocess.CalledProcessError as e:
-        logging.error(f"错误: {e}")
+        logging.error(f"错误: {e} {e.stderr}")
+        raise
 
 def get_domain_from_url(url):
     parsed_url = urlparse(url)
@@ -204,73 +357,37 @@ class NoRedirection(urllib.request.HTTPErrorProcessor):
         return response
     https_response = http_response
 
-def download_file(url: str, output_path: str):
+def download_file(url: str, output_path: str, progress=None, expected_sha256=None, cancelled=None):
+    """
+    下载文件（多连接分段下载，支持断点续传，见 utils.downloader）
+    :param expected_sha256: 可选，下载时同时校验 sha256，一致才生成 output_path，否则抛出 HashMismatch
+    :param cancelled: 可选回调，返回 True 时中止下载并抛出 DownloadCancelled
+    :return: (真实文件名, 文件大小)
+    """
     logging.info(f"下载文件: {url} 到 {output_path}")
-    path_dir = os.path.dirname(output_path)
-    file_name = os.path.basename(output_path)
-    os.makedirs(path_dir, exist_ok=True)  # 创建目录（如果不存在的话）
     dest_url = redirect_url(url)
-    parsed_url = urlparse(dest_url)
-    query_params = parse_qs(parsed_url.query)
-    content_disposition = query_params.get('response-content-disposition', [None])[0]
-    true_file_name = unquote(content_disposition.split('filename=')[1].strip('"'))
-    response = urllib.request.urlopen(dest_url)
-    total_size = response.getheader('Content-Length')
-    total_size = int(total_size) if total_size is not None else None
-    output_file = os.path.join(path_dir, file_name)
-    logging.info(f"文件实际下载地址: {dest_url}, 文件名: {true_file_name}, 文件大小: {total_size} 字节")
-
-    with open(output_file, 'wb') as f:
-        downloaded = 0
-        start_time = time.time()
-
-        while True:
-            chunk_start_time = time.time()
-            buffer = response.read(1638400)
-            chunk_end_time = time.time()
-            if not buffer:
-                break
-            downloaded += len(buffer)
-            f.write(buffer)
-            chunk_time = chunk_end_time - chunk_start_time
-
-            if chunk_time > 0:
-                speed = len(buffer) / chunk_time / (1024 ** 2)  # Speed in MB/s
-
-            if total_size is not None:
-                progress = downloaded / total_size
-                logging.info(f'\r下载中: {true_file_name} [{progress*100:.2f}%] - {speed:.2f} MB/s')
-    end_time = time.time()
-    time_taken = end_time - start_time
-    hours, remainder = divmod(time_taken, 3600)
-    minutes, seconds = divmod(remainder, 60)
-
-    if hours > 0:
-        time_str = f'{int(hours)}h {int(minutes)}m {int(seconds)}s'
-    elif minutes > 0:
-        time_str = f'{int(minutes)}m {int(seconds)}s'
-    else:
-        time_str = f'{int(seconds)}s'
-
-    sys.stdout.write('\n')
-    logging.info(f'下载完成. 文件路径: {file_name}')
-    logging.info(f'下载耗时 {time_str}')
-    return true_file_name,total_size
-
-
-
-def redirect_url(url: str):
+    headers = {'User-Agent': USER_AGENT}
+    if dest_url is None:
+        # 没有重定向时直接从原地址下载，需要带上认证信息
+        dest_url = url
+        headers = auth_headers(url)
+    return get_downloader().download(dest_url, output_path, headers=headers, progress=progress,
+                                     expected_sha256=expected_sha256, cancelled=cancelled)
+
+def auth_headers(url: str):
     if get_domain_from_url(url) != "huggingface.co":
-        headers = {
+        return {
             'Authorization': f'Bearer {CIVIAI_API_KEY}',
             'User-Agent': USER_AGENT,
         }
-    else:
-        headers = {
-            'Authorization': f'Bearer {HUGGINGFACE_TOKEN}',
-            'User-Agent': USER_AGENT,
-        }
-    request = urllib.request.Request(url, headers=headers)
+    return {
+        'Authorization': f'Bearer {HUGGINGFACE_TOKEN}',
+        'User-Agent': USER_AGENT,
+    }
+
+def redirect_url(url: str):
+    """返回重定向地址，没有重定向时返回 None"""
+    request = urllib.request.Request(url, headers=auth_headers(url))
     opener = urllib.request.build_opener(NoRedirection)
     response = opener.open(request)
     return response.getheader('Location')
@@ -288,22 +405,33 @@ def remove_subdirectories(parent_dir: str):
                 print(f"删除目录 {item_path} 时出错: {e}")
 
 # 获取仓库大文件，lfs文件
-def huggingface_query_lfs(repo_id: str):
+def huggingface_query_lfs(repo_id: str, revision: str = "main", cache_dir=None):
+    """
+    查询仓库中的 LFS 文件，返回 {sha256: 文件路径}
+    递归列出整个目录树（分页接口，每页包含 LFS 信息），不再逐个文件查询
+    :param revision: 分支或提交 sha
+    :param cache_dir: 可选，revision 为完整提交 sha 时按 (仓库, 提交) 缓存结果，同一提交再次查询不访问网络
+    """
+    cache_file = None
+    if cache_dir is not None and re.fullmatch(r"[0-9a-f]{40}", revision):
+        cache_file = os.path.join(cache_dir, repo_id.replace("/", "--"), f"{revision}.json")
+        if os.path.exists(cache_file):
+            with open(cache_file, "r") as f:
+                return json.load(f)
     files = {}
     hf_client = HfApi()
-    repo_files = hf_client.list_repo_files(repo_id=repo_id, revision="main")
-    for file in repo_files:
-        infos = hf_client.get_paths_info(
-            repo_id=repo_id,
-            repo_type="model",
-            revision="main",
-            paths=file,
-        )
-        if len(infos) == 1 and infos[0].lfs is not None:
-            sha256 = infos[0].lfs.sha256
-            path = infos[0].path
-            files[sha256] = path
-    return  files
+    for item in hf_client.list_repo_tree(repo_id=repo_id, repo_type="model", revision=revision, recursive=True):
+        lfs = getattr(item, "lfs", None)
+        if lfs is not None:
+            files[lfs.sha256] = item.path
+    logging.info(f"仓库 {repo_id}@{revision} LFS 文件数: {len(files)}")
+    if cache_file is not None:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = f"{cache_file}.tmp-{os.getpid()}"
+        with open(tmp_file, "w") as f:
+            json.dump(files, f)
+        os.replace(tmp_file, cache_file)
+    return files
 
 # 获取仓库的基本信息
 def huggingface_repo_info(repo_id: str):